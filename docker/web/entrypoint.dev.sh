@@ -46,7 +46,6 @@ if [ -n "${RUN_INITIAL_SEED:-}" ]; then
   python manage.py sync_taxonomy_tags || true
   python manage.py seed_initial_data || true
   python manage.py import_lab_indicators_csv /app/data/labtests-database.csv || true
-  python manage.py optimize_indexes || true
   python manage.py backfill_event_tags || true
 fi
 
@@ -75,6 +75,26 @@ DATABASES = {
     },
 }
 
+# "default" holds per-process copies of rendered fragments. "shared" holds
+# what every worker process has to agree on: record/profile/share version
+# counters, rate-limit windows and export job state. Anything beyond a single
+# runserver process needs a real shared backend: set REDIS_URL, or
+# DJANGO_CACHE_TABLE and run ``python manage.py createcachetable``.
+if os.environ.get("REDIS_URL"):
+    SHARED_CACHE = {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": os.environ["REDIS_URL"]}
+elif os.environ.get("DJANGO_CACHE_TABLE"):
+    SHARED_CACHE = {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": os.environ["DJANGO_CACHE_TABLE"]}
+else:
+    SHARED_CACHE = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "medj-shared"}
+
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "medj-local"},
+    "shared": SHARED_CACHE,
+}
+RECORD_VERSION_CACHE = "shared"
+RATE_LIMIT_CACHE = "shared"
+EXPORT_JOB_CACHE = "shared"
+
 AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"},
     {"NAME": "django.contrib.auth.password_validation.MinimumLengthValidator"},
@@ -3,7 +3,7 @@ from .models import (
     PatientProfile, MedicalCategory, MedicalSpecialty, DocumentType,
     Tag, MedicalEvent, EventTag, Document, DocumentTag,
     Diagnosis, NarrativeNote, Medication,
-    LabIndicator, LabIndicatorAlias, LabTestMeasurement,
+    LabIndicator, LabIndicatorAlias, LabTestMeasurement, LabSeries, DocumentFacetCount,
     ShareLink, OcrLog, Practitioner, DocumentPractitioner
 )
 
@@ -87,6 +87,18 @@ class LabTestMeasurementAdmin(admin.ModelAdmin):
     list_display = ("medical_event", "indicator", "value", "measured_at")
     list_filter = ("indicator", "measured_at")
 
+@admin.register(LabSeries)
+class LabSeriesAdmin(admin.ModelAdmin):
+    list_display = ("patient", "indicator", "count", "last_measured_at", "updated_at")
+    search_fields = ("patient__user__username", "indicator__slug")
+    readonly_fields = ("timestamps", "values", "count", "first_measured_at", "last_measured_at", "updated_at")
+
+@admin.register(DocumentFacetCount)
+class DocumentFacetCountAdmin(admin.ModelAdmin):
+    list_display = ("owner", "facet", "key", "count")
+    list_filter = ("facet",)
+    search_fields = ("owner__username", "key")
+
 @admin.register(ShareLink)
 class ShareLinkAdmin(admin.ModelAdmin):
     list_display = ("token", "owner", "object_type", "object_id", "format", "status", "expires_at", "created_at")
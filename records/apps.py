@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
 from django.db.models.signals import post_migrate
 
 class RecordsConfig(AppConfig):
@@ -6,6 +7,8 @@ class RecordsConfig(AppConfig):
     name = "records"
 
     def ready(self):
-        from . import signals
+        from . import checks, signals
         from .signals import post_migrate_sync
+        from .management.services.share_lifecycle import start_scheduler
         post_migrate.connect(post_migrate_sync, sender=self, weak=False)
+        request_started.connect(start_scheduler, weak=False, dispatch_uid="records.share_sweeper")
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+PER_PROCESS_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register()
+def shared_cache_check(app_configs, **kwargs):
+    """Warn when version counters would live in a per-process cache outside DEBUG."""
+
+    if settings.DEBUG:
+        return []
+    alias = getattr(settings, "RECORD_VERSION_CACHE", "default")
+    backend = settings.CACHES.get(alias, {}).get("BACKEND", "")
+    if backend not in PER_PROCESS_BACKENDS:
+        return []
+    return [
+        Warning(
+            f"The {alias!r} cache ({backend}) is private to each process.",
+            hint="Set REDIS_URL, or DJANGO_CACHE_TABLE and run createcachetable, so every worker sees record version bumps.",
+            id="records.W001",
+        )
+    ]
@@ -1,17 +1,23 @@
 from __future__ import annotations
 
-import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
+from records.management.services.backfill import Checkpoint, Progress, iter_chunks
+from records.management.services.record_versions import bump_record_versions
+from records.management.services.search import index_document, indexed_documents
 from records.models import Document
-from records.utils.analysis import (
-    compose_analysis_text,
-    normalize_analysis_payload,
-    render_analysis_tables,
-    word_count,
-)
+from records.utils.analysis import rebuild_analysis_fields
+
+FIELDS = ("summary", "analysis_html", "analysis_text")
+
+
+def _rebuild(row):
+    pk, notes, summary = row
+    return pk, rebuild_analysis_fields(notes, summary)
 
 
 class Command(BaseCommand):
@@ -25,64 +31,76 @@ class Command(BaseCommand):
             default=None,
             help="Optional cap on the number of documents to process.",
         )
+        parser.add_argument("--batch-size", type=int, default=500, help="Documents per chunk (default: 500).")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Processes rendering the analysis; 0 renders in this process.",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the saved checkpoint and start from the first document.",
+        )
+        parser.add_argument("--checkpoint", default=None, help="Checkpoint file path (default: BACKFILL_CHECKPOINT_DIR).")
 
     def handle(self, *args, **options):
         dry_run: bool = options.get("dry_run", False)
         limit: int | None = options.get("limit")
-        updated = 0
-        processed = 0
+        batch_size = max(1, int(options.get("batch_size") or 500))
+        workers = max(0, int(options.get("workers") or 0))
+        verbose = dry_run or int(options.get("verbosity", 1)) > 1
 
-        qs = Document.objects.all().order_by("id")
-        if limit is not None:
-            if limit <= 0:
-                qs = qs.none()
-            else:
-                qs = qs[:limit]
+        checkpoint = Checkpoint("document_analysis", options.get("checkpoint"))
+        if options.get("restart"):
+            checkpoint.clear()
+        start_id = checkpoint.load()
+        if start_id:
+            self.stdout.write(f"Resuming after document {start_id}.")
 
-        for doc in qs.iterator():
-            processed += 1
-            payload = {}
-            raw_notes = getattr(doc, "notes", None)
-            if isinstance(raw_notes, dict):
-                payload = raw_notes
-            elif isinstance(raw_notes, str) and raw_notes.strip():
-                try:
-                    payload = json.loads(raw_notes)
-                except Exception:
-                    payload = {}
-            analysis_payload = normalize_analysis_payload(payload.get("analysis"))
-            if not analysis_payload:
-                continue
-            summary = (analysis_payload.get("summary") or doc.summary or "").strip()
-            if summary:
-                analysis_payload["summary"] = summary
-                analysis_payload["summary_word_count"] = word_count(summary)
-            html = render_analysis_tables(analysis_payload)
-            text = compose_analysis_text(analysis_payload, summary)
-            has_changes = False
-            update_fields: list[str] = []
-            if html and html != (doc.analysis_html or ""):
-                has_changes = True
-                if not dry_run:
-                    doc.analysis_html = html
-                    update_fields.append("analysis_html")
-            if text and text != (doc.analysis_text or ""):
-                has_changes = True
-                if not dry_run:
-                    doc.analysis_text = text
-                    update_fields.append("analysis_text")
-            if summary and summary != (doc.summary or ""):
-                has_changes = True
+        # Only rows whose notes can hold an analysis payload are read at all.
+        qs = Document.objects.filter(notes__contains='"analysis"').only("id", "owner_id", "notes", *FIELDS)
+        progress = Progress(qs, self.stdout.write, start_id=start_id, label="documents")
+        updated = 0
+
+        pool = ProcessPoolExecutor(max_workers=workers) if workers else None
+        try:
+            for chunk in iter_chunks(qs, after_id=start_id, chunk_size=batch_size, limit=limit):
+                rows = [(doc.pk, doc.notes, doc.summary) for doc in chunk]
+                results = pool.map(_rebuild, rows, chunksize=32) if pool else map(_rebuild, rows)
+                docs = {doc.pk: doc for doc in chunk}
+                changed, fields = [], set()
+                for pk, values in results:
+                    doc = docs[pk]
+                    update_fields = [name for name, value in values.items() if value != (getattr(doc, name) or "")]
+                    if not update_fields:
+                        continue
+                    for name in update_fields:
+                        setattr(doc, name, values[name])
+                    changed.append(doc)
+                    fields.update(update_fields)
+                    if verbose:
+                        self.stdout.write(f"Document #{doc.id} will be updated ({', '.join(update_fields)})")
+                updated += len(changed)
                 if not dry_run:
-                    doc.summary = summary
-                    update_fields.append("summary")
-            if has_changes:
-                updated += 1
-                self.stdout.write(f"Document #{doc.id} will be updated ({', '.join(update_fields) or 'no fields'})")
-                if not dry_run and update_fields:
-                    with transaction.atomic():
-                        doc.save(update_fields=update_fields)
+                    if changed:
+                        with transaction.atomic():
+                            Document.objects.bulk_update(changed, [name for name in FIELDS if name in fields])
+                        # bulk_update skips the Document signals; redo their work for this chunk.
+                        for document in indexed_documents().filter(pk__in=[doc.pk for doc in changed]):
+                            index_document(document)
+                        bump_record_versions(doc.owner_id for doc in changed)
+                    checkpoint.save(chunk[-1].pk, updated=updated)
+                progress.advance(len(chunk), chunk[-1].pk)
+        finally:
+            if pool:
+                pool.shutdown()
+
+        rate = f"{progress.processed} documents in {progress.elapsed:.1f}s ({progress.rate:.1f} docs/s)"
         if dry_run:
-            self.stdout.write(self.style.WARNING(f"Dry run completed. {updated} documents require updates."))
+            self.stdout.write(self.style.WARNING(f"Dry run completed. {updated} documents require updates ({rate})."))
         else:
-            self.stdout.write(self.style.SUCCESS(f"Backfill complete. Updated {updated} documents (processed {processed})."))
+            if limit is None:
+                checkpoint.clear()
+            self.stdout.write(self.style.SUCCESS(f"Backfill complete. Updated {updated} documents (processed {rate})."))
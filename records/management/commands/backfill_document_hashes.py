@@ -1,10 +1,28 @@
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
 from django.core.management.base import BaseCommand
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.db.models import Q
+from records.management.services.backfill import Checkpoint, Progress, iter_chunks
 from records.models import Document
 
 
+def _hash_document(doc):
+    """Return ``(doc, digest, error)``; runs on a worker thread."""
+
+    if not doc.file:
+        return doc, None, "no file"
+    hasher = hashlib.sha256()
+    try:
+        with doc.file.storage.open(doc.file.name, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                hasher.update(chunk)
+    except Exception as exc:
+        return doc, None, str(exc) or exc.__class__.__name__
+    return doc, hasher.hexdigest(), None
+
+
 class Command(BaseCommand):
     help = "Compute and backfill SHA-256 content hashes for existing documents."
 
@@ -13,84 +31,119 @@ class Command(BaseCommand):
             "--batch-size",
             type=int,
             default=200,
-            help="Number of documents to iterate per database batch (default: 200).",
+            help="Number of documents to hash and write per batch (default: 200).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Threads used to read and hash files (default: 8).",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the saved checkpoint and start from the first document.",
         )
+        parser.add_argument("--checkpoint", default=None, help="Checkpoint file path (default: BACKFILL_CHECKPOINT_DIR).")
 
     def handle(self, *args, **options):
         batch_size = max(1, int(options.get("batch_size") or 200))
-        qs = (
-            Document.objects.filter(Q(content_hash__isnull=True) | Q(content_hash=""))
-            .select_related("owner")
-            .order_by("id")
+        workers = max(1, int(options.get("workers") or 1))
+        checkpoint = Checkpoint("document_hashes", options.get("checkpoint"))
+        if options.get("restart"):
+            checkpoint.clear()
+        start_id = checkpoint.load()
+        if start_id:
+            self.stdout.write(f"Resuming after document {start_id}.")
+
+        qs = Document.objects.filter(Q(content_hash__isnull=True) | Q(content_hash="")).only(
+            "id", "owner_id", "file", "content_hash", "sha256"
         )
-        total = qs.count()
-        if not total:
-            self.stdout.write(self.style.SUCCESS("All documents already have a content hash."))
-            return
+        progress = Progress(Document.objects.all(), self.stdout.write, start_id=start_id, label="documents")
 
-        processed = 0
         updated = 0
         skipped = 0
         duplicates = 0
 
-        for doc in qs.iterator(chunk_size=batch_size):
-            processed += 1
-            file_field = doc.file
-            if not file_field:
-                skipped += 1
-                continue
-
-            try:
-                file_field.open("rb")
-            except Exception as exc:
-                skipped += 1
-                self.stderr.write(f"Failed to open file for document {doc.id}: {exc}")
-                continue
-
-            hasher = hashlib.sha256()
-            try:
-                for chunk in file_field.chunks():
-                    hasher.update(chunk)
-            finally:
-                try:
-                    file_field.close()
-                except Exception:
-                    pass
-
-            digest = hasher.hexdigest()
-            if not digest:
-                skipped += 1
-                continue
-
-            if doc.content_hash == digest and doc.sha256 == digest:
-                continue
-
-            doc.content_hash = digest
-            if not doc.sha256:
-                doc.sha256 = digest
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for chunk in iter_chunks(qs, after_id=start_id, chunk_size=batch_size):
+                hashed = []
+                for doc, digest, error in pool.map(_hash_document, chunk):
+                    if error:
+                        skipped += 1
+                        if error != "no file":
+                            self.stderr.write(f"Failed to hash document {doc.id}: {error}")
+                        continue
+                    hashed.append((doc, digest))
 
-            try:
-                doc.save(update_fields=["content_hash", "sha256"])
-                updated += 1
-            except IntegrityError:
-                dup = (
-                    Document.objects.filter(owner=doc.owner, content_hash=digest)
-                    .exclude(pk=doc.pk)
-                    .first()
-                )
-                if dup:
-                    duplicates += 1
+                to_update, dupes = self._without_duplicates(hashed)
+                duplicates += len(dupes)
+                for doc, dup_id in dupes:
                     self.stderr.write(
-                        f"Duplicate detected for owner {doc.owner_id}: doc {doc.pk} duplicates {dup.pk}"
+                        f"Duplicate detected for owner {doc.owner_id}: doc {doc.pk} duplicates {dup_id}"
                     )
-                    continue
-                raise
+                updated += self._write(to_update)
 
+                last_id = chunk[-1].pk
+                checkpoint.save(last_id, updated=updated, skipped=skipped, duplicates=duplicates)
+                progress.advance(len(chunk), last_id)
+
+        checkpoint.clear()
         summary = (
-            f"Processed {processed} of {total} documents. Updated: {updated}. "
-            f"Skipped: {skipped}. Duplicates: {duplicates}."
+            f"Processed {progress.processed} documents in {progress.elapsed:.1f}s "
+            f"({progress.rate:.1f}/s). Updated: {updated}. Skipped: {skipped}. Duplicates: {duplicates}."
         )
         if updated:
             self.stdout.write(self.style.SUCCESS(summary))
         else:
             self.stdout.write(summary)
+
+    def _without_duplicates(self, hashed):
+        """Split hashed docs into writable ones and ``(doc, duplicate_id)`` pairs.
+
+        A digest may already belong to another document of the same owner,
+        either in the database or earlier in the same chunk; those would
+        violate the ``(owner, content_hash)`` constraint.
+        """
+
+        if not hashed:
+            return [], []
+        existing = {
+            (owner_id, digest): pk
+            for pk, owner_id, digest in Document.objects.filter(
+                owner_id__in={doc.owner_id for doc, _ in hashed},
+                content_hash__in={digest for _, digest in hashed},
+            ).values_list("pk", "owner_id", "content_hash")
+        }
+        writable, dupes = [], []
+        for doc, digest in hashed:
+            key = (doc.owner_id, digest)
+            if key in existing and existing[key] != doc.pk:
+                dupes.append((doc, existing[key]))
+                continue
+            existing[key] = doc.pk
+            doc.content_hash = digest
+            if not doc.sha256:
+                doc.sha256 = digest
+            writable.append(doc)
+        return writable, dupes
+
+    def _write(self, docs):
+        if not docs:
+            return 0
+        try:
+            with transaction.atomic():
+                Document.objects.bulk_update(docs, ["content_hash", "sha256"])
+            return len(docs)
+        except IntegrityError:
+            pass
+        # A concurrent upload claimed one of the digests; fall back to row saves.
+        written = 0
+        for doc in docs:
+            try:
+                with transaction.atomic():
+                    Document.objects.filter(pk=doc.pk).update(content_hash=doc.content_hash, sha256=doc.sha256)
+                written += 1
+            except IntegrityError:
+                self.stderr.write(f"Duplicate detected for owner {doc.owner_id}: doc {doc.pk}")
+        return written
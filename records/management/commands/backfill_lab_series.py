@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from records.management.services.lab_series import find_stale_series, rebuild_series
+from records.models import LabTestMeasurement
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized per-patient lab time series (LabSeries) from measurements."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--patient",
+            type=int,
+            action="append",
+            default=None,
+            help="Limit to a patient profile id (can be repeated).",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Rebuild every series instead of only the stale ones.",
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report stale series; exit with an error if any are found.",
+        )
+
+    def handle(self, *args, **options):
+        patient_ids = options.get("patient")
+        check_only = options.get("check", False)
+
+        if options.get("all") and not check_only:
+            qs = LabTestMeasurement.objects.all()
+            if patient_ids:
+                qs = qs.filter(medical_event__patient_id__in=patient_ids)
+            pairs = sorted(set(qs.values_list("medical_event__patient_id", "indicator_id")))
+        else:
+            pairs = find_stale_series(patient_ids)
+
+        if check_only:
+            for patient_id, indicator_id in pairs:
+                self.stdout.write(f"- stale: patient={patient_id} indicator={indicator_id}")
+            if pairs:
+                raise CommandError(f"{len(pairs)} lab series are stale.")
+            self.stdout.write(self.style.SUCCESS("All lab series are up to date."))
+            return
+
+        for patient_id, indicator_id in pairs:
+            rebuild_series(patient_id, indicator_id)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(pairs)} lab series."))
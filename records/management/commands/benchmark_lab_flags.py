@@ -0,0 +1,96 @@
+import random
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from records.models import (
+    LabIndicator,
+    LabTestMeasurement,
+    MedicalEvent,
+    MedicalSpecialty,
+    PatientProfile,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark abnormal-flag filtering and counting in Python vs SQL on a synthetic dataset. "
+        "All generated rows are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000, help="Synthetic measurements to generate.")
+        parser.add_argument("--indicators", type=int, default=20, help="Synthetic indicators to generate.")
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument(
+            "--skip-python",
+            action="store_true",
+            help="Skip the row-by-row Python baseline (slow on large datasets).",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._run(options)
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS("Synthetic data rolled back."))
+
+    def _timed(self, label, fn):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{label:<40} {elapsed * 1000:10.1f} ms  -> {result}")
+        return result
+
+    def _run(self, options):
+        rng = random.Random(42)
+        user = get_user_model().objects.create_user(username="lab-benchmark", password=None)
+        patient = PatientProfile.objects.create(user=user)
+        specialty = MedicalSpecialty.objects.create(slug="lab-benchmark")
+        events = MedicalEvent.objects.bulk_create(
+            MedicalEvent(patient=patient, owner=user, specialty=specialty, event_date=date(2020, 1, 1) + timedelta(days=i))
+            for i in range(100)
+        )
+        indicators = LabIndicator.objects.bulk_create(
+            LabIndicator(
+                slug=f"bench-{i}",
+                reference_low=None if i % 5 == 0 else 4.0,
+                reference_high=None if i % 7 == 0 else 6.0,
+            )
+            for i in range(options["indicators"])
+        )
+
+        rows = options["rows"]
+        batch_size = options["batch_size"]
+        base = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+        started = time.perf_counter()
+        for offset in range(0, rows, batch_size):
+            LabTestMeasurement.objects.bulk_create(
+                [
+                    LabTestMeasurement(
+                        medical_event=events[i % len(events)],
+                        indicator=indicators[i % len(indicators)],
+                        value=rng.uniform(2.0, 8.0),
+                        measured_at=base + timedelta(hours=i),
+                    )
+                    for i in range(offset, min(offset + batch_size, rows))
+                ],
+                batch_size=batch_size,
+            )
+        self.stdout.write(f"Generated {rows} measurements in {time.perf_counter() - started:.1f} s")
+
+        qs = LabTestMeasurement.objects.filter(medical_event__patient=patient)
+        if not options["skip_python"]:
+            self._timed(
+                "python: count abnormal",
+                lambda: sum(1 for m in qs.select_related("indicator").iterator(chunk_size=5000) if m.abnormal_flag),
+            )
+        self._timed("sql: count abnormal", lambda: qs.abnormal().count())
+        self._timed(
+            "sql: first 100 flagged rows",
+            lambda: len(list(qs.with_abnormal_flag().order_by("-measured_at", "-id")[:100])),
+        )
+        self._timed("sql: abnormal per indicator", lambda: len(list(qs.abnormal_counts())))
+        self._timed("sql: abnormal per indicator/month", lambda: len(list(qs.abnormal_counts("month"))))
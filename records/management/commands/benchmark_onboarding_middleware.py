@@ -0,0 +1,73 @@
+import time
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+from records.management.middleware.onboarding import OnboardingMiddleware
+from records.models import PatientProfile
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the per-request overhead of OnboardingMiddleware against the previous "
+        "profile lookup + resolve() check. All generated rows are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=10_000)
+        parser.add_argument("--path", default="/dashboard/")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._run(options)
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS("Synthetic data rolled back."))
+
+    def _run(self, options):
+        count = max(1, options["requests"])
+        path = options["path"]
+        user = get_user_model().objects.create_user(username="onboarding-benchmark", password=None)
+        PatientProfile.objects.create(
+            user=user, first_name_bg="Бенчмарк", last_name_bg="Потребител", date_of_birth=date(1990, 1, 1)
+        )
+        factory = RequestFactory()
+        middleware = OnboardingMiddleware(lambda request: None)
+        session = SessionStore()
+        User = get_user_model()
+
+        def request():
+            req = factory.get(path)
+            # A fresh user instance per request, like AuthenticationMiddleware provides.
+            req.user = User(pk=user.pk, username=user.username)
+            req.session = session
+            return req
+
+        def legacy():
+            req = request()
+            profile = PatientProfile.objects.get(user_id=req.user.pk)
+            complete = bool(profile.first_name_bg and profile.last_name_bg and profile.date_of_birth)
+            try:
+                resolve(path)
+            except Exception:
+                pass
+            return complete
+
+        def current():
+            return middleware.process_request(request())
+
+        current()
+        for label, fn in (("legacy lookup + resolve()", legacy), ("session-cached middleware", current)):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                for _ in range(count):
+                    fn()
+                elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{label:<30} {elapsed * 1e6 / count:8.1f} us/request  queries/request={len(queries) / count:.2f}"
+            )
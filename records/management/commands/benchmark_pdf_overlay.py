@@ -0,0 +1,77 @@
+import copy
+import io
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PyPDF2 import PdfReader, PdfWriter
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from records.management.services.pdf_overlay import clear_template_cache, load_template, overlay_template
+
+
+def _generated_pdf(pages: int) -> bytes:
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    for i in range(pages):
+        for line in range(40):
+            c.drawString(60, 760 - line * 16, f"Page {i + 1} line {line + 1}")
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+def _legacy_overlay(pdf_bytes: bytes, template_path: str) -> bytes:
+    """The previous per-request implementation: parse the template and deep-copy a page per page."""
+
+    tmpl_reader = PdfReader(template_path)
+    gen_reader = PdfReader(io.BytesIO(pdf_bytes))
+    first_tpl_page = tmpl_reader.pages[0]
+    second_tpl_page = tmpl_reader.pages[1] if len(tmpl_reader.pages) >= 2 else None
+    writer = PdfWriter()
+    for i, gen_page in enumerate(gen_reader.pages):
+        base_tpl = first_tpl_page if i == 0 else (second_tpl_page or first_tpl_page)
+        writer.add_page(copy.deepcopy(base_tpl))
+        writer.pages[-1].merge_page(gen_page)
+    buf = io.BytesIO()
+    writer.write(buf)
+    return buf.getvalue()
+
+
+class Command(BaseCommand):
+    help = "Benchmark the letterhead overlay engine against the legacy per-page template copy."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100], help="Document sizes to test.")
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per size; the best time is reported.")
+        parser.add_argument("--template", default="pdf-template-twopage-bg.pdf", help="Template file in pdf_templates.")
+        parser.add_argument("--skip-legacy", action="store_true", help="Only time the overlay engine.")
+
+    def _best(self, fn, repeat):
+        best = None
+        result = b""
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1000, len(result)
+
+    def handle(self, *args, **options):
+        template_path = str(Path(settings.BASE_DIR) / "records" / "pdf_templates" / options["template"])
+        clear_template_cache()
+        started = time.perf_counter()
+        if load_template(template_path) is None:
+            raise CommandError(f"Cannot read template {template_path}")
+        self.stdout.write(f"Template parsed once in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        repeat = max(1, options["repeat"])
+        for pages in options["pages"]:
+            pdf_bytes = _generated_pdf(pages)
+            engine_ms, engine_size = self._best(lambda: overlay_template(pdf_bytes, template_path), repeat)
+            self.stdout.write(f"{pages:>4} pages  engine {engine_ms:10.1f} ms  {engine_size / 1024:10.1f} KiB")
+            if not options["skip_legacy"]:
+                legacy_ms, legacy_size = self._best(lambda: _legacy_overlay(pdf_bytes, template_path), repeat)
+                self.stdout.write(f"{pages:>4} pages  legacy {legacy_ms:10.1f} ms  {legacy_size / 1024:10.1f} KiB")
@@ -1,12 +1,13 @@
 from django.core.management.base import BaseCommand
-from django.utils import timezone
-from records.models import ShareToken
+
+from records.management.services.share_lifecycle import run_sweep
+
 
 class Command(BaseCommand):
-    help = "Deactivate expired share tokens"
+    help = "Expire overdue share links and delete expired/revoked ones past SHARE_RETENTION_DAYS"
 
     def handle(self, *args, **options):
-        now = timezone.now()
-        qs = ShareToken.objects.filter(is_active=True, expires_at__lte=now)
-        count = qs.update(is_active=False)
-        self.stdout.write(self.style.SUCCESS(f"Deactivated {count} expired share tokens"))
+        result = run_sweep()
+        self.stdout.write(
+            self.style.SUCCESS(f"Expired {result['expired']} and purged {result['purged']} share links")
+        )
@@ -1,10 +1,11 @@
 from django.core.management.base import BaseCommand
-from django.utils.timezone import now
-from records.models import ShareLink
+
+from records.management.services.share_lifecycle import expire_links
+
 
 class Command(BaseCommand):
+    help = "Mark active share links past their expiry as expired."
+
     def handle(self, *args, **options):
-        qs = ShareLink.objects.filter(status="active", expires_at__lt=now())
-        for s in qs:
-            s.status = "expired"
-            s.save(update_fields=["status"])
+        count = expire_links()
+        self.stdout.write(self.style.SUCCESS(f"Expired {count} share links"))
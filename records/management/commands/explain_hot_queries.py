@@ -0,0 +1,80 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from records.management.services.record_filters import RecordFilters
+from records.models import Document, LabTestMeasurement, MedicalEvent, PatientProfile, ShareLink
+
+SEQ_SCAN_PATTERNS = {
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+    "sqlite": re.compile(r"\bSCAN (\w+)\b(?! USING (?:COVERING )?INDEX)"),
+}
+
+
+def hot_queries(user_id: int, patient_id: int, indicator_id: int):
+    """The queries behind the busiest views, keyed by a short label."""
+
+    filters = RecordFilters.from_payload({})
+    return {
+        "documents by owner, newest first": Document.objects.filter(owner_id=user_id).order_by("-uploaded_at")[:25],
+        "share filter documents": filters.documents(user_id),
+        "events by patient, newest first": MedicalEvent.objects.filter(patient_id=patient_id).order_by("-event_date")[:25],
+        "lab series by patient and indicator": LabTestMeasurement.objects.filter(
+            medical_event__patient_id=patient_id, indicator_id=indicator_id
+        ).order_by("measured_at"),
+        "share link by token": ShareLink.objects.filter(token="explain", status="active"),
+        "active share links past expiry": ShareLink.objects.filter(status="active", expires_at__lt=timezone.now()),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Run EXPLAIN on the hot view queries and report sequential scans. On PostgreSQL sequential "
+        "scans are disabled while planning, so any that remain mean no usable index exists."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, default=None, help="User id to plan the queries for.")
+        parser.add_argument("--indicator", type=int, default=None, help="Lab indicator id for the series query.")
+        parser.add_argument(
+            "--natural",
+            action="store_true",
+            help="Keep the planner's own choices on PostgreSQL (small tables favour sequential scans).",
+        )
+        parser.add_argument("--check", action="store_true", help="Exit with an error if any sequential scan is found.")
+
+    def handle(self, *args, **options):
+        profile = PatientProfile.objects.filter(user_id=options["user"]) if options["user"] else PatientProfile.objects
+        profile = profile.order_by("pk").first()
+        user_id = options["user"] or (profile.user_id if profile else 0)
+        patient_id = profile.pk if profile else 0
+        indicator_id = options["indicator"] or LabTestMeasurement.objects.values_list("indicator_id", flat=True).first() or 0
+
+        pattern = SEQ_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            self.stderr.write(f"Sequential scan detection is not supported on {connection.vendor}; plans only.")
+        verbose = int(options.get("verbosity", 1)) > 1
+        flagged = []
+
+        with transaction.atomic():
+            if connection.vendor == "postgresql" and not options["natural"]:
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+            for label, qs in hot_queries(user_id, patient_id, indicator_id).items():
+                plan = qs.explain()
+                tables = sorted(set(pattern.findall(plan))) if pattern else []
+                if tables:
+                    flagged.append(label)
+                    self.stdout.write(self.style.WARNING(f"SEQ  {label}: {', '.join(tables)}"))
+                else:
+                    self.stdout.write(f"OK   {label}")
+                if verbose or tables:
+                    for line in plan.splitlines():
+                        self.stdout.write(f"       {line}")
+
+        if flagged and options["check"]:
+            raise CommandError(f"{len(flagged)} hot queries use sequential scans.")
+        if not flagged:
+            self.stdout.write(self.style.SUCCESS("No sequential scans in hot queries."))
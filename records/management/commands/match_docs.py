@@ -1,17 +1,92 @@
 import json
 import mimetypes
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
 
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from django.utils.timezone import now
 
+from records.management.services.document_facets import rebuild_counts
+from records.management.services.record_versions import bump_record_versions
+from records.management.services.search import index_document, indexed_documents
 from records.models import Document  # records_document
 
+UPDATE_FIELDS = ("file", "file_size", "file_mime", "title")
+
+
 def guess_mime(path: Path) -> str:
     mt, _ = mimetypes.guess_type(path.name)
     return mt or "application/octet-stream"
 
+
+def _iter_json_array(fh, chunk_size=1 << 16):
+    """Yield the elements of a top-level JSON array without loading the whole file."""
+
+    decoder = json.JSONDecoder()
+    buf = fh.read(chunk_size).lstrip()
+    if not buf.startswith("["):
+        raise ValueError("map must be a JSON array or JSON Lines")
+    buf = buf[1:]
+    eof = False
+    while True:
+        buf = buf.lstrip().lstrip(",").lstrip()
+        if buf.startswith("]"):
+            return
+        try:
+            item, end = decoder.raw_decode(buf)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            more = fh.read(chunk_size)
+            eof = not more
+            buf += more
+            continue
+        yield item
+        buf = buf[end:]
+        if not buf and not eof:
+            more = fh.read(chunk_size)
+            eof = not more
+            buf = more
+        if not buf and eof:
+            raise ValueError("unterminated JSON array in map")
+
+
+def iter_map(path: Path):
+    """Stream map entries from a JSON array or a JSON Lines (``.jsonl``) file."""
+
+    with path.open("r", encoding="utf-8") as fh:
+        head = fh.read(1)
+        while head.isspace():
+            head = fh.read(1)
+        fh.seek(0)
+        if head == "[":
+            yield from _iter_json_array(fh)
+            return
+        for line in fh:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _stat(path: Path):
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return None
+
+
+def _chunks(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 class Command(BaseCommand):
     help = "Match local media/documents files to records_document by sha256, fix paths, and optionally create missing docs."
 
@@ -19,7 +94,7 @@ class Command(BaseCommand):
         parser.add_argument(
             "--map",
             default="document_file_map.json",
-            help="JSON от PowerShell join-а: [{id, sha256, file_db, file_local, title}]",
+            help="JSON или JSON Lines от PowerShell join-а: [{id, sha256, file_db, file_local, title}]",
         )
         parser.add_argument(
             "--media-root",
@@ -37,128 +112,194 @@ class Command(BaseCommand):
             help="Дефолти за нови записи: owner_id=...,category_id=...,doc_type_id=...,specialty_id=...",
         )
         parser.add_argument("--dry-run", action="store_true", help="Само показва промените.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Записи от картата на една партида.")
+        parser.add_argument("--workers", type=int, default=16, help="Нишки за stat на локалните файлове.")
+        parser.add_argument(
+            "--report",
+            default=None,
+            help="Записва JSON Lines отчет (по един ред на събитие и обобщение накрая); '-' за stdout.",
+        )
 
     def handle(self, *args, **opts):
         mp = Path(opts["map"])
-        media_root = Path(opts["media_root"])
+        self.media_root = Path(opts["media_root"])
         if not mp.exists():
             self.stderr.write(self.style.ERROR(f"Map file not found: {mp}"))
             return
 
-        with mp.open("r", encoding="utf-8") as f:
-            items = json.load(f)
-
-        # Индекси
-        by_sha = {}
-        for d in Document.objects.all().only("id", "sha256", "file", "title"):
-            if d.sha256:
-                by_sha.setdefault(d.sha256, []).append(d)
-
         # parse defaults
-        defaults = {}
+        self.defaults = {}
         for kv in opts["defaults"].split(","):
             k, v = kv.split("=", 1)
-            defaults[k.strip()] = int(v.strip())
+            self.defaults[k.strip()] = int(v.strip())
 
-        updates, duplicates, not_found_local, created = [], [], [], []
+        self.dry_run = opts["dry_run"]
+        self.create_missing = opts["create_missing"]
+        self.counts = {"entries": 0, "update": 0, "duplicate": 0, "missing_local": 0, "created": 0}
+        self.events = {"update": [], "duplicate": [], "missing_local": [], "created": []}
+        self.created_shas = set()
+        self.created_owners = set()
 
-        @transaction.atomic
-        def apply():
-            for it in items:
-                sha = (it.get("sha256") or "").strip()
-                file_local = it.get("file_local")
-                if not sha:
-                    continue
+        report_path = opts.get("report")
+        self.report = None
+        if report_path == "-":
+            self.report = self.stdout
+        elif report_path:
+            self.report = open(report_path, "w", encoding="utf-8")
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, opts["workers"])) as pool:
+                for chunk in _chunks(iter_map(mp), max(1, opts["batch_size"])):
+                    self._process(chunk, pool)
+            if self.created_owners:
+                # bulk_create skips the post_save facet bookkeeping.
+                rebuild_counts(self.created_owners)
+            if self.report:
+                self._emit("summary", **self.counts)
+        finally:
+            if self.report and self.report is not self.stdout:
+                self.report.close()
 
-                # 1) актуализация на съществуващ запис/и
-                docs = by_sha.get(sha, [])
-                if docs:
-                    if len(docs) > 1:
-                        duplicates.append(
-                            {"sha256": sha, "ids": [d.id for d in docs]}
-                        )
-                    for d in docs:
-                        # желан относителен път в медия
-                        if file_local:
-                            desired = f"documents/{file_local}"
-                            full = media_root / file_local
-                        else:
-                            desired = d.file  # няма ново име
-                            full = media_root / Path(d.file).name
-
-                        size = full.stat().st_size if full.exists() else None
-                        mime = guess_mime(full)
-
-                        changed = {}
-                        if file_local and d.file != desired:
-                            changed["file"] = (d.file, desired)
-                            d.file = desired
-                        if size and getattr(d, "file_size", None) != size:
-                            changed["file_size"] = (getattr(d, "file_size", None), size)
-                            d.file_size = size
-                        if (getattr(d, "file_mime", "") or "") != mime:
-                            changed["file_mime"] = (getattr(d, "file_mime", ""), mime)
-                            d.file_mime = mime
-                        if not d.title and it.get("title"):
-                            changed["title"] = (d.title, it["title"])
-                            d.title = it["title"]
-
-                        if changed:
-                            updates.append({"id": d.id, "changes": changed})
-                            if not opts["dry_run"]:
-                                d.save()
-
-                        if not full.exists():
-                            not_found_local.append({"id": d.id, "expected": str(full)})
-
-                # 2) създаване на липсващ запис (ако е позволено)
-                elif opts["create-missing"] and file_local:
-                    full = media_root / file_local
-                    if not full.exists():
-                        not_found_local.append({"sha256": sha, "expected": str(full)})
-                        continue
-                    d = Document(
-                        document_date=now().date(),
-                        date_created=now().date(),
-                        uploaded_at=now(),
-                        file=f"documents/{file_local}",
-                        file_size=full.stat().st_size,
-                        file_mime=guess_mime(full),
-                        doc_kind="image" if guess_mime(full).startswith("image/") else "file",
-                        sha256=sha,
-                        summary="",
-                        notes="",
-                        category_id=defaults["category_id"],
-                        doc_type_id=defaults["doc_type_id"],
-                        medical_event_id=None,
-                        owner_id=defaults["owner_id"],
-                        specialty_id=defaults["specialty_id"],
-                        title=it.get("title") or Path(file_local).stem,
-                    )
-                    created.append({"file": d.file, "sha256": sha})
-                    if not opts["dry_run"]:
-                        d.save()
-
-        apply()
+        if self.report is self.stdout:
+            return
 
         # Изход
-        self.stdout.write(self.style.SUCCESS(f"Updated: {len(updates)}"))
-        self.stdout.write(self.style.WARNING(f"Duplicates (same sha256): {len(duplicates)}"))
-        self.stdout.write(self.style.WARNING(f"Local files missing: {len(not_found_local)}"))
-        if opts["create-missing"]:
-            self.stdout.write(self.style.SUCCESS(f"Created new: {len(created)}"))
+        self.stdout.write(self.style.SUCCESS(f"Updated: {self.counts['update']}"))
+        self.stdout.write(self.style.WARNING(f"Duplicates (same sha256): {self.counts['duplicate']}"))
+        self.stdout.write(self.style.WARNING(f"Local files missing: {self.counts['missing_local']}"))
+        if self.create_missing:
+            self.stdout.write(self.style.SUCCESS(f"Created new: {self.counts['created']}"))
+        if self.report:
+            return
 
         # Детайлни отчети
         self.stdout.write("\n== Updates ==")
-        for u in updates:
+        for u in self.events["update"]:
             self.stdout.write(f"- id {u['id']}: {u['changes']}")
         self.stdout.write("\n== Duplicates ==")
-        for d in duplicates:
+        for d in self.events["duplicate"]:
             self.stdout.write(f"- sha256 {d['sha256']} -> ids {d['ids']}")
         self.stdout.write("\n== Missing local files ==")
-        for m in not_found_local:
+        for m in self.events["missing_local"]:
             self.stdout.write(f"- {m}")
-        if created:
+        if self.events["created"]:
             self.stdout.write("\n== Created ==")
-            for c in created:
+            for c in self.events["created"]:
                 self.stdout.write(f"- {c}")
+
+    def _emit(self, kind, **data):
+        if kind in self.counts:
+            self.counts[kind] += 1
+        if self.report is self.stdout:
+            self.stdout.write(json.dumps({"type": kind, **data}, ensure_ascii=False))
+        elif self.report:
+            self.report.write(json.dumps({"type": kind, **data}, ensure_ascii=False) + "\n")
+        elif kind in self.events:
+            self.events[kind].append(data)
+
+    def _process(self, items, pool):
+        items = [it for it in items if (it.get("sha256") or "").strip()]
+        self.counts["entries"] += len(items)
+        shas = {it["sha256"].strip() for it in items}
+        by_sha = {}
+        for d in Document.objects.filter(sha256__in=shas).only("id", "owner_id", "sha256", *UPDATE_FIELDS).order_by("id"):
+            by_sha.setdefault(d.sha256, []).append(d)
+
+        # Всички stat-ове на партидата вървят паралелно.
+        paths = set()
+        for it in items:
+            sha = it["sha256"].strip()
+            if it.get("file_local"):
+                paths.add(self.media_root / it["file_local"])
+            else:
+                paths.update(self.media_root / Path(d.file.name).name for d in by_sha.get(sha, []))
+        paths = list(paths)
+        sizes = dict(zip(paths, pool.map(_stat, paths)))
+
+        changed_docs, fields, new_docs, retitled = {}, set(), [], []
+        for it in items:
+            sha = it["sha256"].strip()
+            file_local = it.get("file_local")
+
+            # 1) актуализация на съществуващ запис/и
+            docs = by_sha.get(sha, [])
+            if docs:
+                if len(docs) > 1:
+                    self._emit("duplicate", sha256=sha, ids=[d.id for d in docs])
+                for d in docs:
+                    # желан относителен път в медия
+                    if file_local:
+                        desired = f"documents/{file_local}"
+                        full = self.media_root / file_local
+                    else:
+                        desired = d.file.name  # няма ново име
+                        full = self.media_root / Path(d.file.name).name
+
+                    size = sizes.get(full)
+                    mime = guess_mime(full)
+
+                    changed = {}
+                    if file_local and d.file.name != desired:
+                        changed["file"] = (d.file.name, desired)
+                        d.file = desired
+                    if size and d.file_size != size:
+                        changed["file_size"] = (d.file_size, size)
+                        d.file_size = size
+                    if (d.file_mime or "") != mime:
+                        changed["file_mime"] = (d.file_mime or "", mime)
+                        d.file_mime = mime
+                    if not d.title and it.get("title"):
+                        changed["title"] = (d.title, it["title"])
+                        d.title = it["title"]
+                        retitled.append(d.id)
+
+                    if changed:
+                        self._emit("update", id=d.id, changes=changed)
+                        changed_docs[d.id] = d
+                        fields.update(changed)
+
+                    if size is None:
+                        self._emit("missing_local", id=d.id, expected=str(full))
+
+            # 2) създаване на липсващ запис (ако е позволено)
+            elif self.create_missing and file_local and sha not in self.created_shas:
+                full = self.media_root / file_local
+                size = sizes.get(full)
+                if size is None:
+                    self._emit("missing_local", sha256=sha, expected=str(full))
+                    continue
+                mime = guess_mime(full)
+                d = Document(
+                    document_date=now().date(),
+                    date_created=now().date(),
+                    uploaded_at=now(),
+                    file=f"documents/{file_local}",
+                    file_size=size,
+                    file_mime=mime,
+                    doc_kind="image" if mime.startswith("image/") else "other",
+                    sha256=sha,
+                    summary="",
+                    notes="",
+                    category_id=self.defaults["category_id"],
+                    doc_type_id=self.defaults["doc_type_id"],
+                    medical_event_id=None,
+                    owner_id=self.defaults["owner_id"],
+                    specialty_id=self.defaults["specialty_id"],
+                    title=it.get("title") or Path(file_local).stem,
+                )
+                self.created_shas.add(sha)
+                self._emit("created", file=d.file.name, sha256=sha)
+                new_docs.append(d)
+
+        if self.dry_run or not (changed_docs or new_docs):
+            return
+        with transaction.atomic():
+            if changed_docs:
+                Document.objects.bulk_update(list(changed_docs.values()), [f for f in UPDATE_FIELDS if f in fields])
+            if new_docs:
+                Document.objects.bulk_create(new_docs)
+        # Bulk writes bypass the Document signals; redo their work per batch.
+        owners = {d.owner_id for d in new_docs}
+        self.created_owners.update(owners)
+        for document in indexed_documents().filter(pk__in=retitled + [d.pk for d in new_docs if d.pk]):
+            index_document(document)
+        bump_record_versions(owners | {d.owner_id for d in changed_docs.values()})
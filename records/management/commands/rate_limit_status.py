@@ -0,0 +1,20 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from records.management.services.rate_limit import DEFAULT_LIMITS, RateLimiter
+
+
+class Command(BaseCommand):
+    help = "Show the sliding-window rate limit metrics for one or more keys without counting a hit."
+
+    def add_arguments(self, parser):
+        parser.add_argument("name", help=f"Limiter name ({', '.join(DEFAULT_LIMITS)}).")
+        parser.add_argument("keys", nargs="+", help="Limiter keys, e.g. u42 for a user or <token>:<ip>.")
+
+    def handle(self, *args, **options):
+        if options["name"] not in DEFAULT_LIMITS:
+            raise CommandError(f"Unknown limiter: {options['name']}")
+        limiter = RateLimiter(options["name"])
+        for key in options["keys"]:
+            self.stdout.write(json.dumps(limiter.peek(key).as_dict()))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from records.management.services.document_facets import find_drift, rebuild_counts
+
+
+class Command(BaseCommand):
+    help = "Check or rebuild the per-owner document facet counters (DocumentFacetCount)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--owner",
+            type=int,
+            action="append",
+            default=None,
+            help="Limit to a user id (can be repeated).",
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report drifted counters; exit with an error if any are found.",
+        )
+
+    def handle(self, *args, **options):
+        owner_ids = options.get("owner")
+        drift = find_drift(owner_ids)
+
+        if options.get("check"):
+            for owner_id, facet, key, stored, expected in drift:
+                self.stdout.write(f"- drift: owner={owner_id} {facet}={key} stored={stored} expected={expected}")
+            if drift:
+                raise CommandError(f"{len(drift)} facet counters are out of date.")
+            self.stdout.write(self.style.SUCCESS("All facet counters are consistent."))
+            return
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("All facet counters are consistent."))
+            return
+        affected = sorted({row[0] for row in drift})
+        rebuild_counts(affected)
+        self.stdout.write(
+            self.style.SUCCESS(f"Fixed {len(drift)} facet counters for {len(affected)} owners.")
+        )
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from records.management.services.search import index_document, indexed_documents
+from records.models import DocumentSearchIndex
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index for documents."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--owner",
+            type=int,
+            action="append",
+            default=None,
+            help="Limit to documents of a user id (can be repeated).",
+        )
+        parser.add_argument(
+            "--missing",
+            action="store_true",
+            help="Only index documents that have no search entry yet.",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        qs = indexed_documents().order_by("id")
+        if options.get("owner"):
+            qs = qs.filter(owner_id__in=options["owner"])
+        if options.get("missing"):
+            qs = qs.exclude(pk__in=DocumentSearchIndex.objects.values("document_id"))
+
+        batch_size = max(1, options["batch_size"])
+        ids = list(qs.values_list("id", flat=True))
+        done = 0
+        for start in range(0, len(ids), batch_size):
+            for document in qs.filter(id__in=ids[start:start + batch_size]):
+                index_document(document)
+                done += 1
+            self.stdout.write(f"- indexed {done}/{len(ids)}")
+        self.stdout.write(self.style.SUCCESS(f"Indexed {done} documents."))
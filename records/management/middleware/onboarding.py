@@ -1,7 +1,11 @@
-from django.urls import resolve, reverse
+from functools import lru_cache
+
+from django.urls import NoReverseMatch, get_script_prefix, reverse
 from django.shortcuts import redirect
 from django.utils.deprecation import MiddlewareMixin
 
+from records.management.services.record_versions import profile_version
+
 ALLOWED_PREFIXES = (
     "/static/",
     "/favicon.ico/",
@@ -10,47 +14,84 @@ ALLOWED_PREFIXES = (
     "/admin/",
 )
 
+ALLOWED_VIEWS = (
+    "medj:personalcard",
+    "medj:profile",
+    "medj:logout",
+    "medj:password_change",
+    "medj:password_change_done",
+)
+
+# Session entry holding {"uid", "v", "ok"}: the onboarding state of the
+# logged-in user as of profile version ``v``. PatientProfile signals bump the
+# version, so the state is only re-read from the database after a profile
+# change and a completed profile costs no query per request.
+SESSION_KEY = "_onboarding"
+
+
+@lru_cache(maxsize=1)
+def allowed_paths() -> frozenset:
+    """Paths of the views reachable before onboarding, reversed once per process.
+
+    ``reverse()`` includes the script prefix (SCRIPT_NAME) while
+    ``request.path_info`` does not, so the prefix is stripped here.
+    """
+
+    prefix = get_script_prefix()
+    paths = set()
+    for name in ALLOWED_VIEWS:
+        try:
+            url = reverse(name)
+        except NoReverseMatch:
+            continue
+        paths.add("/" + url[len(prefix):] if url.startswith(prefix) else url)
+    return frozenset(paths)
+
+
+def _load_complete(user) -> bool:
+    try:
+        profile = user.patient_profile
+    except Exception:
+        from records.models import PatientProfile
+        profile, _ = PatientProfile.objects.get_or_create(
+            user=user,
+            defaults={
+                "first_name_bg": user.first_name or "",
+                "last_name_bg": user.last_name or "",
+            },
+        )
+    return profile.onboarding_complete
+
+
+def onboarding_complete(request) -> bool:
+    """Return the onboarding state of ``request.user``, cached in the session."""
+
+    user = request.user
+    version = profile_version(user.pk)
+    session = getattr(request, "session", None)
+    state = session.get(SESSION_KEY) if session is not None else None
+    if state and state.get("uid") == user.pk and state.get("v") == version:
+        return bool(state.get("ok"))
+
+    complete = _load_complete(user)
+    if session is not None:
+        session[SESSION_KEY] = {"uid": user.pk, "v": version, "ok": complete}
+    return complete
+
+
 class OnboardingMiddleware(MiddlewareMixin):
     def process_request(self, request):
         path = request.path_info or "/"
-        for p in ALLOWED_PREFIXES:
-            if path.startswith(p):
-                return None
+        if path.startswith(ALLOWED_PREFIXES):
+            return None
 
         if not request.user.is_authenticated:
             return None
 
-        try:
-            profile = request.user.patient_profile
-        except Exception:
-            from records.models import PatientProfile
-            profile, _ = PatientProfile.objects.get_or_create(
-                user=request.user,
-                defaults={
-                    "first_name_bg": request.user.first_name or "",
-                    "last_name_bg": request.user.last_name or "",
-                },
-            )
-
-        complete = bool(profile.first_name_bg and profile.last_name_bg and profile.date_of_birth)
-
-        try:
-            view_name = resolve(path).view_name or ""
-        except Exception:
-            view_name = ""
-
-        if complete:
+        if onboarding_complete(request):
             return None
 
-        allowed_views = {
-            "medj:personalcard",
-            "medj:profile",
-            "medj:logout",
-            "medj:password_change",
-            "medj:password_change_done",
-        }
-
-        if view_name in allowed_views:
+        if path in allowed_paths():
             return None
 
         return redirect(reverse("medj:personalcard"))
@@ -0,0 +1,113 @@
+"""Shared plumbing for long-running backfill commands.
+
+Backfills walk a table in primary-key order, one chunk per
+:func:`iter_chunks` step (keyset pagination, so no ``OFFSET`` and no upfront
+``count()``). After every written chunk the last processed id is stored in a
+:class:`Checkpoint`, a small JSON file under ``BACKFILL_CHECKPOINT_DIR``, so a
+rerun resumes where the previous one stopped. :class:`Progress` reports
+throughput and an ETA derived from the remaining id range.
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Callable, Iterator
+
+from django.conf import settings
+from django.db.models import Max
+
+
+def checkpoint_dir() -> Path:
+    return Path(getattr(settings, "BACKFILL_CHECKPOINT_DIR", Path(settings.BASE_DIR) / ".backfill"))
+
+
+class Checkpoint:
+    """Last processed primary key of a backfill, persisted as JSON."""
+
+    def __init__(self, name: str, path: str | os.PathLike | None = None):
+        self.name = name
+        self.path = Path(path) if path else checkpoint_dir() / f"{name}.json"
+
+    def load(self) -> int:
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                return int(json.load(fh).get("last_id") or 0)
+        except (OSError, ValueError, TypeError, AttributeError):
+            return 0
+
+    def save(self, last_id: int, **stats) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump({"name": self.name, "last_id": int(last_id), "saved_at": time.time(), **stats}, fh)
+        os.replace(tmp, self.path)
+
+    def clear(self) -> None:
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def iter_chunks(queryset, *, after_id: int = 0, chunk_size: int = 500, limit: int | None = None) -> Iterator[list]:
+    """Yield lists of rows with ``pk > after_id`` in ascending pk order."""
+
+    last_id = after_id
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        rows = list(queryset.filter(pk__gt=last_id).order_by("pk")[:size])
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].pk
+        if remaining is not None:
+            remaining -= len(rows)
+
+
+class Progress:
+    """Throughput and ETA reporting for a pk-ordered backfill."""
+
+    def __init__(self, queryset, write: Callable[[str], None], *, start_id: int = 0, label: str = "rows", every: float = 5.0):
+        self.write = write
+        self.label = label
+        self.every = every
+        self.start_id = start_id
+        self.last_id = start_id
+        self.max_id = queryset.aggregate(max_id=Max("pk"))["max_id"] or 0
+        self.processed = 0
+        self.started = time.monotonic()
+        self._reported = self.started
+
+    @property
+    def elapsed(self) -> float:
+        return max(time.monotonic() - self.started, 1e-6)
+
+    @property
+    def rate(self) -> float:
+        return self.processed / self.elapsed
+
+    def eta(self) -> float | None:
+        done = self.last_id - self.start_id
+        remaining = self.max_id - self.last_id
+        if done <= 0:
+            return None
+        return max(remaining, 0) * self.elapsed / done
+
+    def advance(self, count: int, last_id: int) -> None:
+        self.processed += count
+        self.last_id = max(self.last_id, last_id)
+        now = time.monotonic()
+        if now - self._reported >= self.every:
+            self._reported = now
+            self.write(self.line())
+
+    def line(self) -> str:
+        eta = self.eta()
+        eta_text = f"{int(eta // 60)}m{int(eta % 60):02d}s" if eta is not None else "?"
+        return (
+            f"{self.processed} {self.label} ({self.rate:.1f}/s), "
+            f"at id {self.last_id}/{self.max_id}, ETA {eta_text}"
+        )
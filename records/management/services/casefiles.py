@@ -0,0 +1,238 @@
+"""Data layer for the casefiles listing.
+
+Builds the filtered document queryset, cuts it into cursor pages and turns a
+page into template rows grouped by month. A page costs a fixed number of
+queries: document type and specialty names are annotated in SQL, and tags come
+from one prefetch restricted to the active and fallback language.
+"""
+from __future__ import annotations
+
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import DateTimeField, F, OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import Cast, Coalesce
+from django.utils.translation import get_language
+
+from records.models import Document, DocumentType, MedicalSpecialty, Tag
+
+from .search import search_documents
+
+FALLBACK_LANGUAGE = "en-us"
+DEFAULT_SORT = "date_desc"
+
+SORTS = {
+    "date_asc": ("sort_date", "id"),
+    "date_desc": ("-sort_date", "-id"),
+    "type_asc": ("type_name", "id"),
+    "type_desc": ("-type_name", "-id"),
+    "name_asc": ("summary", "id"),
+    "name_desc": ("-summary", "-id"),
+    "spec_asc": ("spec_name", "id"),
+    "spec_desc": ("-spec_name", "-id"),
+    "relevance": ("-search_rank", "-sort_date", "-id"),
+}
+KEYSET_SORTS = {"date_asc", "date_desc"}
+
+MONTHS_BG = [
+    "Януари",
+    "Февруари",
+    "Март",
+    "Април",
+    "Май",
+    "Юни",
+    "Юли",
+    "Август",
+    "Септември",
+    "Октомври",
+    "Ноември",
+    "Декември",
+]
+
+
+def _languages(lang: str | None = None) -> list[str]:
+    lang = lang or get_language() or FALLBACK_LANGUAGE
+    return [lang] if lang == FALLBACK_LANGUAGE else [lang, FALLBACK_LANGUAGE]
+
+
+def _translated_name(model, ref: str, languages: list[str]):
+    translation_model = model._parler_meta.root_model
+    names = [
+        Subquery(
+            translation_model.objects.filter(master_id=OuterRef(ref), language_code=code)
+            .values("name")[:1]
+        )
+        for code in languages
+    ]
+    return names[0] if len(names) == 1 else Coalesce(*names)
+
+
+def _ids(values) -> list[int]:
+    return [int(v) for v in values if str(v).isdigit()]
+
+
+def casefile_documents(
+    user,
+    patient_id,
+    *,
+    q: str = "",
+    date_from: str = "",
+    date_to: str = "",
+    tags=(),
+    specialties=(),
+    categories=(),
+    lang: str | None = None,
+):
+    """Return the filtered casefiles queryset with ``sort_date``, ``type_name`` and ``spec_name``."""
+
+    languages = _languages(lang)
+    qs = Document.objects.select_related("medical_event").filter(
+        medical_event__patient_id=patient_id, owner=user
+    )
+    if date_from:
+        qs = qs.filter(medical_event__event_date__gte=date_from)
+    if date_to:
+        qs = qs.filter(medical_event__event_date__lte=date_to)
+    if tags:
+        ids = _ids(tags)
+        names = [t for t in tags if not str(t).isdigit()]
+        tag_q = Q()
+        if ids:
+            tag_q |= Q(tags__id__in=ids)
+        if names:
+            tag_q |= Q(tags__translations__name__in=names)
+        qs = qs.filter(tag_q).distinct()
+    if q:
+        qs = search_documents(qs, q)
+    if specialties:
+        qs = qs.filter(medical_event__specialty_id__in=_ids(specialties))
+    if categories:
+        qs = qs.filter(medical_event__category_id__in=_ids(categories))
+
+    return qs.annotate(
+        sort_date=Coalesce(
+            Cast(F("medical_event__event_date"), DateTimeField()),
+            F("uploaded_at"),
+            output_field=DateTimeField(),
+        ),
+        type_name=_translated_name(DocumentType, "doc_type_id", languages),
+        spec_name=_translated_name(MedicalSpecialty, "medical_event__specialty_id", languages),
+    ).prefetch_related(
+        Prefetch(
+            "tags",
+            queryset=Tag.objects.prefetch_related(
+                Prefetch(
+                    "translations",
+                    queryset=Tag._parler_meta.root_model.objects.filter(language_code__in=languages),
+                )
+            ),
+        )
+    )
+
+
+def _encode_cursor(payload: dict) -> str:
+    raw = json.dumps(payload, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(token: str | None, sort: str) -> dict | None:
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(payload, dict) or payload.get("s") != sort:
+        return None
+    return payload
+
+
+def document_page(qs, sort: str, cursor: str | None = None, page_size: int | None = None):
+    """Return ``(documents, next_cursor)`` for one page of ``qs`` ordered by ``sort``.
+
+    Date sorts page by keyset on ``(sort_date, id)``; other sorts by offset.
+    """
+
+    if sort not in SORTS:
+        sort = DEFAULT_SORT
+    page_size = page_size or getattr(settings, "CASEFILES_PAGE_SIZE", 50)
+    state = _decode_cursor(cursor, sort)
+    offset = 0
+    if state and sort in KEYSET_SORTS:
+        try:
+            after = datetime.fromisoformat(state["d"])
+            after_id = int(state["i"])
+        except (KeyError, TypeError, ValueError):
+            after = None
+        if after is not None:
+            op = "lt" if sort == "date_desc" else "gt"
+            qs = qs.filter(
+                Q(**{f"sort_date__{op}": after}) | Q(sort_date=after, **{f"id__{op}": after_id})
+            )
+    elif state:
+        try:
+            offset = max(0, int(state.get("o", 0)))
+        except (TypeError, ValueError):
+            offset = 0
+
+    docs = list(qs.order_by(*SORTS[sort])[offset:offset + page_size + 1])
+    next_cursor = None
+    if len(docs) > page_size:
+        docs = docs[:page_size]
+        last = docs[-1]
+        if sort in KEYSET_SORTS:
+            next_cursor = _encode_cursor({"s": sort, "d": last.sort_date.isoformat(), "i": last.id})
+        else:
+            next_cursor = _encode_cursor({"s": sort, "o": offset + page_size})
+    return docs, next_cursor
+
+
+def _tag_name(tag) -> str:
+    try:
+        return tag.safe_translation_getter("name") or ""
+    except Exception:
+        return ""
+
+
+def document_items(docs) -> list[dict]:
+    items = []
+    for d in docs:
+        ev = d.medical_event
+        type_name = d.type_name or ""
+        items.append(
+            {
+                "id": d.id,
+                "event_id": getattr(ev, "id", None),
+                "date": getattr(ev, "event_date", None) or d.uploaded_at,
+                "title": d.summary or type_name or "Document",
+                "type_name": type_name,
+                "specialist": d.spec_name or "",
+                "tags": [name for name in (_tag_name(t) for t in d.tags.all()) if name],
+            }
+        )
+    return items
+
+
+def group_by_month(items) -> list[dict]:
+    """Group one page of rows by month, newest month first."""
+
+    groups = {}
+    for it in items:
+        dt = it["date"]
+        if not dt:
+            key = "nodate"
+            label = "Без дата"
+        else:
+            key = f"{dt.year:04d}-{dt.month:02d}"
+            label = f"{MONTHS_BG[dt.month - 1]},{dt.year}"
+        if key not in groups:
+            groups[key] = {"label": label, "items": []}
+        groups[key]["items"].append(it)
+    ordered = sorted(groups.items(), key=lambda kv: (kv[0] == "nodate", kv[0]), reverse=True)
+    return [
+        {"label": g["label"], "items": g["items"], "count": len(g["items"])}
+        for _, g in ordered
+    ]
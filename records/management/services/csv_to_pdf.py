@@ -1,7 +1,8 @@
 from __future__ import annotations
 import csv
 import io
-from typing import List, Optional
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Sequence
+from xml.sax.saxutils import escape
 
 from reportlab.lib.pagesizes import A4, landscape
 from reportlab.lib import colors
@@ -10,7 +11,8 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph,
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
-from PyPDF2 import PdfReader, PdfWriter
+
+from .pdf_overlay import overlay_template
 
 PRIMARY_DARK = colors.HexColor("#0A4E75")
 TEAL         = colors.HexColor("#43B8CF")
@@ -73,50 +75,119 @@ def _style_table(table: Table, header_font_size: int = 11):
         ("TEXTCOLOR",  (0,0), (-1,0), CREAM),
         ("FONTNAME",   (0,0), (-1,0), f"{_FONT_MAIN}-Bold" if _FONT_MAIN != "Helvetica" else "Helvetica-Bold"),
         ("FONTSIZE",   (0,0), (-1,0), header_font_size),
+        ("FONTNAME",   (0,1), (-1,-1), _FONT_MAIN),
+        ("FONTSIZE",   (0,1), (-1,-1), 8),
         ("GRID",       (0,0), (-1,-1), 0.25, PRIMARY_DARK),
         ("VALIGN", (0,0), (-1,-1), "TOP"),
         ("ROWBACKGROUNDS", (0,1), (-1,-1), [colors.whitesmoke, BLOCK_BG]),
     ]))
 
+_STYLES = getSampleStyleSheet()
+_STYLES.add(ParagraphStyle(
+    name="TitleCyr",
+    parent=_STYLES["Title"],
+    fontName=_FONT_MAIN,
+    fontSize=16,
+    textColor=PRIMARY_DARK,
+    spaceAfter=8,
+))
+_STYLES.add(ParagraphStyle(
+    name="NormalCyr",
+    parent=_STYLES["Normal"],
+    fontName=_FONT_MAIN,
+    fontSize=10,
+))
+_STYLES.add(ParagraphStyle(
+    name="CellCyr",
+    parent=_STYLES["Normal"],
+    fontName=_FONT_MAIN,
+    fontSize=8,
+    leading=10,
+))
+
+REPORT_CHUNK_ROWS = 300
+_WRAP_AT = 24
+
 def _title_paragraph(text: str) -> Paragraph:
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle(
-        name="TitleCyr",
-        parent=styles["Title"],
-        fontName=_FONT_MAIN,
-        fontSize=16,
-        textColor=PRIMARY_DARK,
-        spaceAfter=8,
-    ))
-    return Paragraph(text, styles["TitleCyr"])
+    return Paragraph(text, _STYLES["TitleCyr"])
 
 def _normal_paragraph(text: str) -> Paragraph:
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle(
-        name="NormalCyr",
-        parent=styles["Normal"],
-        fontName=_FONT_MAIN,
-        fontSize=10,
-    ))
-    return Paragraph(text, styles["NormalCyr"])
+    return Paragraph(text, _STYLES["NormalCyr"])
+
+def _cell(value):
+    text = "" if value is None else str(value)
+    if len(text) <= _WRAP_AT:
+        return text
+    return Paragraph(escape(text), _STYLES["CellCyr"])
+
+class _ChunkedStory(list):
+    """Flowable list that pulls the next table chunk only when platypus runs dry.
+
+    ``BaseDocTemplate.build`` consumes the story from the front and checks
+    ``len()`` before each flowable, so at most one chunk of rows is held at a
+    time.
+    """
+
+    def __init__(self, head, chunks: Iterator):
+        super().__init__(head)
+        self._chunks = chunks
+
+    def __len__(self):
+        if not list.__len__(self):
+            chunk = next(self._chunks, None)
+            if chunk is not None:
+                self.append(chunk)
+        return list.__len__(self)
+
+def _table_chunks(header: Sequence, rows: Iterable[Sequence], col_widths, chunk_rows: int) -> Iterator[Table]:
+    head = [str(h) for h in header]
+    batch: List = []
+    emitted = False
+    for row in rows:
+        batch.append([_cell(v) for v in row])
+        if len(batch) >= chunk_rows:
+            yield _chunk_table(head, batch, col_widths)
+            batch = []
+            emitted = True
+    if batch or not emitted:
+        yield _chunk_table(head, batch, col_widths)
+
+def _chunk_table(head, batch, col_widths) -> Table:
+    table = Table([head, *batch], colWidths=col_widths, repeatRows=1)
+    _style_table(table, header_font_size=9)
+    return table
+
+def build_table_report(
+    header: Sequence,
+    rows: Iterable[Sequence],
+    title: str,
+    out: Optional[BinaryIO] = None,
+    chunk_rows: int = REPORT_CHUNK_ROWS,
+    col_widths: Optional[Sequence[float]] = None,
+) -> bytes:
+    """Lay out ``rows`` (any iterable, e.g. a queryset iterator) as a paginated table.
+
+    Rows are turned into tables ``chunk_rows`` at a time, each repeating the
+    header on every page, so memory stays bounded for long histories. Writes to
+    ``out`` when given, otherwise returns the PDF bytes.
+    """
+
+    buf = out if out is not None else io.BytesIO()
+    page_size = landscape(A4)
+    doc = SimpleDocTemplate(buf, pagesize=page_size, rightMargin=12*mm, leftMargin=12*mm, topMargin=12*mm, bottomMargin=12*mm)
+    col_count = max(len(header), 1)
+    if col_widths is None:
+        col_widths = [(page_size[0] - 24*mm) / col_count] * col_count
+    story = _ChunkedStory(
+        [_title_paragraph(escape(title)), Spacer(1, 6)],
+        _table_chunks(header, rows, col_widths, max(1, chunk_rows)),
+    )
+    doc.build(story)
+    return b"" if out is not None else buf.getvalue()
 
 def _build_pdf_from_table(data: List[List[str]], title: str) -> bytes:
-    buf = io.BytesIO()
-    doc = SimpleDocTemplate(buf, pagesize=landscape(A4), rightMargin=12*mm, leftMargin=12*mm, topMargin=12*mm, bottomMargin=12*mm)
-    story: List = []
-    story.append(_title_paragraph(title))
-    story.append(Spacer(1, 6))
-
-    col_count = len(data[0]) if data else 0
-
-    col_widths = [ (landscape(A4)[0] - 24*mm) / max(col_count, 1) ] * max(col_count, 1)
-
-    table = Table(data, colWidths=col_widths, repeatRows=1)
-    _style_table(table, header_font_size=11)
-    story.append(table)
-
-    doc.build(story)
-    return buf.getvalue()
+    header, rows = (data[0], data[1:]) if data else ([], [])
+    return build_table_report(header, rows, title)
 
 def events_csv_to_pdf(csv_file, title: Optional[str] = None) -> bytes:
     rows = _clean_rows(_read_csv(csv_file))
@@ -131,27 +202,7 @@ def labs_csv_to_pdf(csv_file, title: Optional[str] = None) -> bytes:
     return _build_pdf_from_table(rows, title or "Лабораторни резултати")
 
 def _overlay_pages_on_template(generated_pdf_bytes: bytes, template_pdf_path: str) -> bytes:
-
-    try:
-        template_reader = PdfReader(template_pdf_path)
-        template_page = template_reader.pages[0]
-    except Exception:
-
-        return generated_pdf_bytes
-
-    gen_reader = PdfReader(io.BytesIO(generated_pdf_bytes))
-    writer = PdfWriter()
-
-    for i in range(len(gen_reader.pages)):
-        base = template_page
-        overlay = gen_reader.pages[i]
-
-        base.merge_page(overlay)
-        writer.add_page(base)
-
-    out = io.BytesIO()
-    writer.write(out)
-    return out.getvalue()
+    return overlay_template(generated_pdf_bytes, template_pdf_path, repeat_first=True)
 
 def csv_to_pdf_with_template(csv_file, kind: str, template_pdf_path: str, title: Optional[str] = None) -> bytes:
 
@@ -0,0 +1,212 @@
+"""Incrementally maintained per-owner document facet counters.
+
+``DocumentFacetCount`` holds one row per ``(owner, facet, key)`` with the
+number of the owner's documents in that bucket:
+
+* ``category`` / ``specialty`` - from the document's medical event, as the
+  casefiles filters use them;
+* ``doc_type`` - the document type id;
+* ``tag`` - the tag id (one count per document tag);
+* ``year`` - the event date year.
+
+Signals in ``records.signals`` apply +1/-1 deltas when documents are created,
+moved (event, type or event attributes change) or deleted and when tags are
+attached or removed. :func:`rebuild_counts` recomputes everything from scratch
+for the consistency checker.
+"""
+from __future__ import annotations
+
+from collections import Counter
+from typing import Iterable
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import ExtractYear
+
+from records.models import Document, DocumentFacetCount, DocumentTag, MedicalEvent
+
+FACETS = ("category", "specialty", "doc_type", "tag", "year")
+BASE_FIELDS = (
+    "owner_id",
+    "doc_type_id",
+    "medical_event__specialty_id",
+    "medical_event__category_id",
+    "medical_event__event_date",
+)
+
+
+def _keys_from_row(row: dict) -> set[tuple[str, str]]:
+    keys = set()
+    if row.get("doc_type_id"):
+        keys.add(("doc_type", str(row["doc_type_id"])))
+    if row.get("medical_event__specialty_id"):
+        keys.add(("specialty", str(row["medical_event__specialty_id"])))
+    if row.get("medical_event__category_id"):
+        keys.add(("category", str(row["medical_event__category_id"])))
+    if row.get("medical_event__event_date"):
+        keys.add(("year", str(row["medical_event__event_date"].year)))
+    return keys
+
+
+def document_state(document_id) -> tuple[int, set[tuple[str, str]]] | None:
+    """Return ``(owner_id, facet keys)`` of a stored document, tags excluded."""
+
+    row = Document.objects.filter(pk=document_id).values(*BASE_FIELDS).first()
+    if row is None:
+        return None
+    return row["owner_id"], _keys_from_row(row)
+
+
+def event_keys(event_id) -> set[tuple[str, str]]:
+    row = MedicalEvent.objects.filter(pk=event_id).values("specialty_id", "category_id", "event_date").first()
+    if row is None:
+        return set()
+    return _keys_from_row(
+        {
+            "medical_event__specialty_id": row["specialty_id"],
+            "medical_event__category_id": row["category_id"],
+            "medical_event__event_date": row["event_date"],
+        }
+    )
+
+
+def tag_delta(document_ids: Iterable, tag_ids: Iterable, delta: int) -> None:
+    keys = {("tag", str(tag_id)) for tag_id in tag_ids}
+    owners = Document.objects.filter(pk__in=list(document_ids)).values_list("owner_id", flat=True)
+    for owner_id, n in Counter(owners).items():
+        apply_delta(owner_id, keys, delta * n)
+
+
+def apply_delta(owner_id, keys: Iterable[tuple[str, str]], delta: int) -> None:
+    for facet, key in keys:
+        rows = DocumentFacetCount.objects.filter(owner_id=owner_id, facet=facet, key=key)
+        if delta < 0:
+            rows.filter(count__lte=-delta).delete()
+            rows.update(count=F("count") + delta)
+            continue
+        if rows.update(count=F("count") + delta):
+            continue
+        try:
+            with transaction.atomic():
+                DocumentFacetCount.objects.create(owner_id=owner_id, facet=facet, key=key, count=delta)
+        except IntegrityError:
+            rows.update(count=F("count") + delta)
+
+
+def apply_move(before, after) -> None:
+    """Shift counters between two ``document_state`` snapshots (either may be None)."""
+
+    if before == after:
+        return
+    if before and after and before[0] == after[0]:
+        owner_id = before[0]
+        apply_delta(owner_id, before[1] - after[1], -1)
+        apply_delta(owner_id, after[1] - before[1], 1)
+        return
+    if before:
+        apply_delta(before[0], before[1], -1)
+    if after:
+        apply_delta(after[0], after[1], 1)
+
+
+def shift_event_documents(event_id, old_keys: set, new_keys: set) -> None:
+    """Move every document of an event after the event's own attributes changed."""
+
+    removed = old_keys - new_keys
+    added = new_keys - old_keys
+    if not removed and not added:
+        return
+    per_owner = (
+        Document.objects.filter(medical_event_id=event_id)
+        .values("owner_id")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+    for row in per_owner:
+        apply_delta(row["owner_id"], removed, -row["n"])
+        apply_delta(row["owner_id"], added, row["n"])
+
+
+def facet_panels(owner, facets: Iterable[str] = FACETS) -> dict[str, dict[str, int]]:
+    """Return ``{facet: {key: count}}`` for ``owner`` in one query."""
+
+    owner_id = getattr(owner, "pk", owner)
+    panels = {facet: {} for facet in facets}
+    rows = DocumentFacetCount.objects.filter(owner_id=owner_id, facet__in=list(panels)).values_list(
+        "facet", "key", "count"
+    )
+    for facet, key, count in rows:
+        panels[facet][key] = count
+    return panels
+
+
+def compute_counts(owner_ids: Iterable | None = None) -> Counter:
+    """Recount facets from documents: ``{(owner_id, facet, key): count}``."""
+
+    docs = Document.objects.all()
+    tags = DocumentTag.objects.all()
+    if owner_ids is not None:
+        owner_ids = list(owner_ids)
+        docs = docs.filter(owner_id__in=owner_ids)
+        tags = tags.filter(document__owner_id__in=owner_ids)
+    counts = Counter()
+    for facet, field in (
+        ("doc_type", "doc_type_id"),
+        ("specialty", "medical_event__specialty_id"),
+        ("category", "medical_event__category_id"),
+    ):
+        for row in docs.exclude(**{f"{field}__isnull": True}).values("owner_id", field).annotate(n=Count("id")).order_by():
+            counts[(row["owner_id"], facet, str(row[field]))] += row["n"]
+    years = (
+        docs.exclude(medical_event__event_date__isnull=True)
+        .annotate(y=ExtractYear("medical_event__event_date"))
+        .values("owner_id", "y")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+    for row in years:
+        counts[(row["owner_id"], "year", str(row["y"]))] += row["n"]
+    for row in tags.values("document__owner_id", "tag_id").annotate(n=Count("id")).order_by():
+        counts[(row["document__owner_id"], "tag", str(row["tag_id"]))] += row["n"]
+    return counts
+
+
+def stored_counts(owner_ids: Iterable | None = None) -> Counter:
+    qs = DocumentFacetCount.objects.all()
+    if owner_ids is not None:
+        qs = qs.filter(owner_id__in=list(owner_ids))
+    return Counter(
+        {(r.owner_id, r.facet, r.key): r.count for r in qs.only("owner_id", "facet", "key", "count")}
+    )
+
+
+def find_drift(owner_ids: Iterable | None = None) -> list[tuple]:
+    """Return ``(owner_id, facet, key, stored, expected)`` for every mismatching counter."""
+
+    owner_ids = list(owner_ids) if owner_ids is not None else None
+    expected = compute_counts(owner_ids)
+    stored = stored_counts(owner_ids)
+    drift = []
+    for ident in sorted(set(expected) | set(stored), key=lambda k: (k[0], k[1], k[2])):
+        if expected.get(ident, 0) != stored.get(ident, 0):
+            drift.append((*ident, stored.get(ident, 0), expected.get(ident, 0)))
+    return drift
+
+
+@transaction.atomic
+def rebuild_counts(owner_ids: Iterable | None = None) -> int:
+    owner_ids = list(owner_ids) if owner_ids is not None else None
+    expected = compute_counts(owner_ids)
+    existing = DocumentFacetCount.objects.all()
+    if owner_ids is not None:
+        existing = existing.filter(owner_id__in=owner_ids)
+    existing.delete()
+    DocumentFacetCount.objects.bulk_create(
+        [
+            DocumentFacetCount(owner_id=owner_id, facet=facet, key=key, count=count)
+            for (owner_id, facet, key), count in expected.items()
+            if count > 0
+        ],
+        batch_size=1000,
+    )
+    return len(expected)
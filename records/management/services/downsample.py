@@ -0,0 +1,101 @@
+"""Series reduction for lab charts.
+
+Both reducers take points as ``(x, y, ...)`` tuples sorted by ``x`` (numeric
+timestamps) and return a subset of the original tuples, always keeping the
+first and the last one so the visible range does not shrink. Extra tuple
+items are carried through untouched.
+"""
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Sequence
+
+METHODS = ("lttb", "minmax")
+
+
+def lttb(points: Sequence[tuple], threshold: int) -> list[tuple]:
+    """Largest-Triangle-Three-Buckets downsampling."""
+
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        avg_start = int((i + 1) * bucket_size) + 1
+        avg_end = min(int((i + 2) * bucket_size) + 1, n)
+        avg_len = max(avg_end - avg_start, 1)
+        avg_x = sum(p[0] for p in points[avg_start:avg_end]) / avg_len
+        avg_y = sum(p[1] for p in points[avg_start:avg_end]) / avg_len
+
+        range_start = int(i * bucket_size) + 1
+        range_end = int((i + 1) * bucket_size) + 1
+        ax, ay = points[a][0], points[a][1]
+        max_area = -1.0
+        next_a = range_start
+        for j in range(range_start, range_end):
+            x, y = points[j][0], points[j][1]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                next_a = j
+        sampled.append(points[next_a])
+        a = next_a
+    sampled.append(points[-1])
+    return sampled
+
+
+def minmax_buckets(points: Sequence[tuple], threshold: int) -> list[tuple]:
+    """Keep the minimum and maximum of each bucket, preserving spikes."""
+
+    n = len(points)
+    if threshold >= n or threshold < 4:
+        return list(points)
+
+    inner = points[1:-1]
+    buckets = max((threshold - 2) // 2, 1)
+    size = len(inner) / buckets
+    out = [points[0]]
+    for b in range(buckets):
+        chunk = inner[int(b * size):int((b + 1) * size)]
+        if not chunk:
+            continue
+        lo = min(range(len(chunk)), key=lambda k: chunk[k][1])
+        hi = max(range(len(chunk)), key=lambda k: chunk[k][1])
+        for k in sorted({lo, hi}):
+            out.append(chunk[k])
+    out.append(points[-1])
+    return out
+
+
+def _epoch(value: str) -> float:
+    return datetime.fromisoformat(value).timestamp()
+
+
+def reduce_series(
+    timestamps: Sequence[str],
+    values: Sequence[float],
+    target: int,
+    method: str = "lttb",
+    start: datetime | None = None,
+    end: datetime | None = None,
+) -> tuple[list[dict], int]:
+    """Clip a stored series to ``[start, end]`` and reduce it to ``target`` points.
+
+    Returns the chart points as ``{"x": iso, "y": value}`` dicts and the number
+    of points inside the range before reduction.
+    """
+
+    xs = [_epoch(ts) for ts in timestamps]
+    lo = bisect_left(xs, start.timestamp()) if start else 0
+    hi = bisect_right(xs, end.timestamp()) if end else len(xs)
+    indexed = [(xs[i], float(values[i]), i) for i in range(lo, hi)]
+    in_range = len(indexed)
+
+    reducer = minmax_buckets if method == "minmax" else lttb
+    kept = reducer(indexed, target)
+    series = [{"x": timestamps[i], "y": y} for _, y, i in kept]
+    return series, in_range
@@ -0,0 +1,151 @@
+"""Render-once storage for generated PDF exports.
+
+An export artifact is identified by ``(kind, object id, scope, language,
+version)``. The version combines the owner's records version (see
+``record_versions``, bumped by signals on every document, event and lab
+change) with the modification time of the letterhead template. That way an
+edit to any of the owner's records, or a new template, produces a new artifact
+name instead of serving a stale file. Artifacts live on ``default_storage``
+under ``EXPORT_ARTIFACT_DIR``; storing a new version removes the older files
+of the same object.
+
+Render times and hit/miss counters are kept in the cache and exposed through
+:func:`export_metrics`.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .record_versions import record_version
+
+log = logging.getLogger("records.exports")
+
+METRICS_PREFIX = "exportmetrics"
+METRIC_NAMES = ("hits", "misses", "not_modified", "render_ms")
+
+
+def _root() -> str:
+    return getattr(settings, "EXPORT_ARTIFACT_DIR", "exports").strip("/")
+
+
+def _template_stamp(template_path: str | None) -> str:
+    try:
+        return str(int(os.path.getmtime(template_path)))
+    except (OSError, TypeError):
+        return "0"
+
+
+@dataclass(frozen=True)
+class ExportArtifact:
+    kind: str
+    object_id: int
+    scope: str
+    lang: str
+    version: str
+
+    @property
+    def directory(self) -> str:
+        return f"{_root()}/{self.kind}/{self.object_id}"
+
+    @property
+    def prefix(self) -> str:
+        return f"{self.scope}-{self.lang}-"
+
+    @property
+    def path(self) -> str:
+        return f"{self.directory}/{self.prefix}{self.version}.pdf"
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.kind}-{self.object_id}-{self.scope}-{self.lang}-{self.version}"'
+
+
+def export_artifact(kind: str, object_id, owner, *, lang: str, template_path: str | None = None, scope: str = "full") -> ExportArtifact:
+    version = f"{record_version(owner)}-{_template_stamp(template_path)}"
+    return ExportArtifact(kind=kind, object_id=int(object_id), scope=scope, lang=(lang or "bg").lower(), version=version)
+
+
+def has_artifact(artifact: ExportArtifact) -> bool:
+    try:
+        return default_storage.exists(artifact.path)
+    except OSError:
+        return False
+
+
+def open_artifact(artifact: ExportArtifact):
+    """Return an open file for a stored artifact, or None."""
+
+    try:
+        if default_storage.exists(artifact.path):
+            return default_storage.open(artifact.path, "rb")
+    except OSError:
+        log.warning("export artifact unreadable: %s", artifact.path)
+    return None
+
+
+def store_artifact(artifact: ExportArtifact, data: bytes) -> None:
+    try:
+        if not default_storage.exists(artifact.path):
+            default_storage.save(artifact.path, ContentFile(data))
+        _, files = default_storage.listdir(artifact.directory)
+    except (OSError, NotImplementedError):
+        log.warning("export artifact not stored: %s", artifact.path, exc_info=True)
+        return
+    current = artifact.path.rsplit("/", 1)[-1]
+    for name in files:
+        if name.startswith(artifact.prefix) and name != current:
+            try:
+                default_storage.delete(f"{artifact.directory}/{name}")
+            except OSError:
+                continue
+
+
+def render_artifact(artifact: ExportArtifact, render: Callable[[], bytes]) -> bytes:
+    """Run ``render``, store the result and record its render time."""
+
+    started = time.perf_counter()
+    data = render()
+    elapsed_ms = int((time.perf_counter() - started) * 1000)
+    _incr(artifact.kind, "misses")
+    _incr(artifact.kind, "render_ms", elapsed_ms)
+    log.info("export rendered kind=%s id=%s lang=%s ms=%s", artifact.kind, artifact.object_id, artifact.lang, elapsed_ms)
+    store_artifact(artifact, data)
+    return data
+
+
+def record_hit(artifact: ExportArtifact, not_modified: bool = False) -> None:
+    _incr(artifact.kind, "not_modified" if not_modified else "hits")
+
+
+def _metric_key(kind: str, name: str) -> str:
+    return f"{METRICS_PREFIX}:{kind}:{name}"
+
+
+def _incr(kind: str, name: str, amount: int = 1) -> None:
+    key = _metric_key(kind, name)
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        if not cache.add(key, amount, timeout=None):
+            cache.incr(key, amount)
+
+
+def export_metrics(kind: str) -> dict:
+    """Return hit/miss counters, hit rate and average render time for ``kind``."""
+
+    values = cache.get_many([_metric_key(kind, name) for name in METRIC_NAMES])
+    metrics = {name: int(values.get(_metric_key(kind, name)) or 0) for name in METRIC_NAMES}
+    served = metrics["hits"] + metrics["not_modified"]
+    total = served + metrics["misses"]
+    metrics["hit_rate"] = round(served / total, 4) if total else 0.0
+    metrics["avg_render_ms"] = round(metrics["render_ms"] / metrics["misses"], 1) if metrics["misses"] else 0.0
+    return metrics
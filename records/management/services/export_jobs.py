@@ -0,0 +1,230 @@
+"""Background rendering of large PDF/PNG exports.
+
+WeasyPrint is CPU-bound, so renders run on a bounded ``ProcessPoolExecutor``
+(``EXPORT_WORKERS`` processes, created on first use). Workers are spawned
+rather than forked, so they never inherit the web process's threads or open
+database connections. The request thread only
+builds the HTML (which needs the database) and submits it. The worker process
+turns it into PDF or PNG bytes and applies the letterhead. WeasyPrint only
+writes PDF, so PNGs are the rendered PDF rasterized with pypdfium2 at
+``EXPORT_PNG_DPI`` with the pages stacked top to bottom.
+
+Job state lives in the ``EXPORT_JOB_CACHE`` alias under ``exportjob:<id>`` with status ``queued``,
+``running``, ``done`` or ``failed``. Finished files are written to
+``default_storage``, either as the export artifact passed in (see
+``export_artifacts``) or under ``<EXPORT_ARTIFACT_DIR>/jobs/``.
+``EXPORT_WORKERS = 0`` renders inline, which is handy for development and
+tests.
+"""
+from __future__ import annotations
+
+import io
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .export_artifacts import ExportArtifact, store_artifact
+from .pdf_overlay import overlay_template
+
+log = logging.getLogger("records.exports")
+
+CACHE_PREFIX = "exportjob"
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+_executor: ProcessPoolExecutor | None = None
+_executor_lock = threading.Lock()
+_futures: dict[str, Future] = {}
+
+
+def render_html(kind: str, html: str, base_url: str, template_path: str | None = None) -> bytes:
+    """Render HTML to ``pdf`` or ``png`` bytes; runs inside a worker process."""
+
+    from weasyprint import HTML
+
+    pdf_bytes = HTML(string=html, base_url=base_url).write_pdf()
+    if template_path:
+        pdf_bytes = overlay_template(pdf_bytes, template_path)
+    return rasterize_pdf(pdf_bytes) if kind == "png" else pdf_bytes
+
+
+def rasterize_pdf(pdf_bytes: bytes, dpi: int | None = None) -> bytes:
+    """Render every page of ``pdf_bytes`` into one PNG, pages stacked vertically."""
+
+    import pypdfium2
+    from PIL import Image
+
+    scale = (dpi or int(getattr(settings, "EXPORT_PNG_DPI", 96))) / 72
+    pdf = pypdfium2.PdfDocument(pdf_bytes)
+    try:
+        pages = [page.render(scale=scale).to_pil().convert("RGB") for page in pdf]
+    finally:
+        pdf.close()
+    image = Image.new("RGB", (max(p.width for p in pages), sum(p.height for p in pages)), "white")
+    top = 0
+    for page in pages:
+        image.paste(page, (0, top))
+        top += page.height
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+    return out.getvalue()
+
+
+def _workers() -> int:
+    return int(getattr(settings, "EXPORT_WORKERS", 2))
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "EXPORT_JOB_TTL", 3600))
+
+
+def _cache():
+    return caches[getattr(settings, "EXPORT_JOB_CACHE", "default")]
+
+
+def _init_worker() -> None:
+    django.setup()
+
+
+def _executor_instance() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=max(1, _workers()),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return _executor
+
+
+def _submit(*args) -> Future:
+    if _workers() <= 0:
+        future: Future = Future()
+        try:
+            future.set_result(render_html(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+    return _executor_instance().submit(render_html, *args)
+
+
+def render_now(kind: str, html: str, base_url: str, template_path: str | None = None, timeout: float | None = None) -> bytes:
+    """Render on the worker pool and wait; raises on failure or timeout.
+
+    Keeps short renders synchronous while bounding how many run at once.
+    """
+
+    timeout = timeout if timeout is not None else getattr(settings, "EXPORT_SYNC_TIMEOUT", 20)
+    return _submit(kind, html, base_url, template_path).result(timeout=timeout)
+
+
+def _cache_key(job_id: str) -> str:
+    return f"{CACHE_PREFIX}:{job_id}"
+
+
+def _artifact_key(artifact: ExportArtifact) -> str:
+    return f"{CACHE_PREFIX}:artifact:{artifact.path}"
+
+
+def _update(job_id: str, **fields) -> dict:
+    cache = _cache()
+    job = cache.get(_cache_key(job_id)) or {}
+    job.update(fields)
+    cache.set(_cache_key(job_id), job, timeout=_ttl())
+    return job
+
+
+def submit_job(
+    owner,
+    kind: str,
+    html: str,
+    base_url: str,
+    filename: str,
+    template_path: str | None = None,
+    artifact: ExportArtifact | None = None,
+) -> str:
+    """Queue a render and return its job id.
+
+    A render for an artifact that is already queued or running returns the
+    existing job instead of starting another one.
+    """
+
+    if artifact is not None:
+        pending = _cache().get(_artifact_key(artifact))
+        if pending and (job_status(pending) or {}).get("status") in (STATUS_QUEUED, STATUS_RUNNING):
+            return pending
+    job_id = uuid.uuid4().hex
+    _update(
+        job_id,
+        id=job_id,
+        owner=getattr(owner, "pk", owner),
+        kind=kind,
+        filename=filename,
+        status=STATUS_QUEUED,
+        path="",
+        error="",
+        queued_at=time.time(),
+    )
+    if artifact is not None:
+        _cache().set(_artifact_key(artifact), job_id, timeout=_ttl())
+    future = _submit(kind, html, base_url, template_path)
+    _futures[job_id] = future
+    future.add_done_callback(lambda f: _finish(job_id, f, artifact))
+    return job_id
+
+
+def _finish(job_id: str, future: Future, artifact: ExportArtifact | None) -> None:
+    _futures.pop(job_id, None)
+    try:
+        data = future.result()
+    except Exception as exc:
+        log.warning("export job %s failed: %s", job_id, exc)
+        _update(job_id, status=STATUS_FAILED, error=str(exc) or exc.__class__.__name__, finished_at=time.time())
+        return
+    job = _cache().get(_cache_key(job_id)) or {}
+    if artifact is not None:
+        store_artifact(artifact, data)
+        path = artifact.path
+    else:
+        extension = "png" if job.get("kind") == "png" else "pdf"
+        root = getattr(settings, "EXPORT_ARTIFACT_DIR", "exports").strip("/")
+        path = default_storage.save(f"{root}/jobs/{job_id}.{extension}", ContentFile(data))
+    elapsed = time.time() - job.get("queued_at", time.time())
+    log.info("export job %s done kind=%s bytes=%s s=%.1f", job_id, job.get("kind"), len(data), elapsed)
+    _update(job_id, status=STATUS_DONE, path=path, size=len(data), finished_at=time.time())
+
+
+def job_status(job_id: str, owner=None) -> dict | None:
+    """Return the job record (None if unknown or owned by someone else)."""
+
+    job = _cache().get(_cache_key(job_id))
+    if not job:
+        return None
+    if owner is not None and job.get("owner") != getattr(owner, "pk", owner):
+        return None
+    future = _futures.get(job_id)
+    if job.get("status") == STATUS_QUEUED and future is not None and future.running():
+        job = dict(job, status=STATUS_RUNNING)
+    return job
+
+
+def open_job_result(job: dict):
+    if job.get("status") != STATUS_DONE or not job.get("path"):
+        return None
+    try:
+        return default_storage.open(job["path"], "rb")
+    except OSError:
+        return None
+
@@ -0,0 +1,177 @@
+"""Streaming ingest of uploaded documents.
+
+:class:`HashingFile` wraps an uploaded file, or the decoded chunks of a base64
+JSON upload, and computes the SHA-256 digest, byte size and a sniffed MIME
+type while it is read, so a base64 payload is never decoded into memory as a
+whole. :func:`find_duplicate` is the ``(owner, content_hash)`` lookup. Both the
+OCR and the confirm endpoints hash a file and check it first: a duplicate is
+answered before any OCR is spent or anything is written to storage.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import mimetypes
+import re
+from typing import Iterator
+
+from django.core.files.base import File
+
+from records.models import Document
+
+CHUNK_SIZE = 64 * 1024
+HEAD_SIZE = 16
+GENERIC_MIME = "application/octet-stream"
+
+_BASE64_RE = re.compile(r"[A-Za-z0-9+/ \t\r\n]*(?:=[ \t\r\n]*){0,2}")
+_WHITESPACE = (" ", "\t", "\r", "\n")
+
+_SIGNATURES = (
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"BM", "image/bmp"),
+)
+
+
+def sniff_mime(head: bytes, name: str = "", declared: str | None = None) -> str:
+    """Detect the MIME type from the leading bytes, then the declared type, then the name."""
+
+    for signature, mime in _SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    declared = (declared or "").strip().lower()
+    if declared and declared != GENERIC_MIME:
+        return declared
+    return mimetypes.guess_type(name or "")[0] or GENERIC_MIME
+
+
+def _iter_base64(text: str, chunk_size: int) -> Iterator[bytes]:
+    step = max(4, chunk_size // 3 * 4)
+    carry = ""
+    for start in range(0, len(text), step):
+        piece = carry + "".join(text[start:start + step].split())
+        cut = len(piece) - len(piece) % 4
+        if cut:
+            yield base64.b64decode(piece[:cut])
+        carry = piece[cut:]
+
+
+def _validate_base64(text: str) -> None:
+    if not _BASE64_RE.fullmatch(text):
+        raise ValueError("invalid base64 payload")
+    significant = len(text) - sum(text.count(ch) for ch in _WHITESPACE)
+    if not significant or significant % 4:
+        raise ValueError("incorrect base64 padding")
+
+
+def base64_chunks(text: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Validate ``text`` and return an iterator decoding it slice by slice.
+
+    Raises ``ValueError`` for characters outside the base64 alphabet or a
+    wrong length, before anything is decoded.
+    """
+
+    _validate_base64(text)
+    return _iter_base64(text, chunk_size)
+
+
+class HashingFile(File):
+    """A ``File`` that hashes, measures and sniffs its content while it is read.
+
+    ``source`` is a file object (an ``UploadedFile``), a callable returning
+    an iterable of ``bytes`` chunks, or such an iterable; a plain iterable can
+    only be consumed once. ``sha256``, ``size`` and ``content_type`` describe
+    the content once :meth:`chunks` has been exhausted, e.g. by
+    :meth:`consume` or ``storage.save()``.
+    """
+
+    def __init__(self, source, name: str, content_type: str | None = None):
+        is_file = hasattr(source, "read")
+        super().__init__(source if is_file else None, name=name or "document.bin")
+        self._chunks_source = None if is_file else source
+        self.declared_type = content_type
+        self.complete = False
+        self._reset()
+
+    def _reset(self) -> None:
+        self._hasher = hashlib.sha256()
+        self._size = 0
+        self._head = b""
+
+    def chunks(self, chunk_size=None):
+        chunk_size = chunk_size or CHUNK_SIZE
+        if self.file is not None:
+            source = self.file.chunks(chunk_size) if hasattr(self.file, "chunks") else super().chunks(chunk_size)
+        elif callable(self._chunks_source):
+            source = self._chunks_source()
+        elif self.complete:
+            raise ValueError("stream already consumed")
+        else:
+            source = self._chunks_source
+        self._reset()
+        for chunk in source:
+            self._hasher.update(chunk)
+            self._size += len(chunk)
+            if len(self._head) < HEAD_SIZE:
+                self._head += chunk[:HEAD_SIZE - len(self._head)]
+            yield chunk
+        self.complete = True
+
+    def multiple_chunks(self, chunk_size=None):
+        return True
+
+    def consume(self) -> "HashingFile":
+        for _ in self.chunks():
+            pass
+        return self
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    @property
+    def size(self) -> int:
+        if self.complete:
+            return self._size
+        return getattr(self.file, "size", None) or self._size
+
+    @property
+    def sha256(self) -> str:
+        if not self.complete:
+            raise ValueError("content has not been read yet")
+        return self._hasher.hexdigest()
+
+    @property
+    def content_type(self) -> str:
+        return sniff_mime(self._head, self.name, self.declared_type)
+
+
+def hashing_upload(upload) -> HashingFile:
+    return HashingFile(upload, getattr(upload, "name", "") or "", getattr(upload, "content_type", None))
+
+
+def hashing_base64(text: str, name: str, content_type: str | None = None) -> HashingFile:
+    _validate_base64(text)
+    return HashingFile(lambda: _iter_base64(text, CHUNK_SIZE), name, content_type)
+
+
+def find_duplicate(owner, digest: str):
+    """Return the newest document of ``owner`` with this content hash, or None.
+
+    Documents stored before ``content_hash`` existed are matched on ``sha256``.
+    """
+
+    if not digest:
+        return None
+    documents = Document.objects.filter(owner=owner).order_by("-id")
+    return (
+        documents.filter(content_hash=digest).first()
+        or documents.filter(content_hash__isnull=True, sha256=digest).first()
+    )
@@ -0,0 +1,79 @@
+"""Per-patient lab indicator facets for the labs, export and share filters.
+
+A facet is ``{"slug", "label", "count", "last_measured"}`` for every indicator
+the patient has measurements for. The patient-wide list is computed with one
+grouped query and kept in the Django cache per language; measurement writes
+and deletes drop it through :func:`invalidate_indicator_facets`.
+"""
+from __future__ import annotations
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils.translation import get_language
+
+from records.models import LabTestMeasurement
+
+from .lab_series import FALLBACK_LANGUAGE, indicator_name_expression
+
+CACHE_PREFIX = "labfacets"
+
+
+def _languages() -> set[str]:
+    languages = {code.lower() for code, _ in getattr(settings, "LANGUAGES", ())}
+    languages.add(FALLBACK_LANGUAGE)
+    return languages
+
+
+def _cache_key(patient_id, lang: str) -> str:
+    return f"{CACHE_PREFIX}:{patient_id}:{lang}"
+
+
+def _compute(patient_id, lang: str, event_id=None) -> list[dict]:
+    qs = LabTestMeasurement.objects.filter(medical_event__patient_id=patient_id)
+    if event_id is not None:
+        qs = qs.filter(medical_event_id=event_id)
+    rows = (
+        qs.values("indicator_id", "indicator__slug")
+        .annotate(
+            count=Count("id"),
+            last_measured=Max("measured_at"),
+            label=indicator_name_expression(lang),
+        )
+        .order_by()
+    )
+    facets = [
+        {
+            "slug": row["indicator__slug"],
+            "label": (row["label"] or row["indicator__slug"] or "").strip(),
+            "count": row["count"],
+            "last_measured": row["last_measured"],
+        }
+        for row in rows
+    ]
+    facets.sort(key=lambda f: (f["label"].lower(), f["slug"]))
+    return facets
+
+
+def indicator_facets(patient, event=None, lang: str | None = None) -> list[dict]:
+    """Return the patient's indicator facets sorted by localized label.
+
+    Event-scoped facets are computed directly; the patient-wide list is cached.
+    """
+
+    patient_id = getattr(patient, "pk", patient)
+    lang = (lang or get_language() or FALLBACK_LANGUAGE).lower()
+    if lang not in _languages():
+        lang = FALLBACK_LANGUAGE
+    if event is not None:
+        return _compute(patient_id, lang, event_id=getattr(event, "pk", event))
+    key = _cache_key(patient_id, lang)
+    facets = cache.get(key)
+    if facets is None:
+        facets = _compute(patient_id, lang)
+        cache.set(key, facets, timeout=getattr(settings, "LAB_FACET_CACHE_TIMEOUT", 3600))
+    return facets
+
+
+def invalidate_indicator_facets(patient_id) -> None:
+    cache.delete_many([_cache_key(patient_id, lang) for lang in _languages()])
@@ -0,0 +1,363 @@
+"""Bulk import of lab indicators from vendor CSV catalogs.
+
+The encoding is detected once, on a leading sample of the file, and the
+catalog is then streamed row by row: :func:`read_catalog` hands back a lazy
+iterator, so only the current row is held in memory while rows are matched
+against indicator names, slugs and aliases loaded once up front.
+:func:`plan_import` turns them into an :class:`ImportPlan` (the creates,
+updates and conflicts plus a human-readable diff) without touching the
+database. :func:`apply_plan` writes that plan with ``bulk_create`` /
+``bulk_update``.
+"""
+from __future__ import annotations
+
+import codecs
+import csv
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
+from uuid import uuid4
+
+from django.utils.text import slugify
+
+from records.models import LabIndicator, LabIndicatorAlias, Tag, TagKind
+
+ENCODINGS = ("utf-8-sig", "utf-8", "cp1251", "cp1250", "windows-1252", "iso-8859-1")
+SEPS = [",", ";", "|", "/"]
+LANGUAGES = (("bg", "name_bg"), ("en-us", "name_en"))
+INDICATOR_FIELDS = ("unit", "reference_low", "reference_high")
+SAMPLE_SIZE = 64 * 1024
+
+
+def split_aliases(val: str) -> list[str]:
+    if not val:
+        return []
+    s = val
+    for sep in SEPS[1:]:
+        s = s.replace(sep, SEPS[0])
+    parts = [p.strip() for p in s.split(SEPS[0])]
+    return [p for p in parts if p]
+
+
+def float_or_none(x):
+    if x in (None, ""):
+        return None
+    try:
+        return float(str(x).replace(",", "."))
+    except Exception:
+        return None
+
+
+@dataclass
+class IndicatorRow:
+    name_bg: str
+    name_en: str
+    unit: str
+    reference_low: float | None
+    reference_high: float | None
+    aliases: list[str]
+
+
+class _Columns:
+    """Resolves the accepted header aliases of a catalog once."""
+
+    def __init__(self, fieldnames: list[str]):
+        self.fieldnames = fieldnames
+        self.headers_lower = [h.strip().lower() for h in fieldnames]
+        self.header_map = {h.strip().lower(): h for h in fieldnames}
+
+        self.name_bg = self.first(["name_bg", "bg", "namebg"])
+        self.name_en = self.first(["name_en", "en", "nameen"])
+        self.std_name_full = self.first(["standard name - full"])
+        self.std_name_abbrev = self.first(["standard name - abbrev"])
+        self.abbrev = self.all(["abbrev"])
+        self.aliases = self.first(["aliases", "alias", "aka"])
+        self.units = [c for c in fieldnames if "units" in c.strip().lower()]
+        self.low = [
+            self.first(["reference_low", "ref_low", "low"]),
+            self.first(["ref low male"]),
+            self.first(["ref low female"]),
+        ]
+        self.high = [
+            self.first(["reference_high", "ref_high", "high"]),
+            self.first(["ref high male"]),
+            self.first(["ref high female"]),
+        ]
+        if not (self.name_bg or self.name_en or self.std_name_full or self.std_name_abbrev):
+            raise ValueError(
+                "CSV must contain at least one of: name_bg, name_en, 'Standard Name - Full', 'Standard Name - Abbrev'."
+            )
+
+    def first(self, names: Iterable[str]) -> str | None:
+        for n in names:
+            key = n.strip().lower()
+            if key in self.header_map:
+                return self.header_map[key]
+        return None
+
+    def all(self, contains: Iterable[str]) -> list[str]:
+        tokens = [t.lower() for t in contains]
+        return [self.fieldnames[i] for i, low in enumerate(self.headers_lower) if all(t in low for t in tokens)]
+
+    @staticmethod
+    def _value(row, column) -> str:
+        return (row.get(column) or "").strip() if column else ""
+
+    def _first_value(self, row, columns) -> str:
+        for column in columns:
+            value = self._value(row, column)
+            if value:
+                return value
+        return ""
+
+    def parse(self, row) -> IndicatorRow | None:
+        name_bg = self._value(row, self.name_bg)
+        name_en = self._first_value(row, [self.name_en, self.std_name_full, self.std_name_abbrev])
+        if not (name_bg or name_en):
+            return None
+        aliases = [v for v in (self._value(row, c) for c in self.abbrev) if v]
+        if self.aliases:
+            aliases += split_aliases(row.get(self.aliases) or "")
+        return IndicatorRow(
+            name_bg=name_bg,
+            name_en=name_en,
+            unit=self._first_value(row, self.units),
+            reference_low=float_or_none(self._first_value(row, self.low)),
+            reference_high=float_or_none(self._first_value(row, self.high)),
+            aliases=aliases,
+        )
+
+
+def _parse(fh) -> Iterator[IndicatorRow]:
+    sample = fh.read(4096)
+    fh.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=";,|\t,")
+    except Exception:
+        dialect = csv.excel
+    reader = csv.DictReader(fh, dialect=dialect)
+    if not reader.fieldnames:
+        raise ValueError("CSV has no header.")
+    columns = _Columns(reader.fieldnames)
+    for row in reader:
+        parsed = columns.parse(row)
+        if parsed:
+            yield parsed
+
+
+def detect_encoding(path, sample_size: int = SAMPLE_SIZE) -> str:
+    """First of :data:`ENCODINGS` that strictly decodes the leading sample of ``path``."""
+
+    with open(path, "rb") as fh:
+        sample = fh.read(sample_size)
+    final = len(sample) < sample_size
+    for encoding in ENCODINGS[:-1]:
+        try:
+            # Incremental so a multi-byte sequence cut at the sample edge is not an error.
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=final)
+        except UnicodeDecodeError:
+            continue
+        return encoding
+    return ENCODINGS[-1]
+
+
+def _stream(path, encoding: str) -> Iterator[IndicatorRow]:
+    errors = "replace" if encoding == ENCODINGS[-1] else "strict"
+    with open(path, encoding=encoding, errors=errors, newline="") as fh:
+        try:
+            yield from _parse(fh)
+        except UnicodeDecodeError as exc:
+            raise ValueError(f"CSV is not valid {encoding} past the first {SAMPLE_SIZE} bytes: {exc.reason}.")
+
+
+def read_catalog(path) -> tuple[str, Iterator[IndicatorRow]]:
+    """Detect the encoding of ``path``; returns ``(encoding, rows)``.
+
+    ``rows`` is lazy: the file is opened and parsed as it is consumed, and a
+    bad header or an undecodable byte surfaces as :class:`ValueError` then.
+    """
+
+    encoding = detect_encoding(path)
+    return encoding, _stream(path, encoding)
+
+
+class _SlugAllocator:
+    def __init__(self, taken: Iterable[str]):
+        self.taken = set(taken)
+        self.next_index: dict[str, int] = {}
+
+    def allocate(self, base_text: str | None) -> str:
+        base = (base_text or "").strip()
+        s = slugify(base)[:255] if base else ""
+        if not s:
+            s = f"indicator-{uuid4().hex[:12]}"
+        candidate = s
+        idx = self.next_index.get(s, 1)
+        while candidate in self.taken:
+            suffix = f"-{idx}"
+            candidate = f"{s[: max(0, 255 - len(suffix))]}{suffix}"
+            idx += 1
+            if idx > 9999:
+                candidate = f"{s[:242]}-{uuid4().hex[:12]}"
+                break
+        self.next_index[s] = idx
+        self.taken.add(candidate)
+        return candidate
+
+
+@dataclass
+class ImportPlan:
+    encoding: str = ""
+    created: list = field(default_factory=list)
+    names: dict = field(default_factory=dict)
+    updated: dict = field(default_factory=dict)
+    updated_fields: set = field(default_factory=set)
+    updated_rows: int = 0
+    new_translations: list = field(default_factory=list)
+    changed_translations: dict = field(default_factory=dict)
+    aliases: list = field(default_factory=list)
+    alias_conflicts: int = 0
+    touched: dict = field(default_factory=dict)
+    diff: list = field(default_factory=list)
+
+    def summary(self) -> str:
+        return (
+            f"Detected encoding={self.encoding}; Indicators created={len(self.created)} updated={self.updated_rows} "
+            f"aliases_added={len(self.aliases)} alias_conflicts_skipped={self.alias_conflicts}"
+        )
+
+
+def plan_import(rows: Iterable[IndicatorRow], *, update: bool = False, encoding: str = "") -> ImportPlan:
+    """Match ``rows`` against the current indicators and describe the changes."""
+
+    translation_model = LabIndicator._parler_meta.root_model
+    indicators = {ind.pk: ind for ind in LabIndicator.objects.order_by("pk")}
+    slugs = _SlugAllocator(ind.slug for ind in indicators.values())
+    translations = {}
+    by_name: dict[str, LabIndicator] = {}
+    for tr in translation_model.objects.order_by("master_id", "pk").only("pk", "master_id", "language_code", "name"):
+        translations[(tr.master_id, tr.language_code)] = tr
+        by_name.setdefault((tr.name or "").lower(), indicators[tr.master_id])
+    alias_owner = {}
+    for norm, indicator_id in LabIndicatorAlias.objects.order_by("pk").values_list("normalized", "indicator_id"):
+        alias_owner.setdefault(norm, indicators.get(indicator_id))
+
+    plan = ImportPlan(encoding=encoding)
+    for row in rows:
+        ind = by_name.get(row.name_bg.lower()) if row.name_bg else None
+        if ind is None and row.name_en:
+            ind = by_name.get(row.name_en.lower())
+
+        if ind is None:
+            ind = LabIndicator(
+                slug=slugs.allocate(row.name_en or row.name_bg),
+                unit=row.unit or "",
+                reference_low=row.reference_low,
+                reference_high=row.reference_high,
+            )
+            names = {lang: getattr(row, attr) for lang, attr in LANGUAGES if getattr(row, attr)}
+            plan.created.append(ind)
+            plan.names[id(ind)] = names
+            for name in names.values():
+                by_name.setdefault(name.lower(), ind)
+            plan.diff.append(
+                f"+ indicator {ind.slug}: "
+                + ", ".join(f"{lang}={name!r}" for lang, name in names.items())
+                + f", unit={ind.unit!r}, range={ind.reference_low}..{ind.reference_high}"
+            )
+        elif update:
+            _plan_update(plan, ind, row, translations, translation_model, by_name)
+        plan.touched[id(ind)] = ind
+
+        for raw in row.aliases:
+            key = (raw or "").strip()
+            if not key:
+                continue
+            norm = slugify(key)[:255]
+            owner = alias_owner.get(norm)
+            if owner is not None:
+                if owner is not ind:
+                    plan.alias_conflicts += 1
+                    plan.diff.append(f"! alias {key!r}: already belongs to {owner.slug}")
+                continue
+            alias_owner[norm] = ind
+            plan.aliases.append((ind, key, norm))
+            plan.diff.append(f"+ alias {key!r} -> {ind.slug}")
+    return plan
+
+
+def _plan_update(plan, ind, row, translations, translation_model, by_name) -> None:
+    plan.updated_rows += 1
+    values = {"unit": row.unit or None, "reference_low": row.reference_low, "reference_high": row.reference_high}
+    changes = []
+    for name, value in values.items():
+        if value is not None and getattr(ind, name) != value:
+            changes.append(f"{name} {getattr(ind, name)!r} -> {value!r}")
+            setattr(ind, name, value)
+            if ind.pk:
+                plan.updated[ind.pk] = ind
+                plan.updated_fields.add(name)
+    for lang, attr in LANGUAGES:
+        name = getattr(row, attr)
+        if not name:
+            continue
+        by_name.setdefault(name.lower(), ind)
+        if ind.pk is None:
+            current = plan.names[id(ind)].get(lang)
+            plan.names[id(ind)][lang] = name
+        else:
+            tr = translations.get((ind.pk, lang))
+            current = tr.name if tr else None
+            if tr is None:
+                tr = translation_model(master_id=ind.pk, language_code=lang, name=name)
+                translations[(ind.pk, lang)] = tr
+                plan.new_translations.append(tr)
+            elif tr.name != name:
+                tr.name = name
+                if tr.pk:
+                    plan.changed_translations[tr.pk] = tr
+        if current != name:
+            changes.append(f"name[{lang}] {current!r} -> {name!r}")
+    if changes:
+        plan.diff.append(f"~ indicator {ind.slug}: " + "; ".join(changes))
+
+
+def apply_plan(plan: ImportPlan, *, batch_size: int = 1000) -> None:
+    """Write ``plan``; run it inside a transaction."""
+
+    translation_model = LabIndicator._parler_meta.root_model
+    LabIndicator.objects.bulk_create(plan.created, batch_size=batch_size)
+    if any(ind.pk is None for ind in plan.created):
+        ids = dict(
+            LabIndicator.objects.filter(slug__in=[ind.slug for ind in plan.created]).values_list("slug", "pk")
+        )
+        for ind in plan.created:
+            ind.pk = ids[ind.slug]
+
+    if plan.updated:
+        LabIndicator.objects.bulk_update(
+            list(plan.updated.values()), [f for f in INDICATOR_FIELDS if f in plan.updated_fields], batch_size=batch_size
+        )
+
+    new_translations = [
+        translation_model(master_id=ind.pk, language_code=lang, name=name)
+        for ind in plan.created
+        for lang, name in plan.names[id(ind)].items()
+    ]
+    translation_model.objects.bulk_create(new_translations + plan.new_translations, batch_size=batch_size)
+    if plan.changed_translations:
+        translation_model.objects.bulk_update(list(plan.changed_translations.values()), ["name"], batch_size=batch_size)
+
+    LabIndicatorAlias.objects.bulk_create(
+        [LabIndicatorAlias(indicator_id=ind.pk, alias_raw=raw, normalized=norm) for ind, raw, norm in plan.aliases],
+        batch_size=batch_size,
+    )
+
+    tag_slugs = sorted({f"indicator:{ind.slug}" for ind in plan.touched.values()})
+    existing = set()
+    for start in range(0, len(tag_slugs), batch_size):
+        chunk = tag_slugs[start:start + batch_size]
+        existing.update(Tag.objects.filter(slug__in=chunk).values_list("slug", flat=True))
+    Tag.objects.bulk_create(
+        [Tag(slug=slug, kind=TagKind.INDICATOR, is_active=True) for slug in tag_slugs if slug not in existing],
+        batch_size=batch_size,
+    )
@@ -0,0 +1,200 @@
+"""Denormalized per-patient lab time series used by the dashboard charts.
+
+Each ``LabSeries`` row holds the pre-sorted ``(timestamp, value)`` arrays of a
+single indicator for a single patient, so chart pages read every series with
+one indexed query instead of re-aggregating ``LabTestMeasurement`` per view.
+
+Single measurement writes go through :func:`add_point` and
+:func:`remove_point`, which splice one point into the stored arrays;
+:func:`rebuild_series` re-reads all measurements and is used for bulk imports,
+the backfill and whenever a stored series does not contain the point it is
+asked to remove.
+"""
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone as dt_timezone
+from typing import Iterable
+
+from django.db import transaction
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import get_language
+
+from records.models import LabIndicator, LabSeries, LabTestMeasurement
+
+FALLBACK_LANGUAGE = "en-us"
+
+
+def rebuild_series(patient_id, indicator_id) -> LabSeries | None:
+    rows = list(
+        LabTestMeasurement.objects.filter(
+            medical_event__patient_id=patient_id,
+            indicator_id=indicator_id,
+        )
+        .order_by("measured_at", "id")
+        .values_list("measured_at", "value")
+    )
+    points = [point for point in (_point(measured_at, value) for measured_at, value in rows) if point]
+    if not points:
+        LabSeries.objects.filter(patient_id=patient_id, indicator_id=indicator_id).delete()
+        return None
+    timestamps = [timestamp for timestamp, _ in points]
+    values = [value for _, value in points]
+    series, _ = LabSeries.objects.update_or_create(
+        patient_id=patient_id,
+        indicator_id=indicator_id,
+        defaults={
+            "timestamps": timestamps,
+            "values": values,
+            "count": len(values),
+            # The kept points bound the series, exactly as _store() derives them.
+            "first_measured_at": datetime.fromisoformat(timestamps[0]),
+            "last_measured_at": datetime.fromisoformat(timestamps[-1]),
+        },
+    )
+    return series
+
+
+def _point(measured_at, value) -> tuple[str, float] | None:
+    """The stored ``(timestamp, value)`` form of a measurement, or ``None`` if it is not charted."""
+
+    if measured_at is None or value is None:
+        return None
+    try:
+        fv = float(value)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(measured_at, str):
+        measured_at = parse_datetime(measured_at)
+        if measured_at is None:
+            return None
+    if timezone.is_naive(measured_at):
+        measured_at = timezone.make_aware(measured_at)
+    return measured_at.astimezone(dt_timezone.utc).isoformat(), fv
+
+
+def _locked_series(patient_id, indicator_id) -> LabSeries | None:
+    return LabSeries.objects.select_for_update().filter(patient_id=patient_id, indicator_id=indicator_id).first()
+
+
+def _store(series: LabSeries) -> LabSeries | None:
+    if not series.timestamps:
+        series.delete()
+        return None
+    series.count = len(series.values)
+    series.first_measured_at = datetime.fromisoformat(series.timestamps[0])
+    series.last_measured_at = datetime.fromisoformat(series.timestamps[-1])
+    series.save(update_fields=["timestamps", "values", "count", "first_measured_at", "last_measured_at", "updated_at"])
+    return series
+
+
+def add_point(patient_id, indicator_id, measured_at, value) -> LabSeries | None:
+    point = _point(measured_at, value)
+    if point is None:
+        return None
+    with transaction.atomic():
+        series = _locked_series(patient_id, indicator_id)
+        if series is None:
+            return rebuild_series(patient_id, indicator_id)
+        # Equal timestamps keep insertion (id) order, as in rebuild_series.
+        index = bisect_right(series.timestamps, point[0])
+        series.timestamps.insert(index, point[0])
+        series.values.insert(index, point[1])
+        return _store(series)
+
+
+def remove_point(patient_id, indicator_id, measured_at, value) -> bool:
+    """Remove one point; returns ``False`` if the series had to be rebuilt instead."""
+
+    point = _point(measured_at, value)
+    if point is None:
+        return True
+    with transaction.atomic():
+        series = _locked_series(patient_id, indicator_id)
+        if series is not None:
+            index = bisect_left(series.timestamps, point[0])
+            while index < len(series.timestamps) and series.timestamps[index] == point[0]:
+                if series.values[index] == point[1]:
+                    del series.timestamps[index]
+                    del series.values[index]
+                    _store(series)
+                    return True
+                index += 1
+        rebuild_series(patient_id, indicator_id)
+        return False
+
+
+def refresh_series(patient_id, indicator_ids: Iterable) -> int:
+    refreshed = 0
+    for indicator_id in sorted({i for i in indicator_ids if i}):
+        rebuild_series(patient_id, indicator_id)
+        refreshed += 1
+    return refreshed
+
+
+def _translated_name(lang, ref="indicator_id"):
+    translation_model = LabIndicator._parler_meta.root_model
+    return Subquery(
+        translation_model.objects.filter(master_id=OuterRef(ref), language_code=lang)
+        .values("name")[:1]
+    )
+
+
+def indicator_name_expression(lang: str | None = None, ref: str = "indicator_id"):
+    """Localized indicator name for ``ref``, falling back to en-us and bg."""
+
+    lang = lang or get_language() or FALLBACK_LANGUAGE
+    return Coalesce(
+        _translated_name(lang, ref),
+        _translated_name(FALLBACK_LANGUAGE, ref),
+        _translated_name("bg", ref),
+    )
+
+
+def series_for_patient(patient, limit: int | None = 4, lang: str | None = None, slugs=None):
+    """Return the patient's series ordered by measurement count in one query."""
+
+    qs = LabSeries.objects.filter(patient=patient)
+    if slugs is not None:
+        qs = qs.filter(indicator__slug__in=list(slugs))
+    qs = (
+        qs
+        .select_related("indicator")
+        .annotate(indicator_name=indicator_name_expression(lang))
+        .order_by("-count", "indicator_id")
+    )
+    if limit:
+        qs = qs[:limit]
+    return list(qs)
+
+
+def find_stale_series(patient_ids: Iterable | None = None) -> list[tuple[int, int]]:
+    """Compare stored series with live measurement aggregates.
+
+    Returns ``(patient_id, indicator_id)`` pairs whose stored count or last
+    timestamp differs from ``LabTestMeasurement``, including series rows whose
+    measurements are gone.
+    """
+
+    live_qs = LabTestMeasurement.objects.all()
+    stored_qs = LabSeries.objects.all()
+    if patient_ids is not None:
+        patient_ids = list(patient_ids)
+        live_qs = live_qs.filter(medical_event__patient_id__in=patient_ids)
+        stored_qs = stored_qs.filter(patient_id__in=patient_ids)
+    live = {
+        (r["medical_event__patient_id"], r["indicator_id"]): (r["c"], r["last"])
+        for r in live_qs.values("medical_event__patient_id", "indicator_id").annotate(
+            c=Count("id"), last=Max("measured_at")
+        )
+    }
+    stored = {
+        (r["patient_id"], r["indicator_id"]): (r["count"], r["last_measured_at"])
+        for r in stored_qs.values("patient_id", "indicator_id", "count", "last_measured_at")
+    }
+    stale = [key for key, state in live.items() if stored.get(key) != state]
+    stale.extend(key for key in stored if key not in live)
+    return sorted(stale)
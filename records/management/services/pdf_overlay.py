@@ -0,0 +1,208 @@
+"""Letterhead overlay engine for generated PDFs.
+
+Each letterhead template is parsed once per process (re-parsed only when its
+file changes). Its pages are kept as ready-made content and resources. For an
+export, every template page used is written into the output once as a form
+XObject. Each generated page then gets a one-line ``q /MedjTplN Do Q`` prefix
+that draws the letterhead underneath its own content. The template pages are
+never cloned or mutated per page, so the output size and merge time grow with
+the generated content only.
+
+The first template page backs the first generated page and the second (if
+any) backs the rest, matching the two-page templates in ``pdf_templates``.
+"""
+from __future__ import annotations
+
+import io
+import os
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import BinaryIO
+
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    IndirectObject,
+    NameObject,
+)
+
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class TemplatePage:
+    content: bytes
+    bbox: tuple[float, ...]
+    resources: DictionaryObject
+
+
+@dataclass(frozen=True)
+class LetterheadTemplate:
+    pages: tuple[TemplatePage, ...]
+    holder: PdfWriter
+
+    def page_index(self, generated_index: int, repeat_first: bool = False) -> int:
+        if repeat_first or generated_index == 0:
+            return 0
+        return min(1, len(self.pages) - 1)
+
+
+_templates: dict[str, tuple[float, LetterheadTemplate | None]] = {}
+_lock = threading.Lock()
+
+
+def _parse(path: str) -> LetterheadTemplate | None:
+    try:
+        with open(path, "rb") as fh:
+            reader = PdfReader(io.BytesIO(fh.read()))
+        # Resolve everything into an in-memory holder so later clones never
+        # touch the reader's stream (and are safe to run from several threads).
+        holder = PdfWriter()
+        pages = tuple(
+            TemplatePage(
+                content=page.get_contents().get_data() if page.get_contents() is not None else b"",
+                bbox=tuple(float(v) for v in page.mediabox),
+                resources=page.get("/Resources", DictionaryObject()).get_object().clone(holder),
+            )
+            for page in reader.pages
+        )
+    except Exception:
+        return None
+    return LetterheadTemplate(pages=pages, holder=holder) if pages else None
+
+
+def load_template(path: str | None) -> LetterheadTemplate | None:
+    """Return the parsed template at ``path`` (cached per process), or None."""
+
+    if not path:
+        return None
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _templates.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with _lock:
+        cached = _templates.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        template = _parse(path)
+        _templates[path] = (mtime, template)
+        return template
+
+
+def clear_template_cache() -> None:
+    with _lock:
+        _templates.clear()
+
+
+def _register(writer: PdfWriter, obj) -> IndirectObject:
+    # PyPDF2 3.0.1 (pinned in requirements.txt) has no public way to add a
+    # free-standing object to a writer; this is the only private call here.
+    return writer._add_object(obj)
+
+
+def _form_xobject(writer: PdfWriter, page: TemplatePage) -> IndirectObject:
+    content = DecodedStreamObject()
+    content.set_data(page.content)
+    form = content.flate_encode()
+    form.update(
+        {
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Form"),
+            NameObject("/BBox"): ArrayObject([FloatObject(v) for v in page.bbox]),
+            NameObject("/Resources"): page.resources.clone(writer),
+        }
+    )
+    return _register(writer, form)
+
+
+def _stream(writer: PdfWriter, data: bytes) -> IndirectObject:
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    return _register(writer, stream)
+
+
+def _underlay(writer: PdfWriter, page, name: str, form: IndirectObject, prefix: IndirectObject) -> None:
+    resources = page.get("/Resources")
+    resources = resources.get_object() if resources is not None else DictionaryObject()
+    xobjects = resources.get("/XObject")
+    xobjects = xobjects.get_object() if xobjects is not None else DictionaryObject()
+    xobjects[NameObject(name)] = form
+    resources[NameObject("/XObject")] = xobjects
+    page[NameObject("/Resources")] = resources
+
+    contents = page.get("/Contents")
+    if contents is None:
+        parts = []
+    else:
+        resolved = contents.get_object()
+        if isinstance(resolved, ArrayObject):
+            parts = list(resolved)
+        elif isinstance(contents, IndirectObject):
+            parts = [contents]
+        else:
+            parts = [_register(writer, resolved)]
+    page[NameObject("/Contents")] = ArrayObject([prefix, *parts])
+
+
+def overlay_to_stream(pdf_bytes: bytes, template_path: str | None, out: BinaryIO, repeat_first: bool = False) -> bool:
+    """Write ``pdf_bytes`` on top of the letterhead into ``out``.
+
+    Returns False when the template or the generated PDF cannot be read or
+    merged; ``out`` may then hold partial output and callers fall back to the
+    plain document.
+    """
+
+    template = load_template(template_path)
+    if template is None:
+        return False
+    try:
+        generated = PdfReader(io.BytesIO(pdf_bytes))
+        generated_pages = generated.pages
+    except Exception:
+        return False
+
+    writer = PdfWriter()
+    forms: dict[int, tuple[IndirectObject, IndirectObject]] = {}
+    try:
+        for i, gen_page in enumerate(generated_pages):
+            index = template.page_index(i, repeat_first)
+            if index not in forms:
+                forms[index] = (
+                    _form_xobject(writer, template.pages[index]),
+                    _stream(writer, f"q /MedjTpl{index} Do Q\n".encode()),
+                )
+            page = writer.add_page(gen_page)
+            _underlay(writer, page, f"/MedjTpl{index}", *forms[index])
+        writer.write(out)
+    except Exception:
+        return False
+    return True
+
+
+def overlay_template(pdf_bytes: bytes, template_path: str | None, repeat_first: bool = False) -> bytes:
+    out = io.BytesIO()
+    if not overlay_to_stream(pdf_bytes, template_path, out, repeat_first=repeat_first):
+        return pdf_bytes
+    return out.getvalue()
+
+
+def overlay_to_file(pdf_bytes: bytes, template_path: str | None, repeat_first: bool = False) -> BinaryIO:
+    """Like :func:`overlay_template` but spooled to a temporary file, rewound for reading.
+
+    Large exports go to disk instead of being held in memory twice.
+    """
+
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    if not overlay_to_stream(pdf_bytes, template_path, out, repeat_first=repeat_first):
+        out.seek(0)
+        out.truncate()
+        out.write(pdf_bytes)
+    out.seek(0)
+    return out
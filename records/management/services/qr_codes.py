@@ -0,0 +1,74 @@
+"""QR code rendering with an in-process LRU cache.
+
+Share links and personal-card URLs are turned into the same handful of QR
+images over and over, so rendered bytes are kept per
+``(data, format, box size, border, error correction)`` in an LRU of
+``QR_CACHE_SIZE`` entries. The ETag is derived from those inputs alone, so a
+conditional request can be answered without rendering. ``svg`` output is a
+plain path document and skips PIL and PNG compression entirely.
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+from functools import lru_cache
+
+from django.conf import settings
+
+try:
+    import qrcode
+    import qrcode.image.svg
+except Exception:
+    qrcode = None
+
+FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+ERROR_LEVELS = ("L", "M", "Q", "H")
+
+
+def available() -> bool:
+    return qrcode is not None
+
+
+def qr_format(value: str | None) -> str:
+    value = (value or "png").lower()
+    return value if value in FORMATS else "png"
+
+
+def qr_etag(data: str, fmt: str = "png", box_size: int = 10, border: int = 4, error: str = "M") -> str:
+    key = "\x1f".join([data, fmt, str(box_size), str(border), error])
+    return '"qr-%s"' % hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+@lru_cache(maxsize=getattr(settings, "QR_CACHE_SIZE", 512))
+def _render(data: str, fmt: str, box_size: int, border: int, error: str) -> bytes:
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=getattr(qrcode.constants, f"ERROR_CORRECT_{error}"),
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    buf = io.BytesIO()
+    if fmt == "svg":
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buf)
+    else:
+        qr.make_image(fill_color="black", back_color="white").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def qr_bytes(data: str, fmt: str = "png", box_size: int = 10, border: int = 4, error: str = "M") -> bytes:
+    """Return the encoded QR image for ``data`` (served from the LRU when possible)."""
+
+    if qrcode is None:
+        raise RuntimeError("qrcode is not installed")
+    error = error if error in ERROR_LEVELS else "M"
+    return _render(data, qr_format(fmt), int(box_size), int(border), error)
+
+
+def cache_info():
+    return _render.cache_info()
+
+
+def clear_cache() -> None:
+    _render.cache_clear()
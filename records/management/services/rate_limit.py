@@ -0,0 +1,210 @@
+"""Sliding-window rate limiting on atomic cache counters.
+
+Each limiter counts hits per key in fixed windows of ``window`` seconds and
+estimates the sliding window as ``previous * (1 - elapsed) + current``, where
+``elapsed`` is the fraction of the current window that has passed. A hit is
+one ``add`` (creates the counter if missing) plus one ``incr`` on the
+current window and one ``get`` of the previous one. ``add`` and ``incr`` are
+atomic on the memcached, Redis and local-memory cache backends, so
+concurrent requests never lose updates or restart a window.
+
+Limits come from ``RATE_LIMITS`` (``{name: (limit, window_seconds)}``),
+falling back to :data:`DEFAULT_LIMITS`; ``RATE_LIMIT_CACHE`` selects the cache
+alias. :class:`LocalMemoryBackend` keeps counters in a dict with an
+injectable clock, for tests that need to move time forward.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+log = logging.getLogger("records.ratelimit")
+
+CACHE_PREFIX = "rl"
+DEFAULT_LIMITS = {
+    "share_create": (10, 300),
+    "share_password": (5, 300),
+    "qr": (60, 60),
+}
+
+
+class CacheBackend:
+    """Counters in a Django cache (``RATE_LIMIT_CACHE``, ``default`` if unset)."""
+
+    def __init__(self, alias: str | None = None):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias or getattr(settings, "RATE_LIMIT_CACHE", "default")]
+
+    def now(self) -> float:
+        return time.time()
+
+    def incr(self, key: str, timeout: int) -> int:
+        cache = self.cache
+        cache.add(key, 0, timeout=timeout)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Evicted between add and incr: this hit starts the window.
+            cache.add(key, 1, timeout=timeout)
+            return 1
+
+    def get(self, key: str) -> int:
+        return int(self.cache.get(key) or 0)
+
+
+class LocalMemoryBackend:
+    """In-process counters with an optional fake clock."""
+
+    def __init__(self, clock=None):
+        self.clock = clock or time.time
+        self.counters: dict[str, tuple[int, float]] = {}
+        self.lock = threading.Lock()
+
+    def now(self) -> float:
+        return self.clock()
+
+    def _live(self, key: str) -> int:
+        value, expires = self.counters.get(key, (0, 0.0))
+        return value if expires > self.now() else 0
+
+    def incr(self, key: str, timeout: int) -> int:
+        with self.lock:
+            value = self._live(key) + 1
+            expires = self.counters.get(key, (0, 0.0))[1] if value > 1 else self.now() + timeout
+            self.counters[key] = (value, expires)
+            return value
+
+    def get(self, key: str) -> int:
+        with self.lock:
+            return self._live(key)
+
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    name: str
+    key: str
+    allowed: bool
+    count: float
+    limit: int
+    window: int
+    retry_after: int
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.limit - math.ceil(self.count))
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "key": self.key,
+            "allowed": self.allowed,
+            "count": round(self.count, 2),
+            "limit": self.limit,
+            "window": self.window,
+            "remaining": self.remaining,
+            "retry_after": self.retry_after,
+        }
+
+
+class RateLimiter:
+    def __init__(self, name: str, limit: int | None = None, window: int | None = None, backend=None):
+        self.name = name
+        self._limit = limit
+        self._window = window
+        self.backend = backend or CacheBackend()
+
+    def _config(self) -> tuple[int, int]:
+        limit, window = getattr(settings, "RATE_LIMITS", {}).get(self.name, DEFAULT_LIMITS.get(self.name, (60, 60)))
+        return int(self._limit or limit), int(self._window or window)
+
+    def _keys(self, key, now: float, window: int) -> tuple[str, str, float]:
+        slot = int(now // window)
+        base = f"{CACHE_PREFIX}:{self.name}:{key}"
+        return f"{base}:{slot}", f"{base}:{slot - 1}", (now % window) / window
+
+    def _result(self, key, current: int, previous: int, elapsed: float, limit: int, window: int) -> RateLimitResult:
+        count = previous * (1 - elapsed) + current
+        allowed = count <= limit
+        retry_after = 0
+        if not allowed:
+            # Seconds until the previous window's weight has decayed enough.
+            over = count - limit
+            retry_after = window * (1 - elapsed)
+            if previous and over <= previous * (1 - elapsed):
+                retry_after = window * over / previous
+            retry_after = max(1, math.ceil(retry_after))
+        return RateLimitResult(self.name, str(key), allowed, count, limit, window, retry_after)
+
+    def hit(self, key) -> RateLimitResult:
+        """Record one hit for ``key`` and report whether it is within the limit."""
+
+        limit, window = self._config()
+        current_key, previous_key, elapsed = self._keys(key, self.backend.now(), window)
+        current = self.backend.incr(current_key, timeout=window * 2)
+        result = self._result(key, current, self.backend.get(previous_key), elapsed, limit, window)
+        if not result.allowed:
+            log.warning("rate_limited name=%s key=%s count=%.1f limit=%s", self.name, key, result.count, limit)
+        return result
+
+    def peek(self, key) -> RateLimitResult:
+        """Current metrics for ``key`` without counting a hit."""
+
+        limit, window = self._config()
+        current_key, previous_key, elapsed = self._keys(key, self.backend.now(), window)
+        current = self.backend.get(current_key)
+        return self._result(key, current, self.backend.get(previous_key), elapsed, limit, window)
+
+
+def rate_limit_headers(response, result: RateLimitResult):
+    response["X-RateLimit-Limit"] = str(result.limit)
+    response["X-RateLimit-Remaining"] = str(result.remaining)
+    if not result.allowed:
+        response["Retry-After"] = str(result.retry_after)
+    return response
+
+
+def too_many_requests(result: RateLimitResult, content: str = "rate_limited") -> HttpResponse:
+    return rate_limit_headers(HttpResponse(content, status=429, content_type="text/plain"), result)
+
+
+def rate_limited(limiter: RateLimiter, key_func):
+    """View decorator answering 429 once ``key_func(request, ...)`` exceeds ``limiter``."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            result = limiter.hit(key_func(request, *args, **kwargs))
+            if not result.allowed:
+                return too_many_requests(result)
+            return rate_limit_headers(view(request, *args, **kwargs), result)
+
+        return wrapper
+
+    return decorator
+
+
+def client_ip(request) -> str:
+    return request.META.get("REMOTE_ADDR") or "unknown"
+
+
+def user_or_ip(request, *args, **kwargs) -> str:
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return f"u{user.pk}"
+    return f"ip{client_ip(request)}"
+
+
+share_create_limiter = RateLimiter("share_create")
+share_password_limiter = RateLimiter("share_password")
+qr_limiter = RateLimiter("qr")
@@ -0,0 +1,178 @@
+"""Patient-record filter engine shared by the share/export screens.
+
+``RecordFilters`` is compiled once from a request payload and yields querysets
+for the three record types (documents, lab measurements, events). Filters on
+tags and indicators are ``EXISTS`` subqueries instead of joins, so no query
+needs ``DISTINCT`` and :meth:`RecordFilters.counts` can count all three types
+in one SELECT of scalar subqueries.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date
+
+from django.db.models import Exists, F, Func, IntegerField, OuterRef, Prefetch, Q, Subquery
+from django.utils.dateparse import parse_date
+
+from records.models import Document, DocumentTag, LabTestMeasurement, MedicalEvent, PatientProfile, Tag
+
+
+def _int_list(value) -> tuple[int, ...]:
+    if isinstance(value, (list, tuple)):
+        items = value
+    elif value in (None, ""):
+        items = []
+    else:
+        items = [value]
+    out = []
+    for item in items:
+        try:
+            out.append(int(item))
+        except (TypeError, ValueError):
+            continue
+    return tuple(out)
+
+
+def _str_list(value) -> tuple[str, ...]:
+    if isinstance(value, (list, tuple)):
+        return tuple(str(v).strip() for v in value if str(v).strip())
+    if value:
+        return (str(value).strip(),)
+    return ()
+
+
+def _date(raw: str) -> date | None:
+    try:
+        return parse_date((raw or "").strip())
+    except ValueError:
+        return None
+
+
+def _count(qs):
+    return Subquery(
+        qs.order_by().annotate(_n=Func(F("pk"), function="COUNT", output_field=IntegerField())).values("_n")
+    )
+
+
+@dataclass(frozen=True)
+class RecordFilters:
+    category_ids: tuple[int, ...] = ()
+    specialty_ids: tuple[int, ...] = ()
+    event_ids: tuple[int, ...] = ()
+    indicator_slugs: tuple[str, ...] = ()
+    start: date | None = None
+    end: date | None = None
+
+    @classmethod
+    def from_payload(cls, filters: dict | None, start_raw: str = "", end_raw: str = "") -> "RecordFilters":
+        filters = filters or {}
+        return cls(
+            category_ids=_int_list(filters.get("category")),
+            specialty_ids=_int_list(filters.get("specialty")),
+            event_ids=_int_list(filters.get("event")),
+            indicator_slugs=_str_list(filters.get("indicator")),
+            start=_date(start_raw),
+            end=_date(end_raw),
+        )
+
+    def _indicator_labs(self, event_ref: str):
+        return LabTestMeasurement.objects.filter(
+            medical_event_id=OuterRef(event_ref), indicator__slug__in=self.indicator_slugs
+        )
+
+    def documents(self, owner):
+        qs = Document.objects.filter(owner=owner)
+        if self.category_ids:
+            qs = qs.filter(category_id__in=self.category_ids)
+        if self.specialty_ids:
+            qs = qs.filter(specialty_id__in=self.specialty_ids)
+        if self.event_ids:
+            qs = qs.filter(medical_event_id__in=self.event_ids)
+        if self.indicator_slugs:
+            tagged = DocumentTag.objects.filter(document_id=OuterRef("pk"), tag__slug__in=self.indicator_slugs)
+            qs = qs.filter(Q(Exists(tagged)) | Q(Exists(self._indicator_labs("medical_event_id"))))
+        if self.start:
+            qs = qs.filter(
+                Q(uploaded_at__date__gte=self.start)
+                | Q(document_date__gte=self.start)
+                | Q(medical_event__event_date__gte=self.start)
+            )
+        if self.end:
+            qs = qs.filter(
+                Q(uploaded_at__date__lte=self.end)
+                | Q(document_date__lte=self.end)
+                | Q(medical_event__event_date__lte=self.end)
+            )
+        return qs
+
+    def labs(self, patient):
+        qs = LabTestMeasurement.objects.filter(medical_event__patient=patient)
+        if self.category_ids:
+            qs = qs.filter(medical_event__category_id__in=self.category_ids)
+        if self.specialty_ids:
+            qs = qs.filter(medical_event__specialty_id__in=self.specialty_ids)
+        if self.event_ids:
+            qs = qs.filter(medical_event_id__in=self.event_ids)
+        if self.indicator_slugs:
+            qs = qs.filter(indicator__slug__in=self.indicator_slugs)
+        if self.start:
+            qs = qs.filter(measured_at__date__gte=self.start)
+        if self.end:
+            qs = qs.filter(measured_at__date__lte=self.end)
+        return qs
+
+    def events(self, patient):
+        qs = MedicalEvent.objects.filter(patient=patient)
+        if self.category_ids:
+            qs = qs.filter(category_id__in=self.category_ids)
+        if self.specialty_ids:
+            qs = qs.filter(specialty_id__in=self.specialty_ids)
+        if self.event_ids:
+            qs = qs.filter(id__in=self.event_ids)
+        if self.indicator_slugs:
+            qs = qs.filter(Exists(self._indicator_labs("pk")))
+        if self.start:
+            qs = qs.filter(event_date__gte=self.start)
+        if self.end:
+            qs = qs.filter(event_date__lte=self.end)
+        return qs
+
+    def counts(self, owner, patient) -> dict[str, int]:
+        """Count documents, lab measurements and events in one round trip."""
+
+        row = (
+            PatientProfile.objects.filter(pk=patient.pk)
+            .annotate(
+                n_documents=_count(self.documents(owner)),
+                n_labs=_count(self.labs(patient)),
+                n_events=_count(self.events(patient)),
+            )
+            .values("n_documents", "n_labs", "n_events")
+            .first()
+        ) or {}
+        return {key: int(row.get(f"n_{key}") or 0) for key in ("documents", "labs", "events")}
+
+    def preview_documents(self, owner, limit: int = 25):
+        tags = Tag.objects.prefetch_related("translations")
+        return list(
+            self.documents(owner)
+            .select_related("doc_type", "category")
+            .prefetch_related(Prefetch("tags", queryset=tags), "doc_type__translations", "category__translations")
+            .order_by("-uploaded_at")[:limit]
+        )
+
+    def as_params(self) -> dict:
+        params = {}
+        if self.start:
+            params["start_date"] = self.start.isoformat()
+        if self.end:
+            params["end_date"] = self.end.isoformat()
+        if self.specialty_ids:
+            params["specialty"] = [str(s) for s in self.specialty_ids]
+        if self.category_ids:
+            params["category"] = [str(c) for c in self.category_ids]
+        if self.event_ids:
+            params["event"] = [str(e) for e in self.event_ids]
+        if self.indicator_slugs:
+            params["indicator"] = list(self.indicator_slugs)
+        return params
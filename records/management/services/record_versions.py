@@ -0,0 +1,96 @@
+"""Per-user version counters for caches derived from medical records.
+
+Every cache entry built from a user's documents, events or lab measurements
+embeds :func:`record_version` in its key; signals call
+:func:`bump_record_version` on every write, so stale entries are simply never
+read again and expire on their own. A missing counter is seeded with the
+current time in milliseconds, which keeps it from reusing an old version after
+the cache was cleared or the key evicted.
+
+:func:`profile_version` is the same kind of counter for the patient profile
+alone; the onboarding middleware uses it to know when a state remembered in
+the session has to be re-read. :func:`share_version` is bumped whenever a
+share link is saved or deleted, so cached public share pages follow revokes
+and edits of the link itself.
+
+The counters live in the ``RECORD_VERSION_CACHE`` alias, which must be shared
+by every process (Redis, Memcached or the database cache): a bump made by one
+web worker or a management command has to be seen by all of them. Entries
+keyed by a version may stay in a per-process cache, since a bump simply moves
+every process to a new key.
+"""
+from __future__ import annotations
+
+import time
+from typing import Iterable
+
+from django.conf import settings
+from django.core.cache import caches
+
+CACHE_PREFIX = "recver"
+PROFILE_PREFIX = "profver"
+SHARE_PREFIX = "sharever"
+
+
+def _cache_key(user_id, prefix: str = CACHE_PREFIX) -> str:
+    return f"{prefix}:{user_id}"
+
+
+def _seed() -> int:
+    return int(time.time() * 1000)
+
+
+def _cache():
+    return caches[getattr(settings, "RECORD_VERSION_CACHE", "default")]
+
+
+def _version(key: str) -> int:
+    cache = _cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _seed(), timeout=None)
+        version = cache.get(key)
+    return int(version or 0)
+
+
+def _bump(key: str) -> None:
+    cache = _cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _seed(), timeout=None)
+
+
+def record_version(user) -> int:
+    """Return the current records version of ``user`` (a user or user id)."""
+
+    return _version(_cache_key(getattr(user, "pk", user)))
+
+
+def bump_record_version(user) -> None:
+    _bump(_cache_key(getattr(user, "pk", user)))
+
+
+def bump_record_versions(user_ids: Iterable) -> None:
+    for user_id in {uid for uid in user_ids if uid}:
+        bump_record_version(user_id)
+
+
+def profile_version(user) -> int:
+    """Return the current patient profile version of ``user``."""
+
+    return _version(_cache_key(getattr(user, "pk", user), PROFILE_PREFIX))
+
+
+def bump_profile_version(user) -> None:
+    _bump(_cache_key(getattr(user, "pk", user), PROFILE_PREFIX))
+
+
+def share_version(token: str) -> int:
+    """Return the current version of the share link ``token``."""
+
+    return _version(_cache_key(token, SHARE_PREFIX))
+
+
+def bump_share_version(token: str) -> None:
+    _bump(_cache_key(token, SHARE_PREFIX))
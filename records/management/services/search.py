@@ -0,0 +1,132 @@
+"""Full-text document search.
+
+``DocumentSearchIndex`` keeps one row of plain text per document in four
+weighted columns: title/summary, tag and type names, analysis, and OCR text.
+Tag and type names are indexed in every translation, so bg and en queries both
+match. The database maintains the actual search structure from those columns:
+
+* PostgreSQL: a generated ``search_vector`` tsvector column with a GIN index
+  (``simple`` configuration, since there is no Bulgarian stemmer);
+* SQLite: the ``records_documentsearch_fts`` FTS5 table, kept in sync by triggers.
+
+Other backends fall back to ``icontains`` over the index columns.
+"""
+from __future__ import annotations
+
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from records.models import Document, DocumentSearchIndex
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_PG_MATCH = (
+    "SELECT document_id FROM records_documentsearchindex "
+    "WHERE search_vector @@ to_tsquery('simple', %s)"
+)
+_PG_RANK = (
+    "SELECT ts_rank(search_vector, to_tsquery('simple', %s)) FROM records_documentsearchindex "
+    "WHERE document_id = records_document.id"
+)
+_SQLITE_MATCH = (
+    "SELECT rowid FROM records_documentsearch_fts WHERE records_documentsearch_fts MATCH %s"
+)
+_SQLITE_RANK = (
+    "SELECT -bm25(records_documentsearch_fts, 10.0, 5.0, 2.0, 1.0) FROM records_documentsearch_fts "
+    "WHERE records_documentsearch_fts MATCH %s AND rowid = records_document.id"
+)
+
+
+def _names(obj) -> list[str]:
+    if obj is None:
+        return []
+    names = []
+    for translation in obj.translations.all():
+        name = (getattr(translation, "name", "") or "").strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def _join(parts) -> str:
+    return "\n".join(p.strip() for p in parts if p and p.strip())
+
+
+def document_search_fields(document: Document) -> dict:
+    event = document.medical_event
+    tag_names = []
+    for tag in document.tags.all():
+        tag_names.extend(_names(tag))
+    return {
+        "title": _join([document.title, document.summary, getattr(event, "summary", None)]),
+        "tags": _join(
+            tag_names
+            + _names(document.doc_type)
+            + _names(document.specialty)
+            + _names(document.category)
+        ),
+        "analysis": _join([document.analysis_text]),
+        "ocr": _join([document.original_ocr_text]),
+    }
+
+
+def indexed_documents():
+    return Document.objects.select_related(
+        "medical_event", "doc_type", "specialty", "category"
+    ).prefetch_related(
+        "tags__translations",
+        "doc_type__translations",
+        "specialty__translations",
+        "category__translations",
+    )
+
+
+def index_document(document: Document) -> DocumentSearchIndex:
+    entry, _ = DocumentSearchIndex.objects.update_or_create(
+        document=document, defaults=document_search_fields(document)
+    )
+    return entry
+
+
+def index_document_id(document_id) -> DocumentSearchIndex | None:
+    document = indexed_documents().filter(pk=document_id).first()
+    if document is None:
+        return None
+    return index_document(document)
+
+
+def _tokens(query: str) -> list[str]:
+    return [t.lower() for t in _TOKEN_RE.findall(query or "")][:16]
+
+
+def search_documents(qs, query: str):
+    """Filter ``qs`` to documents matching every word of ``query`` (as prefixes).
+
+    Matching documents are annotated with ``search_rank`` (higher is better).
+    """
+
+    tokens = _tokens(query)
+    if not tokens:
+        return qs.annotate(search_rank=Value(0.0, output_field=FloatField()))
+    vendor = connection.vendor
+    if vendor == "postgresql":
+        ts_query = " & ".join(f"{t}:*" for t in tokens)
+        return qs.filter(pk__in=RawSQL(_PG_MATCH, [ts_query])).annotate(
+            search_rank=RawSQL(_PG_RANK, [ts_query], output_field=FloatField())
+        )
+    if vendor == "sqlite":
+        match = " ".join(f'"{t}"*' for t in tokens)
+        return qs.filter(pk__in=RawSQL(_SQLITE_MATCH, [match])).annotate(
+            search_rank=RawSQL(_SQLITE_RANK, [match], output_field=FloatField())
+        )
+    for token in tokens:
+        qs = qs.filter(
+            Q(search_index__title__icontains=token)
+            | Q(search_index__tags__icontains=token)
+            | Q(search_index__analysis__icontains=token)
+            | Q(search_index__ocr__icontains=token)
+        )
+    return qs.annotate(search_rank=Value(0.0, output_field=FloatField()))
@@ -0,0 +1,141 @@
+"""Expiry and retention of share links.
+
+Links move from ``active`` to ``expired`` once ``expires_at`` has passed and
+to ``revoked`` when the owner withdraws them. :func:`expire_links` flips all
+overdue links with one ``UPDATE``; :func:`purge_links` deletes expired and
+revoked links older than ``SHARE_RETENTION_DAYS`` in primary-key chunks so a
+large backlog never holds a long lock. The expiry update and the expired branch
+of the purge filter on ``(status, expires_at)`` and are served by the partial
+``records_share_status_exp_idx``; revoked links are matched on ``revoked_at``,
+which is not indexed since revocations are rare next to expiries.
+
+:func:`start_scheduler` runs :func:`run_sweep` every ``SHARE_SWEEP_INTERVAL``
+seconds on a daemon thread of the web process (``0`` disables it). It is
+started by the first request, so management commands and migrations never
+spawn it. A cache lock keeps processes that share a cache from sweeping in the
+same interval; the sweep itself is idempotent, so an overlap is harmless.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from records.models import ShareLink
+
+log = logging.getLogger("records.share")
+
+STATUS_ACTIVE = "active"
+STATUS_EXPIRED = "expired"
+STATUS_REVOKED = "revoked"
+LOCK_KEY = "sharesweep:lock"
+
+_scheduler: "Sweeper | None" = None
+_scheduler_lock = threading.Lock()
+
+
+def _interval() -> int:
+    return int(getattr(settings, "SHARE_SWEEP_INTERVAL", 900))
+
+
+def _retention() -> timedelta:
+    return timedelta(days=int(getattr(settings, "SHARE_RETENTION_DAYS", 30)))
+
+
+def active_links():
+    """Links that may still be opened: active and not past their expiry."""
+
+    return ShareLink.objects.filter(status=STATUS_ACTIVE).filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now())
+    )
+
+
+def expire_links(at=None) -> int:
+    """Mark every active link past its expiry as expired; returns the count."""
+
+    at = at or timezone.now()
+    return ShareLink.objects.filter(status=STATUS_ACTIVE, expires_at__lte=at).update(status=STATUS_EXPIRED)
+
+
+def revoke_link(link: ShareLink) -> None:
+    link.status = STATUS_REVOKED
+    link.revoked_at = timezone.now()
+    link.save(update_fields=["status", "revoked_at"])
+
+
+def purgeable_links(at=None):
+    cutoff = (at or timezone.now()) - _retention()
+    return ShareLink.objects.filter(
+        Q(status=STATUS_EXPIRED, expires_at__lt=cutoff)
+        | Q(status=STATUS_REVOKED, revoked_at__lt=cutoff)
+        | Q(status=STATUS_REVOKED, revoked_at__isnull=True, expires_at__lt=cutoff)
+    )
+
+
+def purge_links(at=None, chunk_size: int = 500) -> int:
+    """Delete expired/revoked links past retention, ``chunk_size`` rows per statement."""
+
+    qs = purgeable_links(at).order_by("pk")
+    total = 0
+    while True:
+        ids = list(qs.values_list("pk", flat=True)[:chunk_size])
+        if not ids:
+            return total
+        deleted, _ = ShareLink.objects.filter(pk__in=ids).delete()
+        total += deleted
+
+
+def run_sweep(at=None) -> dict:
+    expired = expire_links(at)
+    purged = purge_links(at)
+    if expired or purged:
+        log.info("share_sweep expired=%s purged=%s", expired, purged)
+    return {"expired": expired, "purged": purged}
+
+
+class Sweeper(threading.Thread):
+    def __init__(self, interval: int):
+        super().__init__(name="share-sweeper", daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if not cache.add(LOCK_KEY, 1, timeout=max(1, self.interval - 1)):
+                continue
+            try:
+                run_sweep()
+            except Exception:
+                log.exception("share_sweep failed")
+            finally:
+                connection.close()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start_scheduler(sender=None, **kwargs) -> Sweeper | None:
+    """Start the sweeper thread once per process; connected to ``request_started``."""
+
+    global _scheduler
+    if _scheduler is not None or _interval() <= 0:
+        return _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Sweeper(_interval())
+            _scheduler.start()
+    return _scheduler
+
+
+def stop_scheduler() -> None:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.stop()
+            _scheduler = None
@@ -0,0 +1,99 @@
+"""Public share page content.
+
+:func:`share_payload` loads the shared event or document together with
+everything the page shows (specialty and indicator translations, lab
+measurements) in one prefetching query set. :func:`render_share_body`
+renders ``subpages/share_public_body.html`` from it and, for links without a
+password, caches the HTML under the token, scope, language, owner
+:func:`~records.management.services.record_versions.record_version` and link
+:func:`~records.management.services.record_versions.share_version`. Edits of
+the owner's records or of the link (revoke included) therefore never serve a
+stale page. Only the body is cached: the surrounding layout carries the
+viewer's navigation and CSRF token.
+"""
+from __future__ import annotations
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
+
+from records.models import Document, LabTestMeasurement, MedicalEvent, ShareLink
+
+from .record_versions import record_version, share_version
+
+CACHE_PREFIX = "sharepage"
+SCOPES = ("full", "summary", "labs")
+
+
+def link_scope(link: ShareLink) -> str:
+    scope = (link.scope or "full").lower()
+    return scope if scope in SCOPES else "full"
+
+
+def _event_lookups(prefix: str, with_labs: bool) -> list:
+    lookups = [f"{prefix}specialty__translations"]
+    if with_labs:
+        labs = (
+            LabTestMeasurement.objects.select_related("indicator")
+            .prefetch_related("indicator__translations")
+            .order_by("measured_at", "id")
+        )
+        lookups.append(Prefetch(f"{prefix}labtests", queryset=labs, to_attr="shared_labs"))
+    return lookups
+
+
+def share_payload(link: ShareLink) -> dict | None:
+    """Template context for the shared object, or ``None`` if it no longer exists."""
+
+    scope = link_scope(link)
+    with_labs = scope != "summary"
+    if link.object_type == "event":
+        document = None
+        event = (
+            MedicalEvent.objects.filter(pk=link.object_id, owner_id=link.owner_id)
+            .select_related("specialty")
+            .prefetch_related(*_event_lookups("", with_labs))
+            .first()
+        )
+        if event is None:
+            return None
+    else:
+        document = (
+            Document.objects.filter(pk=link.object_id, owner_id=link.owner_id)
+            .select_related("medical_event__specialty")
+            .prefetch_related(*_event_lookups("medical_event__", with_labs))
+            .first()
+        )
+        if document is None:
+            return None
+        event = document.medical_event
+    labs = getattr(event, "shared_labs", []) if event else []
+    return {"scope": scope, "event": event, "document": document, "labs": labs}
+
+
+def share_cache_key(link: ShareLink, scope: str) -> str:
+    return (
+        f"{CACHE_PREFIX}:{link.token}:{scope}:{get_language() or settings.LANGUAGE_CODE}:"
+        f"{record_version(link.owner_id)}:{share_version(link.token)}"
+    )
+
+
+def render_share_body(link: ShareLink) -> str | None:
+    """Rendered share content (safe HTML), or ``None`` if the shared object is gone."""
+
+    cacheable = not link.password_hash
+    key = share_cache_key(link, link_scope(link)) if cacheable else None
+    if cacheable:
+        html = cache.get(key)
+        if html is not None:
+            return mark_safe(html)
+    payload = share_payload(link)
+    if payload is None:
+        return None
+    html = render_to_string("subpages/share_public_body.html", payload)
+    if cacheable:
+        cache.set(key, html, timeout=getattr(settings, "SHARE_PAGE_CACHE_TIMEOUT", 3600))
+    return mark_safe(html)
@@ -0,0 +1,87 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_series(apps, schema_editor, batch_size=500):
+    """Build the series of every patient/indicator pair from existing measurements."""
+
+    LabTestMeasurement = apps.get_model("records", "LabTestMeasurement")
+    LabSeries = apps.get_model("records", "LabSeries")
+    rows = (
+        LabTestMeasurement.objects.exclude(measured_at=None)
+        .order_by("medical_event__patient_id", "indicator_id", "measured_at", "id")
+        .values_list("medical_event__patient_id", "indicator_id", "measured_at", "value")
+        .iterator(chunk_size=2000)
+    )
+    pending, key, stamps, values = [], None, [], []
+
+    def flush():
+        if key and key[0] and stamps:
+            pending.append(
+                LabSeries(
+                    patient_id=key[0],
+                    indicator_id=key[1],
+                    timestamps=[t.isoformat() for t in stamps],
+                    values=values,
+                    count=len(values),
+                    first_measured_at=stamps[0],
+                    last_measured_at=stamps[-1],
+                )
+            )
+        if len(pending) >= batch_size:
+            LabSeries.objects.bulk_create(pending)
+            pending.clear()
+
+    for patient_id, indicator_id, measured_at, value in rows:
+        if (patient_id, indicator_id) != key:
+            flush()
+            key, stamps, values = (patient_id, indicator_id), [], []
+        if value is None:
+            continue
+        stamps.append(measured_at)
+        values.append(float(value))
+    flush()
+    LabSeries.objects.bulk_create(pending)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("records", "0004_document_analysis_html_document_analysis_text_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LabSeries",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("timestamps", models.JSONField(blank=True, default=list)),
+                ("values", models.JSONField(blank=True, default=list)),
+                ("count", models.PositiveIntegerField(default=0)),
+                ("first_measured_at", models.DateTimeField(blank=True, null=True)),
+                ("last_measured_at", models.DateTimeField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="labseries",
+            name="indicator",
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="series", to="records.labindicator"),
+        ),
+        migrations.AddField(
+            model_name="labseries",
+            name="patient",
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="lab_series", to="records.patientprofile"),
+        ),
+        migrations.AddIndex(
+            model_name="labseries",
+            index=models.Index(fields=["patient", "-count"], name="records_lab_patient_51689e_idx"),
+        ),
+        migrations.AlterUniqueTogether(
+            name="labseries",
+            unique_together={("patient", "indicator")},
+        ),
+        migrations.RunPython(fill_series, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("records", "0005_labseries"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="labtestmeasurement",
+            index=models.Index(fields=["indicator", "value"], name="records_lab_ind_value_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="labtestmeasurement",
+            index=models.Index(fields=["indicator", "measured_at"], name="records_lab_ind_measured_idx"),
+        ),
+    ]
@@ -0,0 +1,140 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE records_documentsearchindex ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A')
+        || setweight(to_tsvector('simple', coalesce(tags, '')), 'B')
+        || setweight(to_tsvector('simple', coalesce(analysis, '')), 'C')
+        || setweight(to_tsvector('simple', coalesce(ocr, '')), 'D')
+    ) STORED
+    """,
+    "CREATE INDEX records_docsearch_vector_gin ON records_documentsearchindex USING GIN (search_vector)",
+]
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS records_docsearch_vector_gin",
+    "ALTER TABLE records_documentsearchindex DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE records_documentsearch_fts USING fts5(
+        title, tags, analysis, ocr, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER records_documentsearch_ai AFTER INSERT ON records_documentsearchindex BEGIN
+        INSERT INTO records_documentsearch_fts (rowid, title, tags, analysis, ocr)
+        VALUES (new.document_id, new.title, new.tags, new.analysis, new.ocr);
+    END
+    """,
+    """
+    CREATE TRIGGER records_documentsearch_ad AFTER DELETE ON records_documentsearchindex BEGIN
+        DELETE FROM records_documentsearch_fts WHERE rowid = old.document_id;
+    END
+    """,
+    """
+    CREATE TRIGGER records_documentsearch_au AFTER UPDATE ON records_documentsearchindex BEGIN
+        DELETE FROM records_documentsearch_fts WHERE rowid = old.document_id;
+        INSERT INTO records_documentsearch_fts (rowid, title, tags, analysis, ocr)
+        VALUES (new.document_id, new.title, new.tags, new.analysis, new.ocr);
+    END
+    """,
+]
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS records_documentsearch_au",
+    "DROP TRIGGER IF EXISTS records_documentsearch_ad",
+    "DROP TRIGGER IF EXISTS records_documentsearch_ai",
+    "DROP TABLE IF EXISTS records_documentsearch_fts",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for sql in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+
+    return run
+
+
+def _names(obj):
+    if obj is None:
+        return []
+    names = []
+    for translation in obj.translations.all():
+        name = (getattr(translation, "name", "") or "").strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def _join(parts):
+    return "\n".join(p.strip() for p in parts if p and p.strip())
+
+
+def _search_fields(document):
+    # Mirrors records.management.services.search.document_search_fields as of
+    # this migration, on historical models.
+    tag_names = []
+    for tag in document.tags.all():
+        tag_names.extend(_names(tag))
+    return {
+        "title": _join([document.title, document.summary, getattr(document.medical_event, "summary", None)]),
+        "tags": _join(tag_names + _names(document.doc_type) + _names(document.specialty) + _names(document.category)),
+        "analysis": _join([document.analysis_text]),
+        "ocr": _join([document.original_ocr_text]),
+    }
+
+
+def index_existing_documents(apps, schema_editor, batch_size=500):
+    """Fill the index for documents uploaded before it existed."""
+
+    Document = apps.get_model("records", "Document")
+    DocumentSearchIndex = apps.get_model("records", "DocumentSearchIndex")
+    documents = (
+        Document.objects.select_related("medical_event", "doc_type", "specialty", "category")
+        .prefetch_related(
+            "tags__translations", "doc_type__translations", "specialty__translations", "category__translations"
+        )
+        .order_by("pk")
+    )
+    last_id = 0
+    while True:
+        batch = list(documents.filter(pk__gt=last_id)[:batch_size])
+        if not batch:
+            return
+        DocumentSearchIndex.objects.bulk_create(
+            [DocumentSearchIndex(document_id=doc.pk, **_search_fields(doc)) for doc in batch],
+            ignore_conflicts=True,
+        )
+        last_id = batch[-1].pk
+
+
+create_search_backend = _run({"postgresql": POSTGRES_FORWARD, "sqlite": SQLITE_FORWARD})
+drop_search_backend = _run({"postgresql": POSTGRES_REVERSE, "sqlite": SQLITE_REVERSE})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("records", "0006_labtestmeasurement_abnormal_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DocumentSearchIndex",
+            fields=[
+                ("document", models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name="search_index", serialize=False, to="records.document")),
+                ("title", models.TextField(blank=True, default="")),
+                ("tags", models.TextField(blank=True, default="")),
+                ("analysis", models.TextField(blank=True, default="")),
+                ("ocr", models.TextField(blank=True, default="")),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_search_backend, drop_search_backend),
+        migrations.RunPython(index_existing_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:06
+
+from collections import Counter
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import ExtractYear
+
+
+def count_existing_documents(apps, schema_editor):
+    """Fill the counters from the documents as they are at this migration."""
+
+    Document = apps.get_model("records", "Document")
+    DocumentTag = apps.get_model("records", "DocumentTag")
+    DocumentFacetCount = apps.get_model("records", "DocumentFacetCount")
+
+    counts = Counter()
+    for facet, field in (
+        ("doc_type", "doc_type_id"),
+        ("specialty", "medical_event__specialty_id"),
+        ("category", "medical_event__category_id"),
+    ):
+        rows = (
+            Document.objects.exclude(**{f"{field}__isnull": True})
+            .values("owner_id", field)
+            .annotate(n=Count("id"))
+            .order_by()
+        )
+        for row in rows:
+            counts[(row["owner_id"], facet, str(row[field]))] += row["n"]
+    years = (
+        Document.objects.exclude(medical_event__event_date__isnull=True)
+        .annotate(y=ExtractYear("medical_event__event_date"))
+        .values("owner_id", "y")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+    for row in years:
+        counts[(row["owner_id"], "year", str(row["y"]))] += row["n"]
+    for row in DocumentTag.objects.values("document__owner_id", "tag_id").annotate(n=Count("id")).order_by():
+        counts[(row["document__owner_id"], "tag", str(row["tag_id"]))] += row["n"]
+
+    DocumentFacetCount.objects.bulk_create(
+        [
+            DocumentFacetCount(owner_id=owner_id, facet=facet, key=key, count=count)
+            for (owner_id, facet, key), count in counts.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("records", "0007_documentsearchindex"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DocumentFacetCount",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("facet", models.CharField(choices=[("category", "category"), ("specialty", "specialty"), ("doc_type", "doc_type"), ("tag", "tag"), ("year", "year")], max_length=16)),
+                ("key", models.CharField(max_length=64)),
+                ("count", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="documentfacetcount",
+            name="owner",
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="document_facets", to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name="documentfacetcount",
+            unique_together={("owner", "facet", "key")},
+        ),
+        migrations.RunPython(count_existing_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+from django.db import migrations, models
+
+from ._operations import AddIndexConcurrently
+
+# Indexes that used to be created by the ``optimize_indexes`` command outside
+# of the migration state. Token and owner are already indexed by the unique
+# constraint and the foreign key; the measurement one is superseded by
+# records_lab_event_ind_time_idx.
+LEGACY_INDEXES = (
+    ("records_sharelink", "records_sharelink_token_idx"),
+    ("records_sharelink", "records_sharelink_owner_idx"),
+    ("records_labtestmeasurement", "records_labtestmeasurement_event_measured_idx"),
+)
+
+
+def drop_legacy_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        for table, name in LEGACY_INDEXES:
+            if name not in connection.introspection.get_constraints(cursor, table):
+                continue
+            if connection.vendor == "postgresql":
+                schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(name)}")
+            elif connection.vendor == "mysql":
+                schema_editor.execute(f"DROP INDEX {schema_editor.quote_name(name)} ON {schema_editor.quote_name(table)}")
+            else:
+                schema_editor.execute(f"DROP INDEX IF EXISTS {schema_editor.quote_name(name)}")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("records", "0008_documentfacetcount"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="document",
+            index=models.Index(fields=["owner", "-uploaded_at"], name="records_doc_owner_uploaded_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="labtestmeasurement",
+            index=models.Index(
+                fields=["medical_event", "indicator", "measured_at"], name="records_lab_event_ind_time_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="medicalevent",
+            index=models.Index(fields=["patient", "-event_date"], name="records_event_patient_date_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="sharelink",
+            index=models.Index(
+                condition=models.Q(("expires_at__isnull", False)),
+                fields=["status", "expires_at"],
+                name="records_share_status_exp_idx",
+            ),
+        ),
+        migrations.RunPython(drop_legacy_indexes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("records", "0009_hot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sharelink",
+            name="revoked_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="sharelink",
+            name="status",
+            field=models.CharField(
+                choices=[("active", "active"), ("expired", "expired"), ("revoked", "revoked")],
+                default="active",
+                max_length=16,
+            ),
+        ),
+    ]
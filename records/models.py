@@ -2,7 +2,8 @@ import secrets
 
 from django.conf import settings
 from django.db import models
-from django.db.models import Q
+from django.db.models import Case, CharField, Count, F, Q, Value, When
+from django.db.models.functions import Trunc
 from django.utils import timezone
 from django.utils.text import slugify
 from parler.models import TranslatableModel, TranslatedFields
@@ -142,6 +143,11 @@ class MedicalEvent(models.Model):
     tags = models.ManyToManyField("records.Tag", through="records.EventTag", related_name="events", blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["patient", "-event_date"], name="records_event_patient_date_idx"),
+        ]
+
     def __str__(self):
         return f"{self.patient_id}-{self.event_date}"
 
@@ -186,6 +192,9 @@ class Document(models.Model):
                 name="document_owner_content_hash_unique",
             )
         ]
+        indexes = [
+            models.Index(fields=["owner", "-uploaded_at"], name="records_doc_owner_uploaded_idx"),
+        ]
 
     def __str__(self):
         return self.title or f"{self.id}"
@@ -297,14 +306,61 @@ class LabIndicatorAlias(models.Model):
         unique_together = [("indicator", "alias_raw")]
 
 
+def _low_q():
+    return Q(indicator__reference_low__isnull=False, value__lt=F("indicator__reference_low"))
+
+
+def _high_q():
+    return Q(indicator__reference_high__isnull=False, value__gt=F("indicator__reference_high"))
+
+
+class LabTestMeasurementQuerySet(models.QuerySet):
+    def with_abnormal_flag(self):
+        return self.annotate(
+            abnormal_code=Case(
+                When(_low_q(), then=Value("L")),
+                When(_high_q(), then=Value("H")),
+                default=Value(""),
+                output_field=CharField(max_length=1),
+            )
+        )
+
+    def abnormal(self):
+        return self.filter(_low_q() | _high_q())
+
+    def abnormal_counts(self, period=None):
+        """Count abnormal results per indicator and flag, optionally per ``period``.
+
+        ``period`` is any ``Trunc`` kind ("day", "week", "month", "year").
+        """
+
+        qs = self.abnormal().with_abnormal_flag()
+        fields = ["indicator_id", "abnormal_code"]
+        if period:
+            qs = qs.annotate(period=Trunc("measured_at", period))
+            fields.append("period")
+        return qs.values(*fields).annotate(total=Count("id")).order_by(*fields)
+
+
 class LabTestMeasurement(models.Model):
     medical_event = models.ForeignKey("records.MedicalEvent", on_delete=models.CASCADE, related_name="labtests")
     indicator = models.ForeignKey("records.LabIndicator", on_delete=models.PROTECT, related_name="measurements")
     value = models.FloatField()
     measured_at = models.DateTimeField()
 
+    objects = LabTestMeasurementQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["indicator", "value"], name="records_lab_ind_value_idx"),
+            models.Index(fields=["indicator", "measured_at"], name="records_lab_ind_measured_idx"),
+            models.Index(fields=["medical_event", "indicator", "measured_at"], name="records_lab_event_ind_time_idx"),
+        ]
+
     @property
     def abnormal_flag(self):
+        if "abnormal_code" in self.__dict__:
+            return self.abnormal_code
         lo = self.indicator.reference_low
         hi = self.indicator.reference_high
         if lo is not None and self.value < lo:
@@ -317,8 +373,61 @@ class LabTestMeasurement(models.Model):
         return f"{self.indicator.slug}={self.value}"
 
 
+class LabSeries(models.Model):
+    patient = models.ForeignKey("records.PatientProfile", on_delete=models.CASCADE, related_name="lab_series")
+    indicator = models.ForeignKey("records.LabIndicator", on_delete=models.CASCADE, related_name="series")
+    timestamps = models.JSONField(default=list, blank=True)
+    values = models.JSONField(default=list, blank=True)
+    count = models.PositiveIntegerField(default=0)
+    first_measured_at = models.DateTimeField(blank=True, null=True)
+    last_measured_at = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("patient", "indicator")
+        indexes = [models.Index(fields=["patient", "-count"])]
+
+    def __str__(self):
+        return f"{self.patient_id}-{self.indicator_id} ({self.count})"
+
+    def points(self):
+        return list(zip(self.timestamps or [], self.values or []))
+
+
+class DocumentSearchIndex(models.Model):
+    document = models.OneToOneField("records.Document", on_delete=models.CASCADE, primary_key=True, related_name="search_index")
+    title = models.TextField(blank=True, default="")
+    tags = models.TextField(blank=True, default="")
+    analysis = models.TextField(blank=True, default="")
+    ocr = models.TextField(blank=True, default="")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"search-{self.document_id}"
+
+
+class DocumentFacetCount(models.Model):
+    FACET_CHOICES = (
+        ("category", "category"),
+        ("specialty", "specialty"),
+        ("doc_type", "doc_type"),
+        ("tag", "tag"),
+        ("year", "year"),
+    )
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="document_facets")
+    facet = models.CharField(max_length=16, choices=FACET_CHOICES)
+    key = models.CharField(max_length=64)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("owner", "facet", "key")
+
+    def __str__(self):
+        return f"{self.owner_id}:{self.facet}:{self.key}={self.count}"
+
+
 class ShareLink(models.Model):
-    STATUS_CHOICES = (("active", "active"), ("revoked", "revoked"))
+    STATUS_CHOICES = (("active", "active"), ("expired", "expired"), ("revoked", "revoked"))
     OBJECT_CHOICES = (("document", "document"), ("event", "event"))
     FORMAT_CHOICES = (("pdf", "pdf"), ("csv", "csv"), ("html", "html"))
     token = models.CharField(max_length=64, unique=True)
@@ -330,8 +439,18 @@ class ShareLink(models.Model):
     expires_at = models.DateTimeField(blank=True, null=True)
     password_hash = models.CharField(max_length=128, blank=True, null=True)
     status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="active")
+    revoked_at = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["status", "expires_at"],
+                name="records_share_status_exp_idx",
+                condition=Q(expires_at__isnull=False),
+            ),
+        ]
+
 
 class OcrLog(models.Model):
     SOURCE_CHOICES = (("vision", "vision"), ("flask", "flask"))
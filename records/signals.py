@@ -1,6 +1,30 @@
-from django.db.models.signals import post_save, post_delete, post_migrate
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete, post_migrate, pre_delete, pre_save
 from django.dispatch import receiver
-from .models import DocumentTag, LabTestMeasurement, MedicalEvent, get_indicator_canonical_tag
+from .models import (
+    Document,
+    DocumentTag,
+    LabTestMeasurement,
+    MedicalEvent,
+    PatientProfile,
+    ShareLink,
+    get_indicator_canonical_tag,
+)
+from .management.services.document_facets import (
+    apply_move,
+    document_state,
+    event_keys,
+    shift_event_documents,
+    tag_delta,
+)
+from .management.services.record_versions import (
+    bump_profile_version,
+    bump_record_version,
+    bump_record_versions,
+    bump_share_version,
+)
 
 def _sync_event_tags(event):
     tag_ids = list(
@@ -13,12 +37,25 @@ def _sync_event_tags(event):
     else:
         event.tags.clear()
 
+def _bump_document_owners(document_ids):
+    bump_record_versions(Document.objects.filter(pk__in=list(document_ids)).values_list("owner_id", flat=True))
+
+def _reindex_document(document_id):
+    from .management.services.search import index_document_id
+
+    if document_id:
+        index_document_id(document_id)
+
 @receiver(post_save, sender=DocumentTag)
-def documenttag_saved(sender, instance, **kwargs):
+def documenttag_saved(sender, instance, created=False, raw=False, **kwargs):
     doc = getattr(instance, "document", None)
     ev = getattr(doc, "medical_event", None) if doc else None
     if ev:
         _sync_event_tags(ev)
+    _reindex_document(instance.document_id)
+    if created and not raw:
+        tag_delta([instance.document_id], [instance.tag_id], 1)
+        _bump_document_owners([instance.document_id])
 
 @receiver(post_delete, sender=DocumentTag)
 def documenttag_deleted(sender, instance, **kwargs):
@@ -26,14 +63,132 @@ def documenttag_deleted(sender, instance, **kwargs):
     ev = getattr(doc, "medical_event", None) if doc else None
     if ev:
         _sync_event_tags(ev)
+    tag_delta([instance.document_id], [instance.tag_id], -1)
+    _bump_document_owners([instance.document_id])
+    # The document itself may be mid-cascade delete; reindex once it is settled.
+    transaction.on_commit(partial(_reindex_document, instance.document_id))
+
+@receiver(pre_save, sender=Document)
+def document_pre_save(sender, instance, raw=False, **kwargs):
+    instance._facet_state = None if raw or instance.pk is None else document_state(instance.pk)
+
+@receiver(post_save, sender=Document)
+def document_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _reindex_document(instance.pk)
+    apply_move(getattr(instance, "_facet_state", None), document_state(instance.pk))
+    bump_record_version(instance.owner_id)
+
+@receiver(pre_delete, sender=Document)
+def document_pre_delete(sender, instance, **kwargs):
+    instance._facet_state = document_state(instance.pk)
+
+@receiver(post_delete, sender=Document)
+def document_deleted(sender, instance, **kwargs):
+    apply_move(getattr(instance, "_facet_state", None), None)
+    bump_record_version(instance.owner_id)
+
+@receiver(post_delete, sender=MedicalEvent)
+def medicalevent_deleted(sender, instance, **kwargs):
+    bump_record_version(instance.owner_id)
+
+@receiver(pre_save, sender=MedicalEvent)
+def medicalevent_pre_save(sender, instance, raw=False, **kwargs):
+    instance._facet_keys = set() if raw or instance.pk is None else event_keys(instance.pk)
+
+@receiver(post_save, sender=MedicalEvent)
+def medicalevent_saved(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    bump_record_version(instance.owner_id)
+    if created:
+        return
+    shift_event_documents(instance.pk, getattr(instance, "_facet_keys", set()), event_keys(instance.pk))
+
+@receiver(m2m_changed, sender=DocumentTag)
+def document_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if action == "post_add" and pk_set:
+        # add() bulk-creates the through rows, so post_save never fires for them;
+        # removals go through DocumentTag.post_delete instead.
+        if reverse:
+            tag_delta(pk_set, [instance.pk], 1)
+            _bump_document_owners(pk_set)
+        else:
+            tag_delta([instance.pk], pk_set, 1)
+            bump_record_version(instance.owner_id)
+    if not reverse:
+        _reindex_document(instance.pk)
+    elif pk_set:
+        for document_id in pk_set:
+            _reindex_document(document_id)
+
+def _lab_aggregates_changed(event_id):
+    from .management.services.lab_facets import invalidate_indicator_facets
+
+    ev = MedicalEvent.objects.filter(pk=event_id).only("patient_id", "owner_id").first()
+    if ev:
+        invalidate_indicator_facets(ev.patient_id)
+        bump_record_version(ev.owner_id)
+    return ev
+
+def _event_patient_id(event_id):
+    return MedicalEvent.objects.filter(pk=event_id).values_list("patient_id", flat=True).first()
+
+@receiver(pre_save, sender=LabTestMeasurement)
+def labmeasurement_pre_save(sender, instance, raw=False, **kwargs):
+    instance._series_before = None
+    if raw or not instance.pk:
+        return
+    instance._series_before = (
+        LabTestMeasurement.objects.filter(pk=instance.pk)
+        .values_list("medical_event_id", "indicator_id", "measured_at", "value")
+        .first()
+    )
 
 @receiver(post_save, sender=LabTestMeasurement)
-def labmeasurement_saved(sender, instance, **kwargs):
+def labmeasurement_saved(sender, instance, created=False, raw=False, **kwargs):
+    from .management.services.lab_series import add_point, remove_point
+
     ev = getattr(instance, "medical_event", None)
     ind = getattr(instance, "indicator", None)
     tag = get_indicator_canonical_tag(ind)
     if ev and tag:
         ev.tags.add(tag)
+    rebuilt = None
+    before = getattr(instance, "_series_before", None)
+    if before:
+        old_event_id, old_indicator_id, old_measured_at, old_value = before
+        old_patient_id = _event_patient_id(old_event_id)
+        if old_patient_id and old_indicator_id:
+            if not remove_point(old_patient_id, old_indicator_id, old_measured_at, old_value):
+                # The rebuild already read the new state of this series.
+                rebuilt = (old_patient_id, old_indicator_id)
+        if old_event_id != instance.medical_event_id:
+            _lab_aggregates_changed(old_event_id)
+    current = _lab_aggregates_changed(instance.medical_event_id)
+    if current and instance.indicator_id and rebuilt != (current.patient_id, instance.indicator_id):
+        add_point(current.patient_id, instance.indicator_id, instance.measured_at, instance.value)
+
+@receiver(post_delete, sender=LabTestMeasurement)
+def labmeasurement_deleted(sender, instance, **kwargs):
+    from .management.services.lab_series import remove_point
+
+    ev = _lab_aggregates_changed(instance.medical_event_id)
+    if ev and instance.indicator_id:
+        remove_point(ev.patient_id, instance.indicator_id, instance.measured_at, instance.value)
+
+@receiver(post_save, sender=PatientProfile)
+@receiver(post_delete, sender=PatientProfile)
+def patientprofile_changed(sender, instance, **kwargs):
+    bump_profile_version(instance.user_id)
+
+@receiver(post_save, sender=ShareLink)
+@receiver(post_delete, sender=ShareLink)
+def sharelink_changed(sender, instance, **kwargs):
+    bump_share_version(instance.token)
 
 def post_migrate_sync(sender, **kwargs):
     for ev in MedicalEvent.objects.all():
@@ -1,13 +1,19 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 import base64
 import json
+import tempfile
 from records.models import MedicalCategory, MedicalSpecialty, DocumentType, MedicalEvent, Document, LabTestMeasurement
 
 class UploadFlowTests(TestCase):
     def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_override = override_settings(MEDIA_ROOT=self.media.name)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
         self.client = Client()
         self.user = User.objects.create_user(username="u1", password="p1")
         self.client.login(username="u1", password="p1")
@@ -148,3 +154,91 @@ class UploadFlowTests(TestCase):
         self.assertEqual(doc.date_created, doc.uploaded_at.date())
         self.assertEqual(doc.summary, "custom summary")
         self.assertTrue(doc.content_hash)
+
+
+class UploadIngestTests(TestCase):
+    def setUp(self):
+        from records.models import PatientProfile
+
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_override = override_settings(MEDIA_ROOT=self.media.name)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.user = User.objects.create_user(username="ingest", password="p1")
+        PatientProfile.objects.create(user=self.user, first_name_bg="Иван", last_name_bg="Петров", date_of_birth="1990-01-01")
+        self.client.login(username="ingest", password="p1")
+        self.ids = {}
+        for model, key in ((MedicalCategory, "category_id"), (MedicalSpecialty, "specialty_id"), (DocumentType, "doc_type_id")):
+            obj = model(slug=key)
+            obj.set_current_language("bg")
+            obj.name = key
+            obj.save()
+            self.ids[key] = obj.id
+
+    def test_base64_upload_is_hashed_while_stored_and_ocr_skips_duplicates(self):
+        from unittest import mock
+        import hashlib
+
+        content = b"%PDF-1.4\n" + bytes(range(256)) * 700
+        encoded = base64.encodebytes(content).decode("ascii")
+        payload = dict(self.ids, file_b64=encoded, file_name="scan.bin", final_summary="sum")
+        res = self.client.post("/api/upload/confirm/", data=json.dumps(payload), content_type="application/json")
+        self.assertEqual(res.status_code, 200)
+        doc = Document.objects.get(pk=res.json()["document_id"])
+        self.assertEqual(doc.content_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual((doc.file_size, doc.file_mime), (len(content), "application/pdf"))
+        with doc.file.open("rb") as fh:
+            self.assertEqual(fh.read(), content)
+        self.addCleanup(doc.file.delete, save=False)
+
+        bad = dict(payload, file_b64=encoded[:-3])
+        res = self.client.post("/api/upload/confirm/", data=json.dumps(bad), content_type="application/json")
+        self.assertEqual(res.status_code, 400)
+
+        with mock.patch("records.views.upload._ocr_pipeline") as ocr:
+            f = SimpleUploadedFile("again.pdf", content, content_type="application/pdf")
+            res = self.client.post("/api/upload/ocr/", dict(self.ids, file=f))
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(res.json()["document_id"], doc.id)
+        ocr.assert_not_called()
+
+    def test_failed_confirm_removes_stored_file_and_records(self):
+        from unittest import mock
+
+        storage = Document._meta.get_field("file").storage
+        payload = dict(self.ids, file_b64=base64.b64encode(b"%PDF-1.4 orphan").decode("ascii"), file_name="orphan.pdf")
+        with mock.patch("records.views.upload._persist_lab_measurements", side_effect=RuntimeError("boom")), \
+                mock.patch.object(storage, "delete", wraps=storage.delete) as delete:
+            with self.assertRaises(RuntimeError):
+                self.client.post("/api/upload/confirm/", data=json.dumps(payload), content_type="application/json")
+        delete.assert_called_once()
+        self.assertFalse(storage.exists(delete.call_args.args[0]))
+        self.assertFalse(Document.objects.exists())
+        self.assertFalse(MedicalEvent.objects.exists())
+
+    def test_duplicates_are_answered_before_storage(self):
+        from unittest import mock
+
+        storage = Document._meta.get_field("file").storage
+        payload = dict(self.ids, file_b64=base64.b64encode(b"%PDF-1.4 twice").decode("ascii"), file_name="twice.pdf")
+        send = lambda: self.client.post("/api/upload/confirm/", data=json.dumps(payload), content_type="application/json")
+        self.assertEqual(send().status_code, 200)
+        doc = Document.objects.get()
+        events = MedicalEvent.objects.count()
+
+        with mock.patch.object(storage, "save", wraps=storage.save) as save:
+            self.assertEqual(send().status_code, 409)
+        save.assert_not_called()
+
+        # A concurrent confirm that passed the pre-check loses on the unique
+        # constraint: its event is rolled back along with the document.
+        racing = mock.Mock(side_effect=[None, doc])
+        with mock.patch("records.views.upload.find_duplicate", racing), \
+                mock.patch.object(storage, "delete", wraps=storage.delete) as delete:
+            response = send()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["document_id"], doc.id)
+        self.assertEqual(MedicalEvent.objects.count(), events)
+        self.assertEqual(Document.objects.count(), 1)
+        self.assertFalse(storage.exists(delete.call_args.args[0]))
@@ -1,18 +1,49 @@
+import hashlib
+import json
+import tempfile
+from importlib import import_module
+from datetime import date, timedelta
+from io import StringIO
+from pathlib import Path
+
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import translation
+
+from records.management.commands.explain_hot_queries import SEQ_SCAN_PATTERNS
+from records.management.services.backfill import Checkpoint
+from records.management.services.casefiles import casefile_documents, document_items, document_page
+from records.management.services.document_facets import facet_panels, find_drift
+from records.management.services.record_versions import record_version
 
 from records.models import (
     Document,
+    DocumentFacetCount,
+    DocumentSearchIndex,
     DocumentType,
     MedicalCategory,
     MedicalEvent,
     MedicalSpecialty,
     PatientProfile,
+    Tag,
 )
 
 
+def other_process():
+    """Settings under which ``default`` is another process's private cache."""
+
+    local = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "other-process"}
+    return override_settings(CACHES={**settings.CACHES, "default": local})
+
+
 def create_tx(instance, name_bg, slug):
     instance.set_current_language("bg")
     instance.name = name_bg
@@ -23,6 +54,11 @@ def create_tx(instance, name_bg, slug):
 
 class DocumentRoutingTests(TestCase):
     def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_override = override_settings(MEDIA_ROOT=self.media.name)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
         self.user = User.objects.create_user(username="docs", password="pass123")
         self.client.login(username="docs", password="pass123")
         self.profile = PatientProfile.objects.create(
@@ -64,3 +100,275 @@ class DocumentRoutingTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn("document", response.context)
         self.assertEqual(response.context["document"].pk, self.document.pk)
+
+
+class CasefilesPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="cases", password="pass123")
+        self.client.login(username="cases", password="pass123")
+        self.profile = PatientProfile.objects.create(
+            user=self.user,
+            first_name_bg="Анна",
+            last_name_bg="Иванова",
+            date_of_birth="1990-01-01",
+        )
+        self.specialty = create_tx(MedicalSpecialty(), "Кардиология", "cardio")
+        self.category = create_tx(MedicalCategory(), "Документи", "cat")
+        self.doc_type = create_tx(DocumentType(), "Епикриза", "report")
+        self.tags = [create_tx(Tag(), f"Таг {i}", f"tag-{i}") for i in range(3)]
+
+    def _documents(self, count, start=0):
+        for i in range(start, start + count):
+            event = MedicalEvent.objects.create(
+                patient=self.profile,
+                owner=self.user,
+                specialty=self.specialty,
+                category=self.category,
+                event_date=date(2024, 1, 1) + timedelta(days=i),
+            )
+            doc = Document.objects.create(
+                owner=self.user,
+                medical_event=event,
+                specialty=self.specialty,
+                category=self.category,
+                doc_type=self.doc_type,
+                summary=f"Документ {i}",
+            )
+            doc.tags.add(*self.tags)
+
+    def _page_queries(self):
+        with translation.override("bg"), CaptureQueriesContext(connection) as ctx:
+            qs = casefile_documents(self.user, self.profile.id)
+            docs, _ = document_page(qs, "date_desc", page_size=50)
+            items = document_items(docs)
+        self.assertTrue(all(item["type_name"] == "Епикриза" for item in items))
+        self.assertTrue(all(len(item["tags"]) == 3 for item in items))
+        return len(ctx.captured_queries)
+
+    def test_page_query_count_does_not_grow_with_documents(self):
+        self._documents(3)
+        few = self._page_queries()
+        self._documents(20, start=3)
+        self.assertEqual(self._page_queries(), few)
+        self.assertLessEqual(few, 3)
+
+    @override_settings(CASEFILES_PAGE_SIZE=4)
+    def test_casefiles_cursor_pages_cover_all_documents(self):
+        self._documents(10)
+        url = reverse("medj:casefiles")
+        seen = []
+        response = self.client.get(url)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen.extend(item["id"] for group in response.context["grouped"] for item in group["items"])
+            next_url = response.context["next_page_url"]
+            if not next_url:
+                break
+            response = self.client.get(url + next_url)
+        expected = list(
+            Document.objects.order_by("-medical_event__event_date", "-id").values_list("id", flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+
+class DocumentFacetCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="facets", password="pass123")
+        self.profile = PatientProfile.objects.create(user=self.user, first_name_bg="Анна")
+        self.cardio = create_tx(MedicalSpecialty(), "Кардиология", "cardio")
+        self.neuro = create_tx(MedicalSpecialty(), "Неврология", "neuro")
+        self.category = create_tx(MedicalCategory(), "Документи", "cat")
+        self.doc_type = create_tx(DocumentType(), "Епикриза", "report")
+        self.tag = create_tx(Tag(), "Холестерол", "cholesterol")
+
+    def _event(self, specialty, day):
+        return MedicalEvent.objects.create(
+            patient=self.profile,
+            owner=self.user,
+            specialty=specialty,
+            category=self.category,
+            event_date=date(2023, 12, 31) + timedelta(days=day),
+        )
+
+    def _document(self, event):
+        return Document.objects.create(
+            owner=self.user,
+            medical_event=event,
+            specialty=event.specialty,
+            category=self.category,
+            doc_type=self.doc_type,
+        )
+
+    def test_counters_follow_create_move_and_delete(self):
+        first = self._document(self._event(self.cardio, 0))
+        second = self._document(self._event(self.cardio, 1))
+        second.tags.add(self.tag)
+        panels = facet_panels(self.user)
+        self.assertEqual(panels["specialty"], {str(self.cardio.id): 2})
+        self.assertEqual(panels["year"], {"2023": 1, "2024": 1})
+        self.assertEqual(panels["tag"], {str(self.tag.id): 1})
+
+        second.medical_event = self._event(self.neuro, 2)
+        second.save()
+        first.medical_event.event_date = date(2024, 6, 1)
+        first.medical_event.save()
+        panels = facet_panels(self.user)
+        self.assertEqual(panels["specialty"], {str(self.cardio.id): 1, str(self.neuro.id): 1})
+        self.assertEqual(panels["year"], {"2024": 2})
+
+        second.delete()
+        panels = facet_panels(self.user)
+        self.assertEqual(panels["specialty"], {str(self.cardio.id): 1})
+        self.assertEqual(panels["tag"], {})
+        self.assertEqual(find_drift(), [])
+
+    def test_checker_detects_and_rebuilds_drift(self):
+        self._document(self._event(self.cardio, 0))
+        DocumentFacetCount.objects.filter(facet="specialty").update(count=7)
+        with self.assertRaises(CommandError):
+            call_command("rebuild_document_facets", "--check")
+        call_command("rebuild_document_facets")
+        call_command("rebuild_document_facets", "--check")
+
+    def test_migration_counts_existing_documents(self):
+        migration = import_module("records.migrations.0008_documentfacetcount")
+        historical = MigrationLoader(connection).project_state(("records", "0008_documentfacetcount")).apps
+        self._document(self._event(self.cardio, 0))
+        self._document(self._event(self.neuro, 1)).tags.add(self.tag)
+        DocumentFacetCount.objects.all().delete()
+        migration.count_existing_documents(historical, None)
+        self.assertEqual(facet_panels(self.user)["specialty"], {str(self.cardio.id): 1, str(self.neuro.id): 1})
+        self.assertEqual(facet_panels(self.user)["tag"], {str(self.tag.id): 1})
+        self.assertEqual(find_drift(), [])
+
+
+class BackfillCommandTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        overrides = override_settings(MEDIA_ROOT=self.tmp.name, BACKFILL_CHECKPOINT_DIR=self.tmp.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.user = User.objects.create_user(username="backfill", password="pass123")
+        profile = PatientProfile.objects.create(user=self.user)
+        self.specialty = create_tx(MedicalSpecialty(), "Кардиология", "cardio")
+        self.category = create_tx(MedicalCategory(), "Документи", "cat")
+        self.doc_type = create_tx(DocumentType(), "Епикриза", "report")
+        self.event = MedicalEvent.objects.create(
+            patient=profile, owner=self.user, specialty=self.specialty, category=self.category, event_date="2024-01-01"
+        )
+
+    def _document(self, content, **fields):
+        return Document.objects.create(
+            owner=self.user,
+            medical_event=self.event,
+            specialty=self.specialty,
+            category=self.category,
+            doc_type=self.doc_type,
+            file=SimpleUploadedFile("scan.pdf", content),
+            **fields,
+        )
+
+    def test_hashes_are_backfilled_in_batches_and_resume_from_checkpoint(self):
+        first = self._document(b"first")
+        second = self._document(b"second")
+        dupe = self._document(b"second")
+        third = self._document(b"third")
+        Checkpoint("document_hashes").save(first.pk)
+
+        out = StringIO()
+        call_command("backfill_document_hashes", "--batch-size", "2", "--workers", "2", stdout=out, stderr=StringIO())
+        hashes = dict(Document.objects.values_list("pk", "content_hash"))
+        self.assertIsNone(hashes[first.pk])
+        self.assertEqual(hashes[second.pk], hashlib.sha256(b"second").hexdigest())
+        self.assertIsNone(hashes[dupe.pk])
+        self.assertEqual(hashes[third.pk], hashlib.sha256(b"third").hexdigest())
+        self.assertIn("Updated: 2. Skipped: 0. Duplicates: 1.", out.getvalue())
+        self.assertEqual(Checkpoint("document_hashes").load(), 0)
+
+        call_command("backfill_document_hashes", "--restart", stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Document.objects.get(pk=first.pk).content_hash, hashlib.sha256(b"first").hexdigest())
+
+    def test_analysis_backfill_bump_reaches_web_processes(self):
+        analysis = {"summary": "Нормален резултат"}
+        self._document(b"a", notes=json.dumps({"analysis": analysis}, ensure_ascii=False))
+        version = record_version(self.user)
+        with other_process():
+            call_command("backfill_document_analysis", "--workers", "0", stdout=StringIO())
+        self.assertNotEqual(record_version(self.user), version)
+
+    def test_analysis_backfill_renders_in_workers_and_bulk_writes(self):
+        analysis = {"summary": "Нормален резултат", "tables": [{"title": "Кръв", "columns": ["A"], "rows": [["1"]]}]}
+        stale = self._document(b"a", notes=json.dumps({"analysis": analysis}, ensure_ascii=False))
+        plain = self._document(b"b", notes="бележка", summary="ръчно")
+        version = record_version(self.user)
+
+        out = StringIO()
+        call_command("backfill_document_analysis", "--workers", "2", "--batch-size", "1", stdout=out)
+        stale.refresh_from_db()
+        self.assertIn("нормален", DocumentSearchIndex.objects.get(document=stale).analysis.lower())
+        self.assertNotEqual(record_version(self.user), version)
+        self.assertIn("<h3", stale.analysis_html)
+        self.assertEqual(stale.summary, "Нормален резултат")
+        self.assertTrue(stale.analysis_text.startswith("Нормален резултат"))
+        self.assertEqual(Document.objects.get(pk=plain.pk).summary, "ръчно")
+        self.assertIn("Updated 1 documents", out.getvalue())
+
+        out = StringIO()
+        call_command("backfill_document_analysis", "--dry-run", "--workers", "0", stdout=out)
+        self.assertIn("0 documents require updates", out.getvalue())
+
+    def test_match_docs_streams_map_and_writes_report(self):
+        media = Path(self.tmp.name) / "local"
+        media.mkdir()
+        (media / "scan-a.png").write_bytes(b"12345")
+        known = self._document(b"a", sha256="a" * 64)
+        Document.objects.filter(pk=known.pk).update(title="")
+        other = self._document(b"b", sha256="b" * 64)
+        entries = [
+            {"sha256": "a" * 64, "file_local": "scan-a.png", "title": "Скан"},
+            {"sha256": "b" * 64, "file_local": "missing.pdf"},
+            {"sha256": "c" * 64, "file_local": "scan-a.png"},
+            {"sha256": ""},
+        ]
+        map_path = Path(self.tmp.name) / "map.json"
+        map_path.write_text(json.dumps(entries, ensure_ascii=False, indent=1), encoding="utf-8")
+        report = Path(self.tmp.name) / "report.jsonl"
+        defaults = (
+            f"owner_id={self.user.pk},category_id={self.category.pk},"
+            f"doc_type_id={self.doc_type.pk},specialty_id={self.specialty.pk}"
+        )
+        call_command(
+            "match_docs", "--map", str(map_path), "--media-root", str(media), "--create-missing",
+            "--defaults", defaults, "--batch-size", "2", "--report", str(report), stdout=StringIO(),
+        )
+
+        known.refresh_from_db()
+        self.assertEqual((known.file.name, known.file_size, known.file_mime, known.title),
+                         ("documents/scan-a.png", 5, "image/png", "Скан"))
+        self.assertEqual(Document.objects.get(pk=other.pk).file_mime, "application/pdf")
+        created = Document.objects.get(sha256="c" * 64)
+        self.assertEqual((created.doc_kind, created.title), ("image", "scan-a"))
+        events = [json.loads(line) for line in report.read_text(encoding="utf-8").splitlines()]
+        self.assertEqual(events[-1], {"type": "summary", "entries": 3, "update": 2, "duplicate": 0,
+                                      "missing_local": 1, "created": 1})
+
+        jsonl = Path(self.tmp.name) / "map.jsonl"
+        jsonl.write_text("\n".join(json.dumps(e) for e in entries[:2]) + "\n", encoding="utf-8")
+        out = StringIO()
+        call_command("match_docs", "--map", str(jsonl), "--media-root", str(media), "--dry-run", stdout=out)
+        self.assertIn("Updated: 0", out.getvalue())
+        self.assertIn("missing.pdf", out.getvalue())
+
+
+class HotQueryIndexTests(TestCase):
+    def test_hot_queries_avoid_sequential_scans(self):
+        out = StringIO()
+        call_command("explain_hot_queries", "--check", stdout=out)
+        self.assertIn("No sequential scans", out.getvalue())
+
+    def test_sqlite_plan_detection(self):
+        pattern = SEQ_SCAN_PATTERNS["sqlite"]
+        self.assertEqual(pattern.findall("2 0 0 SCAN records_sharelink"), ["records_sharelink"])
+        self.assertEqual(pattern.findall("2 0 0 SCAN records_document USING INDEX records_doc_owner_uploaded_idx"), [])
+        self.assertEqual(pattern.findall("3 0 0 SEARCH records_sharelink USING INDEX records_share_status_exp_idx"), [])
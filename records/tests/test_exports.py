@@ -0,0 +1,278 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import types
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from PIL import Image
+from PyPDF2 import PdfReader
+from reportlab.pdfgen import canvas
+
+from records.management.services.export_artifacts import export_metrics
+from records.management.services import export_jobs
+from records.management.services.export_jobs import job_status, render_html, submit_job
+from records.management.services.pdf_overlay import load_template, overlay_template
+from records.models import (
+    Document,
+    DocumentType,
+    LabIndicator,
+    LabTestMeasurement,
+    MedicalCategory,
+    MedicalEvent,
+    MedicalSpecialty,
+    PatientProfile,
+)
+
+
+def create_tx(instance, name, slug):
+    instance.set_current_language("bg")
+    instance.name = name
+    instance.slug = slug
+    instance.save()
+    return instance
+
+
+def other_process():
+    """Settings under which ``default`` is another worker's private cache."""
+
+    local = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "other-process"}
+    return override_settings(CACHES={**settings.CACHES, "default": local})
+
+
+class ExportArtifactTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_override = override_settings(MEDIA_ROOT=self.media.name)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        self.user = User.objects.create_user(username="exports", password="pass123")
+        self.client.login(username="exports", password="pass123")
+        profile = PatientProfile.objects.create(
+            user=self.user, first_name_bg="Анна", last_name_bg="Иванова", date_of_birth="1990-01-01"
+        )
+        self.event = event = MedicalEvent.objects.create(
+            patient=profile,
+            owner=self.user,
+            specialty=create_tx(MedicalSpecialty(), "Кардиология", "cardio"),
+            category=create_tx(MedicalCategory(), "Документи", "docs"),
+            event_date="2024-01-01",
+        )
+        self.document = Document.objects.create(
+            owner=self.user,
+            medical_event=event,
+            specialty=event.specialty,
+            category=event.category,
+            doc_type=create_tx(DocumentType(), "Епикриза", "report"),
+            summary="Преглед",
+        )
+        self.url = reverse("medj:document_export_pdf", args=[self.document.pk])
+
+    def _stored_files(self):
+        found = []
+        for _, _, files in os.walk(self.media.name):
+            found.extend(files)
+        return found
+
+    @mock.patch("records.views.exports.render_template_to_pdf", return_value=b"%PDF-export")
+    def test_pdf_is_rendered_once_per_version(self, render):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.content, b"%PDF-export")
+        etag = first["ETag"]
+
+        second = self.client.get(self.url)
+        self.assertEqual(b"".join(second.streaming_content), b"%PDF-export")
+        self.assertEqual(second["ETag"], etag)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(render.call_count, 1)
+
+        self.document.summary = "Контролен преглед"
+        self.document.save()
+        third = self.client.get(self.url)
+        self.assertNotEqual(third["ETag"], etag)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(len(self._stored_files()), 1)
+
+        metrics = export_metrics("document")
+        self.assertEqual((metrics["misses"], metrics["hits"], metrics["not_modified"]), (2, 2, 1))
+        self.assertEqual(metrics["hit_rate"], 0.6)
+
+
+    @mock.patch("records.views.exports.render_template_to_pdf", return_value=b"%PDF-export")
+    def test_edit_in_another_process_invalidates_the_artifact(self, render):
+        etag = self.client.get(self.url)["ETag"]
+        with other_process():
+            self.document.summary = "Контролен преглед"
+            self.document.save()
+        self.assertNotEqual(self.client.get(self.url)["ETag"], etag)
+        self.assertEqual(render.call_count, 2)
+
+    @override_settings(EXPORT_WORKERS=0)
+    @mock.patch("records.management.services.export_jobs.render_html", return_value=b"%PDF-job")
+    def test_job_state_is_visible_to_other_processes(self, render_html):
+        with other_process():
+            job_id = submit_job(self.user, "pdf", "<p>job</p>", "http://testserver/", "job")
+        self.assertEqual(job_status(job_id, owner=self.user)["status"], "done")
+
+    @override_settings(EXPORT_WORKERS=2)
+    @mock.patch("records.management.services.export_jobs.ProcessPoolExecutor")
+    def test_worker_pool_is_spawned(self, pool):
+        self.addCleanup(setattr, export_jobs, "_executor", None)
+        export_jobs._executor = None
+        export_jobs._executor_instance()
+        self.assertEqual(pool.call_args.kwargs["mp_context"].get_start_method(), "spawn")
+
+    @override_settings(EXPORT_WORKERS=0, EXPORT_SYNC_MAX_ITEMS=0)
+    @mock.patch("records.management.services.export_jobs.render_html", return_value=b"%PDF-job")
+    def test_large_event_export_runs_as_job(self, render_html):
+        url = reverse("medj:event_export_pdf", args=[self.event.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(render_html.call_args.args[0], "pdf")
+
+        download = self.client.get(job["download_url"])
+        self.assertEqual(b"".join(download.streaming_content), b"%PDF-job")
+        with mock.patch("records.views.exports._is_large_event") as is_large:
+            cached = self.client.get(url)
+        self.assertEqual(cached.status_code, 200)
+        is_large.assert_not_called()
+        self.assertEqual(render_html.call_count, 1)
+
+        other = User.objects.create_user(username="other", password="pass123")
+        PatientProfile.objects.create(user=other, first_name_bg="Иван", last_name_bg="Петров", date_of_birth="1985-01-01")
+        self.client.login(username="other", password="pass123")
+        self.assertEqual(self.client.get(job["status_url"]).status_code, 404)
+
+    def test_shared_labs_report_streams_measurements(self):
+        indicator = create_tx(LabIndicator(unit="mmol/L", reference_low=3.9, reference_high=6.1), "Глюкоза", "glucose")
+        for day in range(1, 4):
+            LabTestMeasurement.objects.create(
+                medical_event=self.event,
+                indicator=indicator,
+                value=5.0 + day,
+                measured_at=timezone.now() - timezone.timedelta(days=day),
+            )
+        links = self.client.post(
+            reverse("medj:create_download_links"),
+            data=json.dumps({"filters": {"indicator": ["glucose"]}}),
+            content_type="application/json",
+        ).json()
+        self.client.logout()
+
+        response = self.client.get(links["pdf_labs_url"])
+        self.assertEqual(response.status_code, 200)
+        text = PdfReader(io.BytesIO(b"".join(response.streaming_content))).pages[0].extract_text()
+        self.assertIn("Глюкоза", text)
+        self.assertIn("8.0", text)
+        self.assertEqual(self.client.get(links["pdf_labs_url"].replace("&t=", "&t=x")).status_code, 403)
+    def _report_text(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        reader = PdfReader(io.BytesIO(b"".join(response.streaming_content)))
+        return "".join(page.extract_text() for page in reader.pages)
+
+    def test_shared_report_uses_signed_filters_and_owner(self):
+        self.event.summary = "SHAREDONE"
+        self.event.save()
+        MedicalEvent.objects.create(
+            patient=self.event.patient,
+            owner=self.user,
+            specialty=self.event.specialty,
+            category=create_tx(MedicalCategory(), "Други", "other"),
+            event_date="2024-02-01",
+            summary="SECRETTWO",
+        )
+        links = self.client.post(
+            reverse("medj:create_download_links"),
+            data=json.dumps({"filters": {"category": [self.event.category_id]}}),
+            content_type="application/json",
+        ).json()
+        url = links["pdf_events_url"]
+        tampered = url.replace(f"category={self.event.category_id}&", "").replace(f"&category={self.event.category_id}", "")
+        self.assertNotEqual(tampered, url)
+
+        self.client.logout()
+        for link in (url, tampered):
+            text = self._report_text(link)
+            self.assertIn("SHAREDONE", text)
+            self.assertNotIn("SECRETTWO", text)
+
+        viewer = User.objects.create_user(username="viewer", password="pass123")
+        PatientProfile.objects.create(user=viewer, first_name_bg="Иван", last_name_bg="Петров", date_of_birth="1985-01-01")
+        self.client.login(username="viewer", password="pass123")
+        self.assertIn("SHAREDONE", self._report_text(tampered))
+
+
+class LetterheadOverlayTests(TestCase):
+    template = str(Path(settings.BASE_DIR) / "records" / "pdf_templates" / "pdf-template-twopage-bg.pdf")
+
+    def _pdf(self, pages):
+        buf = io.BytesIO()
+        c = canvas.Canvas(buf)
+        for i in range(pages):
+            c.drawString(100, 700, f"generated {i}")
+            c.showPage()
+        c.save()
+        return buf.getvalue()
+
+    def test_overlay_reuses_parsed_template_pages(self):
+        self.assertIs(load_template(self.template), load_template(self.template))
+        merged = PdfReader(io.BytesIO(overlay_template(self._pdf(3), self.template)))
+        self.assertEqual(len(merged.pages), 3)
+        self.assertIn("generated 2", merged.pages[2].extract_text())
+        xobjects = [set(page["/Resources"]["/XObject"].keys()) for page in merged.pages]
+        self.assertEqual(xobjects, [{"/MedjTpl0"}, {"/MedjTpl1"}, {"/MedjTpl1"}])
+        forms = [page["/Resources"]["/XObject"].raw_get("/MedjTpl1") for page in merged.pages[1:]]
+        self.assertEqual(forms[0], forms[1])
+        self.assertEqual(overlay_template(b"not a pdf", self.template), b"not a pdf")
+
+
+class PngExportTests(TestCase):
+    def _pdf(self, pages):
+        buf = io.BytesIO()
+        c = canvas.Canvas(buf, pagesize=(200, 100))
+        for i in range(pages):
+            c.drawString(20, 50, f"page {i}")
+            c.showPage()
+        c.save()
+        return buf.getvalue()
+
+    def _weasyprint(self, pdf_bytes):
+        # WeasyPrint needs Pango at import time; stand in for its HTML -> PDF step.
+        html = mock.Mock()
+        html.return_value.write_pdf.return_value = pdf_bytes
+        return mock.patch.dict(sys.modules, {"weasyprint": types.SimpleNamespace(HTML=html)})
+
+    @override_settings(EXPORT_PNG_DPI=144)
+    def test_png_is_rasterized_from_the_rendered_pdf(self):
+        with self._weasyprint(self._pdf(2)):
+            png = render_html("png", "<p>card</p>", "http://testserver/")
+        image = Image.open(io.BytesIO(png))
+        self.assertEqual(image.format, "PNG")
+        self.assertEqual(image.size, (400, 400))
+
+    @override_settings(EXPORT_WORKERS=0, EXPORT_PNG_DPI=144)
+    def test_personal_card_image_is_a_png(self):
+        user = User.objects.create_user(username="card", password="pass123")
+        profile = PatientProfile.objects.create(user=user, first_name_bg="Анна", share_enabled=True)
+        token = profile.ensure_share_token()
+        with self._weasyprint(self._pdf(1)):
+            response = self.client.get(reverse("medj:personalcard_public_png", args=[token]))
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(Image.open(io.BytesIO(response.content)).size, (400, 200))
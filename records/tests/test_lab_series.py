@@ -0,0 +1,149 @@
+import json
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from importlib import import_module
+from unittest import mock
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.urls import reverse
+
+from records.management.services.lab_series import find_stale_series, rebuild_series
+from records.models import (
+    LabIndicator,
+    LabSeries,
+    LabTestMeasurement,
+    MedicalEvent,
+    MedicalSpecialty,
+    PatientProfile,
+)
+
+
+class LabSeriesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="series_user", password="pass123")
+        self.client.login(username="series_user", password="pass123")
+        self.profile = PatientProfile.objects.create(
+            user=self.user,
+            first_name_bg="Иван",
+            last_name_bg="Иванов",
+            date_of_birth=date(1990, 1, 1),
+        )
+        self.specialty = MedicalSpecialty.objects.create(slug="lab")
+        self.event = MedicalEvent.objects.create(
+            patient=self.profile,
+            owner=self.user,
+            specialty=self.specialty,
+            event_date=date(2024, 1, 1),
+        )
+        self.indicator = LabIndicator(slug="glucose", unit="mmol/L")
+        self.indicator.set_current_language("bg")
+        self.indicator.name = "Глюкоза"
+        self.indicator.save()
+
+    def _measure(self, value, day):
+        return LabTestMeasurement.objects.create(
+            medical_event=self.event,
+            indicator=self.indicator,
+            value=value,
+            measured_at=datetime(2024, 1, day, 8, 0, tzinfo=dt_timezone.utc),
+        )
+
+    def test_series_maintained_on_write_and_delete(self):
+        self._measure(6.1, 3)
+        first = self._measure(5.2, 1)
+        series = LabSeries.objects.get(patient=self.profile, indicator=self.indicator)
+        self.assertEqual(series.count, 2)
+        self.assertEqual(series.values, [5.2, 6.1])
+
+        first.delete()
+        series.refresh_from_db()
+        self.assertEqual(series.count, 1)
+        self.assertEqual(series.values, [6.1])
+
+    def test_single_writes_splice_points(self):
+        later = self._measure(6.1, 3)
+        earlier = self._measure(5.2, 1)
+        with mock.patch("records.management.services.lab_series.rebuild_series") as rebuild:
+            later.value = 7.0
+            later.save()
+            earlier.measured_at = datetime(2024, 1, 5, 8, 0, tzinfo=dt_timezone.utc)
+            earlier.save()
+            self._measure(4.0, 2)
+        rebuild.assert_not_called()
+        series = LabSeries.objects.get(patient=self.profile, indicator=self.indicator)
+        self.assertEqual(series.values, [4.0, 7.0, 5.2])
+        self.assertEqual(series.last_measured_at, datetime(2024, 1, 5, 8, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(find_stale_series(), [])
+
+        other = LabIndicator.objects.create(slug="urea")
+        later.indicator = other
+        later.save()
+        self.assertEqual(LabSeries.objects.get(indicator=self.indicator).values, [4.0, 5.2])
+        self.assertEqual(LabSeries.objects.get(indicator=other).values, [7.0])
+
+    def test_rebuild_bounds_match_the_charted_points(self):
+        def at(day):
+            return datetime(2024, 1, day, 8, 0, tzinfo=dt_timezone.utc)
+
+        rows = [(at(1), "n/a"), (at(2), 5.0), (at(3), 6.0), (at(4), None)]
+        with mock.patch("records.management.services.lab_series.LabTestMeasurement") as measurements:
+            measurements.objects.filter.return_value.order_by.return_value.values_list.return_value = rows
+            series = rebuild_series(self.profile.pk, self.indicator.pk)
+        self.assertEqual(series.values, [5.0, 6.0])
+        self.assertEqual(series.timestamps, [at(2).isoformat(), at(3).isoformat()])
+        self.assertEqual((series.first_measured_at, series.last_measured_at), (at(2), at(3)))
+
+    def test_migration_fills_series(self):
+        migration = import_module("records.migrations.0005_labseries")
+        for day, value in ((3, 6.1), (1, 5.2), (2, 5.5)):
+            self._measure(value, day)
+        expected = LabSeries.objects.values_list("timestamps", "values", "count").get()
+        LabSeries.objects.all().delete()
+        migration.fill_series(apps, None, batch_size=1)
+        self.assertEqual(LabSeries.objects.values_list("timestamps", "values", "count").get(), expected)
+        self.assertEqual(find_stale_series(), [])
+
+    def test_dashboard_reads_series(self):
+        self._measure(5.2, 1)
+        self._measure(6.1, 2)
+        response = self.client.get(reverse("medj:dashboard"))
+        self.assertEqual(response.status_code, 200)
+        charts = response.context["charts_data"]
+        self.assertEqual(len(charts), 1)
+        self.assertEqual(charts[0]["name"], "Глюкоза")
+        self.assertEqual([p["y"] for p in json.loads(charts[0]["series"])], [5.2, 6.1])
+
+    def test_chart_data_endpoint_downsamples_and_zooms(self):
+        base = datetime(2023, 1, 1, 8, 0, tzinfo=dt_timezone.utc)
+        LabTestMeasurement.objects.bulk_create(
+            LabTestMeasurement(
+                medical_event=self.event,
+                indicator=self.indicator,
+                value=5 + (i % 7) / 10,
+                measured_at=base + timedelta(days=i),
+            )
+            for i in range(400)
+        )
+        self._measure(5.0, 1)
+        url = reverse("medj:lab_chart_data")
+        data = self.client.get(url, {"indicator": "glucose", "points": 50}).json()
+        self.assertEqual(data["total"], 401)
+        self.assertEqual(data["returned"], 50)
+
+        zoomed = self.client.get(
+            url, {"indicator": "glucose", "points": 500, "start": "2023-02-01", "end": "2023-02-10"}
+        ).json()
+        self.assertEqual(zoomed["in_range"], 10)
+        self.assertEqual(zoomed["returned"], 10)
+
+    def test_staleness_check_and_backfill(self):
+        self._measure(5.2, 1)
+        LabSeries.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command("backfill_lab_series", "--check")
+        call_command("backfill_lab_series")
+        call_command("backfill_lab_series", "--check")
+        self.assertEqual(LabSeries.objects.get(patient=self.profile).count, 1)
@@ -0,0 +1,169 @@
+import os
+import tempfile
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from records.models import (
+    LabIndicator,
+    LabIndicatorAlias,
+    LabTestMeasurement,
+    MedicalEvent,
+    MedicalSpecialty,
+    PatientProfile,
+    Tag,
+)
+
+
+class LabListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="labs_user", password="pass123")
+        self.client.login(username="labs_user", password="pass123")
+        self.profile = PatientProfile.objects.create(
+            user=self.user,
+            first_name_bg="Иван",
+            last_name_bg="Иванов",
+            date_of_birth=date(1990, 1, 1),
+        )
+        self.specialty = MedicalSpecialty.objects.create(slug="lab")
+        self.event = MedicalEvent.objects.create(
+            patient=self.profile,
+            owner=self.user,
+            specialty=self.specialty,
+            event_date=date(2024, 1, 1),
+        )
+        self.indicator = LabIndicator(slug="glucose", unit="mmol/L", reference_low=3.9, reference_high=6.1)
+        self.indicator.set_current_language("bg")
+        self.indicator.name = "Глюкоза"
+        self.indicator.save()
+        base = datetime(2024, 1, 1, 8, 0, tzinfo=dt_timezone.utc)
+        LabTestMeasurement.objects.bulk_create(
+            LabTestMeasurement(
+                medical_event=self.event,
+                indicator=self.indicator,
+                value=[5.0, 7.2, 3.1][i % 3],
+                measured_at=base + timedelta(days=i),
+            )
+            for i in range(7)
+        )
+
+    @override_settings(LAB_PAGE_SIZE=3)
+    def test_labs_page_uses_keyset_pagination(self):
+        url = reverse("medj:labtests")
+        seen = []
+        response = self.client.get(url)
+        while True:
+            self.assertEqual(response.context["total_measurements"], 7)
+            seen.extend(row["object"].id for row in response.context["measurements"])
+            next_url = response.context["next_page_url"]
+            if not next_url:
+                break
+            response = self.client.get(next_url)
+        expected = list(
+            LabTestMeasurement.objects.order_by("-measured_at", "-id").values_list("id", flat=True)
+        )
+        self.assertEqual(seen, expected)
+        self.assertTrue(response.context["first_page_url"])
+
+    def test_csv_export_streams_only_abnormal_rows(self):
+        response = self.client.get(
+            reverse("medj:export_lab_csv"), {"download": "1", "only_abnormal": "1"}
+        )
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+        self.assertEqual(lines[0].split(",")[0], "event_id")
+        flags = [line.rsplit(",", 1)[1] for line in lines[1:]]
+        self.assertEqual(sorted(flags), ["H", "H", "L", "L"])
+
+    def test_abnormal_flag_computed_in_sql(self):
+        qs = LabTestMeasurement.objects.with_abnormal_flag().order_by("measured_at")
+        self.assertEqual([m.abnormal_code for m in qs], ["", "H", "L", "", "H", "L", ""])
+        self.assertEqual(LabTestMeasurement.objects.abnormal().count(), 4)
+        counts = {
+            (row["abnormal_code"], row["total"])
+            for row in LabTestMeasurement.objects.abnormal_counts()
+        }
+        self.assertEqual(counts, {("H", 2), ("L", 2)})
+        monthly = list(LabTestMeasurement.objects.abnormal_counts("month"))
+        self.assertEqual(sum(row["total"] for row in monthly), 4)
+        self.assertTrue(all(row["period"].month == 1 for row in monthly))
+
+    def test_indicator_facets_cached_and_invalidated(self):
+        from records.management.services.lab_facets import indicator_facets
+
+        facets = indicator_facets(self.profile, lang="bg")
+        self.assertEqual([(f["slug"], f["label"], f["count"]) for f in facets], [("glucose", "Глюкоза", 7)])
+        with self.assertNumQueries(0):
+            indicator_facets(self.profile, lang="bg")
+
+        LabTestMeasurement.objects.create(
+            medical_event=self.event,
+            indicator=self.indicator,
+            value=5.5,
+            measured_at=datetime(2024, 2, 1, 8, 0, tzinfo=dt_timezone.utc),
+        )
+        self.assertEqual(indicator_facets(self.profile, lang="bg")[0]["count"], 8)
+        response = self.client.get(reverse("medj:labtests"))
+        self.assertEqual(response.context["indicators"][0]["count"], 8)
+
+
+class LabIndicatorImportTests(TestCase):
+    def _csv(self, text, encoding="utf-8"):
+        handle = tempfile.NamedTemporaryFile("wb", suffix=".csv", delete=False)
+        handle.write(text.encode(encoding))
+        handle.close()
+        self.addCleanup(os.unlink, handle.name)
+        return handle.name
+
+    def test_bulk_import_dry_run_and_update(self):
+        rows = ["name_en;name_bg;aliases;units;ref_low;ref_high"]
+        rows += [f"Marker {i};Маркер {i};M{i}|mk{i};g/L;1,5;{i + 2}" for i in range(300)]
+        rows.append("Glucose;Глюкоза;GLU;mmol/L;3.9;6.1")
+        path = self._csv("\n".join(rows) + "\n", encoding="cp1251")
+
+        out = StringIO()
+        call_command("import_lab_indicators_csv", path, "--dry-run", stdout=out)
+        self.assertIn("+ indicator glucose: bg='Глюкоза', en-us='Glucose'", out.getvalue())
+        self.assertIn("encoding=cp1251; Indicators created=301", out.getvalue())
+        self.assertFalse(LabIndicator.objects.exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            call_command("import_lab_indicators_csv", path, stdout=StringIO())
+        self.assertLess(len(queries), 20)
+        glucose = LabIndicator.objects.get(slug="glucose")
+        self.assertEqual((glucose.unit, glucose.reference_low, glucose.reference_high), ("mmol/L", 3.9, 6.1))
+        self.assertEqual(glucose.safe_translation_getter("name", language_code="bg"), "Глюкоза")
+        self.assertEqual(LabIndicatorAlias.objects.count(), 601)
+        self.assertTrue(Tag.objects.filter(slug="indicator:marker-299").exists())
+
+        path = self._csv("name_en,aliases,units\nGlucose,GLU|Кръвна захар,mg/dL\nMarker 7,M8,\n")
+        out = StringIO()
+        call_command("import_lab_indicators_csv", path, "--update", stdout=out)
+        self.assertIn("created=0 updated=2 aliases_added=1 alias_conflicts_skipped=1", out.getvalue())
+        self.assertEqual(LabIndicator.objects.get(slug="glucose").unit, "mg/dL")
+        self.assertEqual(LabIndicator.objects.get(slug="marker-7").unit, "g/L")
+
+    def test_catalog_is_streamed_after_sampling_the_encoding(self):
+        from records.management.services.lab_indicator_import import SAMPLE_SIZE, read_catalog
+
+        head = "name_en;name_bg\n" + "".join(f"Marker {i};\n" for i in range(SAMPLE_SIZE // 10))
+        path = self._csv(head + "Glucose;Глюкоза\n", encoding="cp1251")
+
+        encoding, rows = read_catalog(path)
+        self.assertEqual(encoding, "utf-8-sig")
+        self.assertIs(iter(rows), rows)
+        self.assertEqual(next(rows).name_en, "Marker 0")
+        rows.close()
+
+        with self.assertRaisesMessage(CommandError, "CSV is not valid utf-8-sig past the first"):
+            call_command("import_lab_indicators_csv", path, stdout=StringIO())
+        self.assertFalse(LabIndicator.objects.exists())
@@ -1,14 +1,26 @@
 from datetime import date
 from io import BytesIO
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import TestCase
-from django.urls import reverse
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import get_script_prefix, reverse, set_script_prefix
 from PIL import Image
 
+from records.management.middleware.onboarding import OnboardingMiddleware, allowed_paths
+from records.management.services.qr_codes import cache_info as qr_cache_info, clear_cache as clear_qr_cache
 from records.models import PatientProfile
 
 
+def other_process():
+    """Settings under which ``default`` is another worker's private cache."""
+
+    local = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "other-process"}
+    return override_settings(CACHES={**settings.CACHES, "default": local})
+
+
 class PersonalCardLockingTests(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username="card_user", password="pass123")
@@ -72,3 +84,78 @@ class PersonalCardLockingTests(TestCase):
         width, height = image.size
         self.assertGreaterEqual(width, 300)
         self.assertGreaterEqual(height, 300)
+
+    def test_qr_is_cached_with_etag_and_svg_variant(self):
+        clear_qr_cache()
+        token = self.profile.ensure_share_token()
+        self.profile.share_enabled = True
+        self.profile.save(update_fields=["share_enabled"])
+        url = reverse("medj:personalcard_qr", args=[token])
+
+        first = self.client.get(url)
+        second = self.client.get(url)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(qr_cache_info().hits, 1)
+        self.assertEqual(first["Cache-Control"], "private, no-cache")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 304)
+
+        svg = self.client.get(url, {"format": "svg"})
+        self.assertEqual(svg["Content-Type"], "image/svg+xml")
+        self.assertIn(b"<svg", svg.content[:200])
+        self.assertNotEqual(svg["ETag"], first["ETag"])
+
+
+class OnboardingMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="onboarding", password="pass123")
+        self.profile = PatientProfile.objects.create(
+            user=self.user, first_name_bg="Мария", last_name_bg="Петрова", date_of_birth=date(1992, 5, 20)
+        )
+        self.middleware = OnboardingMiddleware(lambda request: None)
+        self.session = SessionStore()
+
+    def _request(self, path="/dashboard/"):
+        request = RequestFactory().get(path)
+        request.user = User.objects.get(pk=self.user.pk)
+        request.session = self.session
+        return request
+
+    def test_state_is_kept_in_session_until_profile_changes(self):
+        self.assertIsNone(self.middleware.process_request(self._request()))
+        request = self._request()
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.middleware.process_request(request))
+
+        self.profile.date_of_birth = None
+        self.profile.save()
+        response = self.middleware.process_request(self._request())
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response["Location"], reverse("medj:personalcard"))
+
+        request = self._request(reverse("medj:personalcard"))
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.middleware.process_request(request))
+
+    def test_profile_change_in_another_process_is_seen(self):
+        self.assertIsNone(self.middleware.process_request(self._request()))
+        with other_process():
+            self.profile.date_of_birth = None
+            self.profile.save()
+        response = self.middleware.process_request(self._request())
+        self.assertIsNotNone(response)
+        self.assertEqual(response["Location"], reverse("medj:personalcard"))
+
+    def test_allowed_views_match_under_a_script_prefix(self):
+        self.profile.date_of_birth = None
+        self.profile.save()
+        path = reverse("medj:personalcard")
+        allowed_paths.cache_clear()
+        self.addCleanup(allowed_paths.cache_clear)
+        self.addCleanup(set_script_prefix, get_script_prefix())
+        set_script_prefix("/medj/")
+        request = RequestFactory().get(path, SCRIPT_NAME="/medj")
+        request.user = User.objects.get(pk=self.user.pk)
+        request.session = self.session
+        self.assertEqual(request.path_info, path)
+        self.assertIsNone(self.middleware.process_request(request))
@@ -0,0 +1,156 @@
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from records.management.services.record_filters import RecordFilters
+from records.management.services.record_versions import record_version
+from records.views.share import _share_options
+from records.models import (
+    Document,
+    DocumentType,
+    LabIndicator,
+    LabTestMeasurement,
+    MedicalCategory,
+    MedicalEvent,
+    MedicalSpecialty,
+    PatientProfile,
+    Tag,
+)
+
+
+def other_process():
+    """Settings under which ``default`` is another worker's private cache."""
+
+    local = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "other-process"}
+    return override_settings(CACHES={**settings.CACHES, "default": local})
+
+
+def create_tx(instance, name, slug):
+    instance.set_current_language("bg")
+    instance.name = name
+    instance.slug = slug
+    instance.save()
+    return instance
+
+
+class RecordFiltersTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="filters", password="pass123")
+        self.client.login(username="filters", password="pass123")
+        self.profile = PatientProfile.objects.create(
+            user=self.user, first_name_bg="Анна", last_name_bg="Иванова", date_of_birth="1990-01-01"
+        )
+        self.specialty = create_tx(MedicalSpecialty(), "Ендокринология", "endo")
+        self.category = create_tx(MedicalCategory(), "Изследвания", "tests")
+        self.doc_type = create_tx(DocumentType(), "Резултат", "result")
+        self.with_labs = self._event("2024-01-10")
+        self.without_labs = self._event("2024-03-05")
+        self.indicator = create_tx(LabIndicator(unit="mmol/L"), "Глюкоза", "glucose")
+        for day in (10, 11):
+            LabTestMeasurement.objects.create(
+                medical_event=self.with_labs,
+                indicator=self.indicator,
+                value=5.0,
+                measured_at=timezone.make_aware(datetime(2024, 1, day)),
+            )
+        self.lab_doc = self._document(self.with_labs, "Кръвна захар")
+        self.tagged_doc = self._document(self.without_labs, "Бележка")
+        self.tagged_doc.tags.add(create_tx(Tag(), "Глюкоза", "glucose"))
+        self._document(self.without_labs, "Епикриза")
+
+    def _event(self, event_date):
+        return MedicalEvent.objects.create(
+            patient=self.profile,
+            owner=self.user,
+            specialty=self.specialty,
+            category=self.category,
+            event_date=event_date,
+        )
+
+    def _document(self, event, summary):
+        return Document.objects.create(
+            owner=self.user,
+            medical_event=event,
+            specialty=self.specialty,
+            category=self.category,
+            doc_type=self.doc_type,
+            summary=summary,
+        )
+
+    def test_counts_all_record_types_in_one_query(self):
+        record_filters = RecordFilters.from_payload({"indicator": ["glucose"]})
+        with self.assertNumQueries(1):
+            counts = record_filters.counts(self.user, self.profile)
+        self.assertEqual(counts, {"documents": 2, "labs": 2, "events": 1})
+
+        unmeasured = RecordFilters.from_payload({"indicator": "ferritin"})
+        self.assertEqual(unmeasured.counts(self.user, self.profile), {"documents": 0, "labs": 0, "events": 0})
+
+        dated = RecordFilters.from_payload({}, "2024-02-01", "bad-date")
+        self.assertIsNone(dated.end)
+        self.assertEqual(dated.counts(self.user, self.profile), {"documents": 3, "labs": 0, "events": 1})
+        self.assertEqual(dated.as_params(), {"start_date": "2024-02-01"})
+
+    def test_create_download_links_uses_engine(self):
+        response = self.client.post(
+            reverse("medj:create_download_links"),
+            data=json.dumps({"filters": {"indicator": ["glucose"]}, "generate_csv": False}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertEqual(payload["counts"], {"documents": 2, "events": 1, "labs": 2})
+        self.assertEqual({item["id"] for item in payload["documents"]}, {self.lab_doc.id, self.tagged_doc.id})
+        self.assertIn("indicator=glucose", payload["pdf_labs_url"])
+        self.assertEqual(payload["csv_url"], "")
+
+    def test_share_options_snapshot_follows_record_version(self):
+        cache.clear()
+        options = _share_options(self.user, self.profile)
+        self.assertEqual(len(options["event_options"]), 2)
+        self.assertEqual([o["slug"] for o in options["indicator_options"]], ["glucose"])
+        with self.assertNumQueries(0):
+            self.assertEqual(_share_options(self.user, self.profile), options)
+
+        self._event("2024-05-01")
+        self.assertEqual(len(_share_options(self.user, self.profile)["event_options"]), 3)
+        response = self.client.get(reverse("medj:share"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["event_options"]), 3)
+
+    def test_version_bumps_are_shared_between_processes(self):
+        cache.clear()
+        options = _share_options(self.user, self.profile)
+        before = record_version(self.user)
+        with other_process():
+            self._event("2024-05-01")
+            bumped = record_version(self.user)
+        self.assertNotEqual(bumped, before)
+        caches["default"].clear()
+        self.assertEqual(record_version(self.user), bumped)
+        self.assertEqual(len(options["event_options"]), 2)
+        self.assertEqual(len(_share_options(self.user, self.profile)["event_options"]), 3)
+
+    def test_share_specialty_options_come_from_the_document(self):
+        cardio = create_tx(MedicalSpecialty(), "Кардиология", "cardio")
+        imaging = create_tx(MedicalCategory(), "Образни", "imaging")
+        Document.objects.create(
+            owner=self.user,
+            medical_event=self.without_labs,
+            specialty=cardio,
+            category=imaging,
+            doc_type=self.doc_type,
+            summary="ЕКГ",
+        )
+        cache.clear()
+        options = _share_options(self.user, self.profile)
+        self.assertEqual({o["id"] for o in options["specialty_options"]}, {self.specialty.id, cardio.id})
+        self.assertEqual({o["id"] for o in options["category_options"]}, {self.category.id, imaging.id})
+        filtered = RecordFilters.from_payload({"specialty": [cardio.id]})
+        self.assertEqual(filtered.counts(self.user, self.profile)["documents"], 1)
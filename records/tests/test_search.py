@@ -0,0 +1,97 @@
+from importlib import import_module
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.test import TestCase
+from django.urls import reverse
+
+from records.management.services.search import search_documents
+from records.models import (
+    Document,
+    DocumentSearchIndex,
+    DocumentType,
+    MedicalCategory,
+    MedicalEvent,
+    MedicalSpecialty,
+    PatientProfile,
+    Tag,
+)
+
+
+def create_tx(instance, name_bg, slug, name_en=None):
+    instance.set_current_language("bg")
+    instance.name = name_bg
+    instance.slug = slug
+    if name_en:
+        instance.set_current_language("en-us")
+        instance.name = name_en
+    instance.save()
+    return instance
+
+
+class DocumentSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="search", password="pass123")
+        self.client.login(username="search", password="pass123")
+        self.profile = PatientProfile.objects.create(
+            user=self.user, first_name_bg="Анна", last_name_bg="Иванова", date_of_birth="1990-01-01"
+        )
+        self.specialty = create_tx(MedicalSpecialty(), "Кардиология", "cardio")
+        self.category = create_tx(MedicalCategory(), "Документи", "cat")
+        self.doc_type = create_tx(DocumentType(), "Епикриза", "report")
+        self.event = MedicalEvent.objects.create(
+            patient=self.profile,
+            owner=self.user,
+            specialty=self.specialty,
+            category=self.category,
+            event_date="2024-01-01",
+        )
+
+    def _document(self, **fields):
+        return Document.objects.create(
+            owner=self.user,
+            medical_event=self.event,
+            specialty=self.specialty,
+            category=self.category,
+            doc_type=self.doc_type,
+            **fields,
+        )
+
+    def test_search_covers_ocr_analysis_and_translated_tags(self):
+        in_ocr = self._document(summary="Кръвна картина", original_ocr_text="Общ холестерол 6.2 mmol/L")
+        in_title = self._document(summary="Холестерол – контрол")
+        tagged = self._document(summary="Изследване", analysis_text="Без отклонения")
+        tagged.tags.add(create_tx(Tag(), "Щитовидна жлеза", "thyroid", name_en="Thyroid"))
+
+        base = Document.objects.filter(owner=self.user)
+        ranked = list(search_documents(base, "холестерол").order_by("-search_rank"))
+        self.assertEqual(ranked, [in_title, in_ocr])
+        self.assertEqual(list(search_documents(base, "thyro")), [tagged])
+        self.assertEqual(list(search_documents(base, "отклонения")), [tagged])
+
+        response = self.client.get(reverse("medj:casefiles"), {"q": "Холестерол"})
+        self.assertEqual(response.status_code, 200)
+        ids = [item["id"] for group in response.context["grouped"] for item in group["items"]]
+        self.assertEqual(ids, [in_title.id, in_ocr.id])
+
+    def test_reindex_command_rebuilds_entries(self):
+        document = self._document(summary="Ехокардиография")
+        DocumentSearchIndex.objects.all().delete()
+        self.assertFalse(search_documents(Document.objects.all(), "ехокардиография").exists())
+        call_command("reindex_documents", "--missing")
+        self.assertEqual(list(search_documents(Document.objects.all(), "ехокардиография")), [document])
+
+    def test_migration_indexes_existing_documents(self):
+        migration = import_module("records.migrations.0007_documentsearchindex")
+        historical = MigrationLoader(connection).project_state(("records", "0007_documentsearchindex")).apps
+        documents = [self._document(summary=f"Ехография {i}") for i in range(3)]
+        documents[0].tags.add(create_tx(Tag(), "Щитовидна жлеза", "thyroid", name_en="Thyroid"))
+        DocumentSearchIndex.objects.all().delete()
+        migration.index_existing_documents(historical, None, batch_size=2)
+        self.assertEqual(
+            sorted(search_documents(Document.objects.all(), "ехография").values_list("pk", flat=True)),
+            [d.pk for d in documents],
+        )
+        self.assertEqual(list(search_documents(Document.objects.all(), "thyro")), [documents[0]])
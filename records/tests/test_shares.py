@@ -0,0 +1,180 @@
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from records.management.services import share_lifecycle
+from records.management.services.rate_limit import LocalMemoryBackend, RateLimiter
+from records.management.services.share_lifecycle import expire_links, purge_links, revoke_link
+from records.models import (
+    LabIndicator,
+    LabTestMeasurement,
+    MedicalEvent,
+    MedicalSpecialty,
+    PatientProfile,
+    ShareLink,
+)
+
+
+def other_process():
+    """Settings under which ``default`` is another worker's private cache."""
+
+    local = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "other-process"}
+    return override_settings(CACHES={**settings.CACHES, "default": local})
+
+
+class ShareLifecycleTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="sharer", password="pass123")
+        self.now = timezone.now()
+
+    def _link(self, token, status="active", expires_in=7, **fields):
+        return ShareLink.objects.create(
+            token=token, owner=self.user, object_type="document", object_id=1, status=status,
+            expires_at=self.now + timedelta(days=expires_in) if expires_in is not None else None, **fields
+        )
+
+    def test_expire_links_is_one_update(self):
+        overdue = self._link("overdue", expires_in=-1)
+        current = self._link("current")
+        forever = self._link("forever", expires_in=None)
+        with self.assertNumQueries(1):
+            self.assertEqual(expire_links(), 1)
+        statuses = dict(ShareLink.objects.values_list("token", "status"))
+        self.assertEqual(statuses, {overdue.token: "expired", current.token: "active", forever.token: "active"})
+
+    @override_settings(SHARE_RETENTION_DAYS=30)
+    def test_purge_keeps_links_inside_retention(self):
+        for i in range(5):
+            self._link(f"old-{i}", status="expired", expires_in=-40)
+        self._link("recent", status="expired", expires_in=-5)
+        revoked = self._link("revoked", expires_in=10)
+        revoke_link(revoked)
+        ShareLink.objects.filter(pk=revoked.pk).update(revoked_at=self.now - timedelta(days=31))
+        self._link("live", expires_in=-40)
+
+        self.assertEqual(purge_links(chunk_size=2), 6)
+        self.assertEqual(set(ShareLink.objects.values_list("token", flat=True)), {"recent", "live"})
+
+    def test_public_view_hides_overdue_links(self):
+        self._link("overdue", expires_in=-1)
+        self.assertEqual(self.client.get(reverse("medj:share_public", kwargs={"token": "overdue"})).status_code, 404)
+
+    def test_cleanup_command_runs_the_sweep(self):
+        self._link("overdue", expires_in=-1)
+        out = StringIO()
+        call_command("cleanup_shares", stdout=out)
+        self.assertIn("Expired 1 and purged 0", out.getvalue())
+        self.assertEqual(ShareLink.objects.get().status, "expired")
+
+    @override_settings(SHARE_SWEEP_INTERVAL=0)
+    def test_scheduler_disabled_by_zero_interval(self):
+        share_lifecycle.stop_scheduler()
+        self.assertIsNone(share_lifecycle.start_scheduler())
+
+
+class SharePublicPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="sharepage", password="pass123")
+        profile = PatientProfile.objects.create(user=self.user)
+        specialty = MedicalSpecialty(slug="cardio")
+        specialty.set_current_language("bg")
+        specialty.name = "Кардиология"
+        specialty.save()
+        self.event = MedicalEvent.objects.create(
+            patient=profile, owner=self.user, specialty=specialty, event_date=date(2024, 1, 1)
+        )
+        for i, slug in enumerate(("glucose", "urea", "creatinine")):
+            indicator = LabIndicator(slug=slug, unit="mmol/L")
+            indicator.set_current_language("bg")
+            indicator.name = f"Показател {slug}"
+            indicator.save()
+            LabTestMeasurement.objects.create(
+                medical_event=self.event, indicator=indicator, value=5 + i,
+                measured_at=datetime(2024, 1, 1 + i, 8, 0, tzinfo=dt_timezone.utc),
+            )
+        self.link = ShareLink.objects.create(
+            token="page", owner=self.user, object_type="event", object_id=self.event.pk,
+            scope="full", expires_at=timezone.now() + timedelta(days=7),
+        )
+        self.url = reverse("medj:share_public", kwargs={"token": "page"})
+
+    def test_page_is_prefetched_and_cached(self):
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get(self.url, HTTP_ACCEPT_LANGUAGE="bg")
+        self.assertContains(response, "Показател creatinine")
+        self.assertContains(response, "Кардиология")
+        with CaptureQueriesContext(connection) as second:
+            self.assertContains(self.client.get(self.url, HTTP_ACCEPT_LANGUAGE="bg"), "Показател creatinine")
+        # link, event + specialty, specialty translations, labs + indicators, indicator translations
+        self.assertEqual(len(first), 5)
+        self.assertEqual(len(second), 1)
+
+    def test_cache_follows_record_edits_and_revoke(self):
+        self.client.get(self.url, HTTP_ACCEPT_LANGUAGE="bg")
+        self.event.event_date = date(2024, 2, 2)
+        self.event.save()
+        self.assertContains(self.client.get(self.url, HTTP_ACCEPT_LANGUAGE="bg"), "02-02-2024")
+
+        revoke_link(self.link)
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT_LANGUAGE="bg").status_code, 404)
+
+    def test_cache_follows_edits_made_by_another_process(self):
+        self.client.get(self.url, HTTP_ACCEPT_LANGUAGE="bg")
+        with other_process():
+            self.event.event_date = date(2024, 3, 3)
+            self.event.save()
+        self.assertContains(self.client.get(self.url, HTTP_ACCEPT_LANGUAGE="bg"), "03-03-2024")
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_sliding_window_weighs_previous_window(self):
+        clock = [1000.0]
+        limiter = RateLimiter("test", limit=3, window=10, backend=LocalMemoryBackend(clock=lambda: clock[0]))
+        self.assertEqual([limiter.hit("k").allowed for _ in range(4)], [True, True, True, False])
+        self.assertEqual(limiter.peek("k").remaining, 0)
+
+        clock[0] = 1015.0  # half-way through the next window: 4 * 0.5 = 2 still count
+        self.assertTrue(limiter.hit("k").allowed)
+        denied = limiter.hit("k")
+        self.assertFalse(denied.allowed)
+        self.assertGreaterEqual(denied.retry_after, 1)
+        self.assertTrue(limiter.hit("other").allowed)
+
+    @override_settings(RATE_LIMITS={"share_password": (2, 300)})
+    def test_password_attempts_are_limited_before_hashing(self):
+        user = User.objects.create_user(username="limited", password="pass123")
+        ShareLink.objects.create(
+            token="locked", owner=user, object_type="event", object_id=1,
+            password_hash=make_password("secret"), expires_at=timezone.now() + timedelta(days=1),
+        )
+        url = reverse("medj:share_public", kwargs={"token": "locked"})
+        for _ in range(2):
+            self.assertEqual(self.client.post(url, {"password": "wrong"}).status_code, 200)
+        response = self.client.post(url, {"password": "secret"})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+
+    @override_settings(RATE_LIMITS={"share_create": (1, 300)})
+    def test_share_create_answers_429(self):
+        user = User.objects.create_user(username="creator", password="pass123")
+        PatientProfile.objects.create(
+            user=user, first_name_bg="Иван", last_name_bg="Иванов", date_of_birth=date(1980, 1, 1)
+        )
+        self.client.login(username="creator", password="pass123")
+        url = reverse("medj:share_create")
+        self.client.post(url, data="{}", content_type="application/json")
+        self.assertEqual(self.client.post(url, data="{}", content_type="application/json").status_code, 429)
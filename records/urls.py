@@ -31,9 +31,16 @@ from .views.documents import (
     document_edit_tags,
     document_move,
 )
-from .views.exports import document_export_pdf, print_csv, print_pdf
+from .views.exports import (
+    document_export_pdf,
+    event_export_pdf,
+    export_job_download,
+    export_job_status,
+    print_csv,
+    print_pdf,
+)
 from .views.events import event_list, event_detail, events_by_specialty, tags_autocomplete
-from .views.labs import labtests, labtests_view, labtest_edit, export_lab_csv
+from .views.labs import labtests, labtests_view, labtest_edit, export_lab_csv, lab_chart_data
 from .views.pages import documents_view
 from .views.personalcard import (
     PersonalCardView,
@@ -115,6 +122,7 @@ urlpatterns = [
     path("casefiles/", login_required(casefiles), name="casefiles"),
     path("events/", login_required(event_list), name="medical_event_list"),
     path("events/<int:pk>/", login_required(event_detail), name="medical_event_detail"),
+    path("events/<int:pk>/export/pdf/", login_required(event_export_pdf), name="event_export_pdf"),
 
     path("personalcard/", login_required(PersonalCardView.as_view()), name="personalcard"),
     path("personalcard/share/<str:token>/", public_personalcard, name="personalcard_public"),
@@ -132,6 +140,8 @@ urlpatterns = [
     path("share/history/", login_required(share_history_page), name="share_history_page"),
     path("share/export/pdf/", print_pdf, name="print_pdf"),
     path("share/export/csv/", print_csv, name="print_csv"),
+    path("exports/jobs/<str:job_id>/", login_required(export_job_status), name="export_job_status"),
+    path("exports/jobs/<str:job_id>/download/", login_required(export_job_download), name="export_job_download"),
 
     path("documents/<int:pk>/", login_required(document_detail), name="document_detail"),
     path("documents/<int:pk>/edit/", login_required(document_edit), name="document_edit"),
@@ -153,6 +163,7 @@ urlpatterns = [
     path("api/upload/confirm/", login_required(upload_confirm), name="upload_confirm"),
     path("api/events/suggest/", login_required(events_suggest), name="events_suggest"),
     path("api/doctors/suggest/", login_required(doctors_suggest), name="doctors_suggest"),
+    path("api/labtests/chart-data/", login_required(lab_chart_data), name="lab_chart_data"),
 
     path("api/personalcard/share/enable/", login_required(personalcard_share_enable_api),
          name="personalcard_share_enable_api"),
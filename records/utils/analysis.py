@@ -3,6 +3,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from html import escape
+import json
 import re
 from typing import Dict, Iterable, List, Mapping
 
@@ -150,3 +151,32 @@ def normalize_analysis_payload(data: Mapping[str, object] | None) -> Dict[str, o
     if isinstance(data, Mapping):
         return dict(data)
     return {}
+
+
+def rebuild_analysis_fields(notes: str | None, summary: str | None = None) -> Dict[str, str]:
+    """Derive ``summary``, ``analysis_html`` and ``analysis_text`` from stored document notes.
+
+    Only non-empty values are returned; an empty dict means the notes carry no
+    analysis payload. Has no Django dependencies, so backfills can run it in
+    worker processes.
+    """
+
+    try:
+        payload = json.loads(notes) if isinstance(notes, str) and notes.strip() else {}
+    except ValueError:
+        return {}
+    if not isinstance(payload, Mapping):
+        return {}
+    analysis_payload = normalize_analysis_payload(payload.get("analysis"))
+    if not analysis_payload:
+        return {}
+    summary = (analysis_payload.get("summary") or summary or "").strip()
+    if summary:
+        analysis_payload["summary"] = summary
+        analysis_payload["summary_word_count"] = word_count(summary)
+    fields = {
+        "summary": summary,
+        "analysis_html": render_analysis_tables(analysis_payload),
+        "analysis_text": compose_analysis_text(analysis_payload, summary),
+    }
+    return {name: value for name, value in fields.items() if value}
@@ -1,9 +1,16 @@
 from datetime import datetime
 from types import SimpleNamespace
+from urllib.parse import urlencode
 from django.contrib.auth.decorators import login_required
-from django.db.models import Count, Q, F, DateTimeField
-from django.db.models.functions import Coalesce, Cast
+from django.db.models import Count
 from django.shortcuts import render, get_object_or_404
+from records.management.services.casefiles import (
+    casefile_documents,
+    document_items,
+    document_page,
+    group_by_month,
+)
+from records.management.services.document_facets import facet_panels
 from records.models import (
     Document,
     MedicalEvent,
@@ -31,6 +38,18 @@ def _t(obj, field):
         except Exception:
             return ""
 
+def _facet_options(qs, count_map):
+    options = [
+        {"id": obj.id, "name": _t(obj, "name"), "count": int(count_map.get(obj.id, 0))}
+        for obj in qs.prefetch_related("translations")
+    ]
+    options.sort(key=lambda o: o["name"].lower())
+    return options
+
+def _hot(options, limit=5):
+    ranked = sorted((o for o in options if o["count"]), key=lambda o: -o["count"])
+    return ranked[:limit]
+
 @login_required
 def casefiles(request):
     patient = getattr(getattr(request.user, "patient_profile", None), "id", None)
@@ -60,200 +79,93 @@ def casefiles(request):
     q = (request.GET.get("q") or "").strip()
     date_from = (request.GET.get("date_from") or "").strip()
     date_to = (request.GET.get("date_to") or "").strip()
-    sort = (request.GET.get("sort") or "date_desc").strip()
-
-    qs = (
-        Document.objects.select_related(
-            "doc_type",
-            "medical_event",
-            "medical_event__specialty",
-            "medical_event__category",
-        )
-        .filter(medical_event__patient_id=patient, owner=request.user)
-    )
-
-    if date_from:
-        qs = qs.filter(medical_event__event_date__gte=date_from)
-    if date_to:
-        qs = qs.filter(medical_event__event_date__lte=date_to)
-
-    if sel_tags:
-        ids = [int(t) for t in sel_tags if str(t).isdigit()]
-        names = [t for t in sel_tags if not str(t).isdigit()]
-        tag_q = Q()
-        if ids:
-            tag_q |= Q(tags__id__in=ids)
-        if names:
-            tag_q |= Q(tags__translations__name__in=names)
-        qs = qs.filter(tag_q).distinct()
-
-    if q:
-        qs = qs.filter(
-            Q(summary__icontains=q)
-            | Q(tags__translations__name__icontains=q)
-            | Q(medical_event__summary__icontains=q)
-            | Q(doc_type__translations__name__icontains=q)
-        ).distinct()
-
-    if sel_specialties:
-        qs = qs.filter(
-            medical_event__specialty_id__in=[
-                int(x) for x in sel_specialties if str(x).isdigit()
-            ]
-        )
-    if sel_categories:
-        qs = qs.filter(
-            medical_event__category_id__in=[
-                int(x) for x in sel_categories if str(x).isdigit()
-            ]
-        )
-
-    qs = qs.annotate(
-        sort_date=Coalesce(
-            Cast(F("medical_event__event_date"), DateTimeField()),
-            F("uploaded_at"),
-            output_field=DateTimeField(),
-        )
+    sort = (request.GET.get("sort") or ("relevance" if q else "date_desc")).strip()
+    if sort == "relevance" and not q:
+        sort = "date_desc"
+
+    qs = casefile_documents(
+        request.user,
+        patient,
+        q=q,
+        date_from=date_from,
+        date_to=date_to,
+        tags=sel_tags,
+        specialties=sel_specialties,
+        categories=sel_categories,
     )
-    sort_map = {
-        "date_asc": ("sort_date", "id"),
-        "date_desc": ("-sort_date", "-id"),
-        "type_asc": ("doc_type__translations__name", "id"),
-        "type_desc": ("-doc_type__translations__name", "-id"),
-        "name_asc": ("summary", "id"),
-        "name_desc": ("-summary", "-id"),
-        "spec_asc": ("medical_event__specialty__translations__name", "id"),
-        "spec_desc": ("-medical_event__specialty__translations__name", "-id"),
-    }
-    qs = qs.order_by(*sort_map.get(sort, ("-sort_date", "-id")))
-    docs = list(qs)
-
-    items = []
-    for d in docs:
-        ev = d.medical_event
-        dt = getattr(ev, "event_date", None) or getattr(d, "uploaded_at", None)
-        doc_type_name = _t(d.doc_type, "name") if getattr(d, "doc_type", None) else ""
-        spec_name = _t(ev.specialty, "name") if getattr(ev, "specialty", None) else ""
-        try:
-            tag_names = [(_t(t, "name") or "") for t in d.tags.all()]
-        except Exception:
-            tag_names = []
-        items.append(
-            {
-                "id": d.id,
-                "event_id": getattr(ev, "id", None),
-                "date": dt,
-                "title": d.summary or doc_type_name or "Document",
-                "type_name": doc_type_name,
-                "specialist": spec_name,
-                "tags": [x for x in tag_names if x],
-            }
-        )
-
-    groups = {}
-    months_bg = [
-        "Януари",
-        "Февруари",
-        "Март",
-        "Април",
-        "Май",
-        "Юни",
-        "Юли",
-        "Август",
-        "Септември",
-        "Октомври",
-        "Ноември",
-        "Декември",
-    ]
-    for it in items:
-        dt = it["date"]
-        if not dt:
-            key = "nodate"
-            label = "Без дата"
-        else:
-            key = f"{dt.year:04d}-{dt.month:02d}"
-            label = f"{months_bg[dt.month-1]},{dt.year}"
-        if key not in groups:
-            groups[key] = {"label": label, "items": []}
-        groups[key]["items"].append(it)
-
-    ordered = sorted(
-        groups.items(), key=lambda kv: (kv[0] == "nodate", kv[0]), reverse=True
-    )
-    grouped = [
-        {"label": v["label"], "items": v["items"], "count": len(v["items"])}
-        for _, v in ordered
-    ]
-
-    base_for_counts = (
-        Document.objects.select_related(
-            "medical_event",
-            "medical_event__specialty",
-            "medical_event__category",
-        )
-        .filter(medical_event__patient_id=patient, owner=request.user)
-    )
-    if date_from:
-        base_for_counts = base_for_counts.filter(
-            medical_event__event_date__gte=date_from
-        )
-    if date_to:
-        base_for_counts = base_for_counts.filter(
-            medical_event__event_date__lte=date_to
-        )
-    if sel_specialties:
-        base_for_counts = base_for_counts.filter(
-            medical_event__specialty_id__in=[
-                int(x) for x in sel_specialties if str(x).isdigit()
-            ]
-        )
-    if sel_categories:
-        base_for_counts = base_for_counts.filter(
-            medical_event__category_id__in=[
-                int(x) for x in sel_categories if str(x).isdigit()
-            ]
+    cursor = (request.GET.get("after") or "").strip()
+    docs, next_cursor = document_page(qs, sort, cursor)
+    grouped = group_by_month(document_items(docs))
+
+    page_params = [(k, v) for k, values in request.GET.lists() if k != "after" for v in values]
+    next_page_url = ""
+    if next_cursor:
+        next_page_url = "?" + urlencode(page_params + [("after", next_cursor)])
+    first_page_url = ("?" + urlencode(page_params)) if cursor else ""
+
+    panels = facet_panels(request.user, ("category", "specialty", "tag"))
+    if date_from or date_to or sel_specialties or sel_categories:
+        base_for_counts = Document.objects.filter(
+            medical_event__patient_id=patient, owner=request.user
         )
+        if date_from:
+            base_for_counts = base_for_counts.filter(
+                medical_event__event_date__gte=date_from
+            )
+        if date_to:
+            base_for_counts = base_for_counts.filter(
+                medical_event__event_date__lte=date_to
+            )
+        if sel_specialties:
+            base_for_counts = base_for_counts.filter(
+                medical_event__specialty_id__in=[
+                    int(x) for x in sel_specialties if str(x).isdigit()
+                ]
+            )
+        if sel_categories:
+            base_for_counts = base_for_counts.filter(
+                medical_event__category_id__in=[
+                    int(x) for x in sel_categories if str(x).isdigit()
+                ]
+            )
+        cat_count_map = {
+            r["medical_event__category_id"]: r["c"]
+            for r in base_for_counts.exclude(medical_event__category__isnull=True)
+            .values("medical_event__category_id")
+            .annotate(c=Count("id"))
+        }
+        spec_count_map = {
+            r["medical_event__specialty_id"]: r["c"]
+            for r in base_for_counts.exclude(medical_event__specialty__isnull=True)
+            .values("medical_event__specialty_id")
+            .annotate(c=Count("id"))
+        }
+    else:
+        cat_count_map = {int(k): v for k, v in panels["category"].items()}
+        spec_count_map = {int(k): v for k, v in panels["specialty"].items()}
 
-    cat_counts = (
-        base_for_counts.exclude(medical_event__category__isnull=True)
-        .values("medical_event__category_id")
-        .annotate(c=Count("id"))
+    categories = _facet_options(
+        MedicalCategory.objects.filter(is_active=True), cat_count_map
     )
-    cat_count_map = {r["medical_event__category_id"]: r["c"] for r in cat_counts}
-    categories = [
-        {"id": c.id, "name": _t(c, "name"), "count": int(cat_count_map.get(c.id, 0))}
-        for c in MedicalCategory.objects.filter(is_active=True).order_by(
-            "translations__name"
-        )
-    ]
-
-    spec_counts = (
-        base_for_counts.exclude(medical_event__specialty__isnull=True)
-        .values("medical_event__specialty_id")
-        .annotate(c=Count("id"))
+    specialties = _facet_options(
+        MedicalSpecialty.objects.filter(is_active=True), spec_count_map
     )
-    spec_count_map = {r["medical_event__specialty_id"]: r["c"] for r in spec_counts}
-    specialties = [
-        {"id": s.id, "name": _t(s, "name"), "count": int(spec_count_map.get(s.id, 0))}
-        for s in MedicalSpecialty.objects.filter(is_active=True).order_by(
-            "translations__name"
-        )
-    ]
 
-    tags_qs = (
-        Tag.objects.filter(
-            documents__medical_event__patient_id=patient, documents__owner=request.user
-        )
-        .distinct()
-        .order_by("translations__name")
+    tags_qs = Tag.objects.filter(
+        id__in=[int(k) for k in panels["tag"]]
+    ).prefetch_related("translations")
+    tags_all = sorted(
+        ({"id": t.id, "name": _t(t, "name")} for t in tags_qs),
+        key=lambda t: t["name"].lower(),
     )
-    tags_all = [{"id": t.id, "name": _t(t, "name")} for t in tags_qs]
 
     ctx = {
         "categories": categories,
         "specialties": specialties,
         "tags_all": tags_all,
         "grouped": grouped,
+        "next_page_url": next_page_url,
+        "first_page_url": first_page_url,
         "selected": {
             "category": sel_categories,
             "specialty": sel_specialties,
@@ -263,8 +175,8 @@ def casefiles(request):
             "date_to": date_to,
             "sort": sort,
         },
-        "hot_categories": [],
-        "hot_specialties": [],
+        "hot_categories": _hot(categories),
+        "hot_specialties": _hot(specialties),
     }
     return render(request, "main/casefiles.html", ctx)
 
@@ -1,10 +1,16 @@
+import json
+from urllib.parse import urlencode
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render
+from django.urls import reverse
 from django.utils.timezone import now
-from django.db.models import Count, F
 from django.utils.translation import get_language
 
-from records.models import LabTestMeasurement, MedicalEvent, Document
+from records.management.services.downsample import reduce_series
+from records.management.services.lab_series import series_for_patient
+from records.models import MedicalEvent, Document
 
 
 def _require_patient_profile(user):
@@ -19,40 +25,19 @@ def dashboard(request):
     today = now().date()
     lang = get_language()
 
-    top_indicators = list(
-        LabTestMeasurement.objects
-        .filter(medical_event__patient=patient)
-        .filter(indicator__translations__language_code=lang)
-        .annotate(indicator_name=F("indicator__translations__name"))
-        .values("indicator_id", "indicator_name", "indicator__unit")
-        .annotate(c=Count("id"))
-        .order_by("-c")[:4]
-    )
-
+    initial_points = getattr(settings, "LAB_CHART_INITIAL_POINTS", 60)
+    chart_data_url = reverse("medj:lab_chart_data")
     charts_data = []
-    for item in top_indicators:
-        ind_id = item["indicator_id"]
-        name = item["indicator_name"]
-        unit = item.get("indicator__unit") or ""
-        qs = (
-            LabTestMeasurement.objects
-            .filter(medical_event__patient=patient, indicator_id=ind_id)
-            .order_by("measured_at", "id")
-            .values("measured_at", "value")
-        )
-        series = []
-        for r in qs:
-            d = r["measured_at"]
-            v = r["value"]
-            if d is None or v is None:
-                continue
-            try:
-                fv = float(v)
-            except Exception:
-                continue
-            series.append({"x": d.isoformat(), "y": fv})
-        if series:
-            charts_data.append({"name": name, "unit": unit, "series": series})
+    for series in series_for_patient(patient, limit=4, lang=lang):
+        points, _ = reduce_series(series.timestamps, series.values, initial_points)
+        if points:
+            charts_data.append({
+                "name": series.indicator_name or series.indicator.slug,
+                "unit": series.indicator.unit or "",
+                "series": json.dumps(points),
+                "total": series.count,
+                "detail_url": f"{chart_data_url}?{urlencode({'indicator': series.indicator.slug})}",
+            })
 
     upcoming_events_qs = (
         MedicalEvent.objects
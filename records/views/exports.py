@@ -1,19 +1,36 @@
 from __future__ import annotations
-import io, os, csv, json, time
+import io, csv, json, time
 from pathlib import Path
 from datetime import datetime
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, FileResponse, HttpResponseForbidden, HttpResponseBadRequest
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    HttpResponseNotModified,
+    JsonResponse,
+)
 from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags
 from django.utils.translation import get_language
 from django.core import signing
 from django.template.loader import render_to_string
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from ..models import Document, MedicalEvent
+from django.urls import reverse
+from ..models import Document, LabTestMeasurement, MedicalEvent, PatientProfile
+from ..management.services.csv_to_pdf import REPORT_CHUNK_ROWS, build_table_report
+from ..management.services.export_artifacts import (
+    export_artifact,
+    has_artifact,
+    open_artifact,
+    record_hit,
+    render_artifact,
+)
+from ..management.services.export_jobs import STATUS_DONE, job_status, open_job_result, submit_job
+from ..management.services.pdf_overlay import overlay_template, overlay_to_file
+from ..management.services.record_filters import RecordFilters
 
 try:
     from records.services import exports as sexp
@@ -25,42 +42,18 @@ _SIGNER_SALT = "medj.share"
 def _templates_dir() -> Path:
     return Path(settings.BASE_DIR) / "records" / "pdf_templates"
 
+def _request_language(request) -> str:
+    return (getattr(request, "LANGUAGE_CODE", None) or get_language() or "bg").lower()
+
 def _template_pdf_path(request):
-    lang = (getattr(request, "LANGUAGE_CODE", None) or get_language() or "bg").lower().split("-")[0]
+    lang = _request_language(request).split("-")[0]
     suffix = "eng" if lang == "en" else "bg"
     two = _templates_dir() / f"pdf-template-twopage-{suffix}.pdf"
     one = _templates_dir() / f"pdf-template-{suffix}.pdf"
     return str(two if two.exists() else one)
 
 def _overlay_bytes_with_template(pdf_bytes: bytes, template_path: str) -> bytes:
-    try:
-        from PyPDF2 import PdfReader, PdfWriter
-    except Exception:
-        return pdf_bytes
-    if not os.path.exists(template_path):
-        return pdf_bytes
-    try:
-        tmpl_reader = PdfReader(template_path)
-        gen_reader = PdfReader(io.BytesIO(pdf_bytes))
-    except Exception:
-        return pdf_bytes
-    if not tmpl_reader.pages:
-        return pdf_bytes
-    first_tpl_page = tmpl_reader.pages[0]
-    second_tpl_page = tmpl_reader.pages[1] if len(tmpl_reader.pages) >= 2 else None
-    writer = PdfWriter()
-    for i, gen_page in enumerate(gen_reader.pages):
-        base_tpl = first_tpl_page if i == 0 else (second_tpl_page or first_tpl_page)
-        try:
-            page = base_tpl.clone()
-        except Exception:
-            import copy as _copy
-            page = _copy.deepcopy(base_tpl)
-        writer.add_page(page)
-        writer.pages[-1].merge_page(gen_page)
-    buf = io.BytesIO()
-    writer.write(buf)
-    return buf.getvalue()
+    return overlay_template(pdf_bytes, template_path)
 
 def _ddmmyyyy(d):
     if not d:
@@ -89,13 +82,6 @@ def _event_tags_text(ev):
                 names.append(nm)
     return ", ".join(names)
 
-def _font_name():
-    try:
-        pdfmetrics.registerFont(TTFont("DejaVuSans", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"))
-        return "DejaVuSans"
-    except Exception:
-        return "Helvetica"
-
 def render_template_to_pdf(request, template_name, context):
     html = render_to_string(template_name, context=context, request=request)
     try:
@@ -110,79 +96,109 @@ def pdf_response(filename: str, pdf_bytes: bytes, inline: bool = True) -> HttpRe
     resp["Content-Disposition"] = f'{disp}; filename="{filename}"'
     return resp
 
-def events_csv_to_pdf(csv_bytes_io: io.BytesIO) -> bytes:
-    csv_bytes_io.seek(0)
-    try:
-        rows = list(csv.reader(io.StringIO(csv_bytes_io.read().decode("utf-8"))))
-    except Exception:
-        rows = []
-    buf = io.BytesIO()
-    c = canvas.Canvas(buf, pagesize=A4)
-    c.setFont(_font_name(), 12)
-    c.drawString(40, 800, "Events")
-    c.setFont(_font_name(), 10)
-    y = 780
-    for r in rows:
-        line = " | ".join(str(x) for x in r)
-        c.drawString(40, y, line[:110])
-        y -= 14
-        if y < 60:
-            c.showPage()
-            c.setFont(_font_name(), 10)
-            y = 800
-    c.showPage()
-    c.save()
-    buf.seek(0)
-    return buf.getvalue()
-
-def labs_csv_to_pdf(csv_bytes_io: io.BytesIO) -> bytes:
-    csv_bytes_io.seek(0)
-    try:
-        rows = list(csv.reader(io.StringIO(csv_bytes_io.read().decode("utf-8"))))
-    except Exception:
-        rows = []
-    buf = io.BytesIO()
-    c = canvas.Canvas(buf, pagesize=A4)
-    c.setFont(_font_name(), 12)
-    c.drawString(40, 800, "Labs")
-    c.setFont(_font_name(), 10)
-    y = 780
-    for r in rows:
-        line = " | ".join(str(x) for x in r)
-        c.drawString(40, y, line[:110])
-        y -= 14
-        if y < 60:
-            c.showPage()
-            c.setFont(_font_name(), 10)
-            y = 800
-    c.showPage()
-    c.save()
-    buf.seek(0)
-    return buf.getvalue()
+def artifact_pdf_response(request, artifact, render, filename: str) -> HttpResponse:
+    if artifact.etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+        record_hit(artifact, not_modified=True)
+        resp = HttpResponseNotModified()
+    else:
+        fh = open_artifact(artifact)
+        if fh is not None:
+            record_hit(artifact)
+            resp = FileResponse(fh, content_type="application/pdf")
+            resp["Content-Disposition"] = f'inline; filename="{filename}"'
+        else:
+            resp = pdf_response(filename, render_artifact(artifact, render), inline=True)
+    resp["ETag"] = artifact.etag
+    resp["Cache-Control"] = "private, no-cache"
+    return resp
 
-def _token_ok(request, kind: str) -> bool:
+REPORT_FILTER_KEYS = ("category", "specialty", "event", "indicator")
+
+def _report_filters(request, payload) -> RecordFilters:
+    # A signed link carries its filters; URL parameters only apply to the owner's own unsigned requests.
+    if payload is not None:
+        params = payload.get("f") or {}
+        filters = {key: params.get(key) for key in REPORT_FILTER_KEYS}
+        return RecordFilters.from_payload(filters, params.get("start_date", ""), params.get("end_date", ""))
+    filters = {key: request.GET.getlist(key) for key in REPORT_FILTER_KEYS}
+    return RecordFilters.from_payload(filters, request.GET.get("start_date"), request.GET.get("end_date"))
+
+def _report_patient(request, payload):
+    if payload is None:
+        return PatientProfile.objects.filter(user=request.user).first()
+    user_id = payload.get("u")
+    return PatientProfile.objects.filter(user_id=user_id).first() if user_id else None
+
+def _event_report_rows(events):
+    events = (
+        events.select_related("specialty", "category")
+        .prefetch_related("specialty__translations", "category__translations")
+        .order_by("event_date", "id")
+    )
+    for ev in events.iterator(chunk_size=REPORT_CHUNK_ROWS):
+        yield [
+            _ddmmyyyy(ev.event_date),
+            _translated_name(ev.category),
+            _translated_name(ev.specialty),
+            ev.summary or "",
+        ]
+
+def _lab_report_rows(labs):
+    events = MedicalEvent.objects.filter(pk__in=labs.values("medical_event_id")).prefetch_related("tags__translations")
+    tags_by_event = {
+        ev.id: ", ".join(filter(None, (_translated_name(t) for t in sorted(ev.tags.all(), key=lambda t: t.id))))
+        for ev in events
+    }
+    labs = (
+        labs.select_related("indicator", "medical_event")
+        .prefetch_related("indicator__translations")
+        .order_by("measured_at", "id")
+    )
+    for m in labs.iterator(chunk_size=REPORT_CHUNK_ROWS):
+        ind = m.indicator
+        yield [
+            m.medical_event_id,
+            _ddmmyyyy(m.medical_event.event_date),
+            _translated_name(ind),
+            m.value,
+            ind.unit or "",
+            "" if ind.reference_low is None else ind.reference_low,
+            "" if ind.reference_high is None else ind.reference_high,
+            _ddmmyyyy(m.measured_at),
+            tags_by_event.get(m.medical_event_id, ""),
+        ]
+
+def _translated_name(obj) -> str:
+    if obj is None:
+        return ""
+    return obj.safe_translation_getter("name", any_language=True) or getattr(obj, "slug", "") or ""
+
+def _token_payload(request, kind: str) -> dict | None:
     t = request.GET.get("t")
     if not t:
-        return False
+        return None
     try:
         s = signing.Signer(salt=_SIGNER_SALT)
         raw = s.unsign(t)
         payload = json.loads(raw)
     except Exception:
-        return False
+        return None
     if payload.get("k") != kind:
-        return False
+        return None
     try:
         exp = int(payload.get("exp", 0))
     except Exception:
-        return False
+        return None
     if exp < int(time.time()):
-        return False
+        return None
     if kind == "print_pdf":
         labs_flag = 1 if request.GET.get("labs") else 0
         if int(payload.get("labs", 0)) != labs_flag:
-            return False
-    return True
+            return None
+    return payload
+
+def _token_ok(request, kind: str) -> bool:
+    return _token_payload(request, kind) is not None
 
 @login_required
 def document_export_pdf(request, pk: int):
@@ -194,14 +210,21 @@ def document_export_pdf(request, pk: int):
             return HttpResponseBadRequest("export_error")
         return pdf_response(f"document_{pk}.pdf", pdf_bytes, inline=True)
     doc = get_object_or_404(Document, pk=pk, owner=request.user)
-    context = {"document": doc, "user": request.user}
-    pdf_bytes = render_template_to_pdf(
-        request,
-        "subpages/documentsubpages/document_export_pdf.html",
-        context,
+    template_path = _template_pdf_path(request)
+    artifact = export_artifact(
+        "document", doc.pk, request.user, lang=_request_language(request), template_path=template_path
     )
-    pdf_bytes = _overlay_bytes_with_template(pdf_bytes, _template_pdf_path(request))
-    return pdf_response(f"document_{pk}.pdf", pdf_bytes, inline=True)
+
+    def render():
+        context = {"document": doc, "user": request.user}
+        pdf_bytes = render_template_to_pdf(
+            request,
+            "subpages/documentsubpages/document_export_pdf.html",
+            context,
+        )
+        return _overlay_bytes_with_template(pdf_bytes, template_path)
+
+    return artifact_pdf_response(request, artifact, render, f"document_{pk}.pdf")
 
 @login_required
 def event_export_pdf(request, pk: int):
@@ -212,6 +235,41 @@ def event_export_pdf(request, pk: int):
         except Exception:
             return HttpResponseBadRequest("export_error")
         return pdf_response(f"event_{pk}.pdf", pdf_bytes, inline=True)
+    event = get_object_or_404(MedicalEvent.objects.only("id"), pk=pk, patient__user=request.user)
+    template_path = _template_pdf_path(request)
+    artifact = export_artifact(
+        "event", event.pk, request.user, lang=_request_language(request), template_path=template_path
+    )
+    filename = f"event_{pk}.pdf"
+
+    def render():
+        pdf_bytes = render_template_to_pdf(
+            request,
+            "subpages/eventsubpages/event_export_pdf.html",
+            _event_export_context(request, pk),
+        )
+        return _overlay_bytes_with_template(pdf_bytes, template_path)
+
+    # A stored artifact is served directly; only a miss pays for the size check.
+    if has_artifact(artifact) or not (request.GET.get("async") or _is_large_event(event)):
+        return artifact_pdf_response(request, artifact, render, filename)
+    html = render_to_string(
+        "subpages/eventsubpages/event_export_pdf.html",
+        context=_event_export_context(request, pk),
+        request=request,
+    )
+    job_id = submit_job(
+        request.user,
+        "pdf",
+        html,
+        request.build_absolute_uri("/"),
+        filename,
+        template_path=template_path,
+        artifact=artifact,
+    )
+    return _job_response(request, job_id, status=202)
+
+def _event_export_context(request, pk: int) -> dict:
     event = get_object_or_404(
         MedicalEvent.objects.select_related("patient__user", "specialty").prefetch_related("documents", "tags"),
         pk=pk, patient__user=request.user
@@ -222,7 +280,7 @@ def event_export_pdf(request, pk: int):
     labs_qs = getattr(event, "lab_measurements", None)
     if labs_qs is None:
         labs_qs = getattr(event, "labtests", None)
-    context = {
+    return {
         "event": event,
         "diagnoses": list(diagnoses.all()) if hasattr(diagnoses, "all") else [],
         "treatment_plans": list(treatment_plans.all()) if hasattr(treatment_plans, "all") else [],
@@ -230,13 +288,50 @@ def event_export_pdf(request, pk: int):
         "documents": list(event.documents.all()) if hasattr(event, "documents") else [],
         "labs": list(labs_qs.select_related("indicator").all()) if hasattr(labs_qs, "all") else [],
     }
-    pdf_bytes = render_template_to_pdf(
-        request,
-        "subpages/eventsubpages/event_export_pdf.html",
-        context,
+
+def _is_large_event(event) -> bool:
+    limit = getattr(settings, "EXPORT_SYNC_MAX_ITEMS", 60)
+    items = Document.objects.filter(medical_event_id=event.pk).count()
+    items += LabTestMeasurement.objects.filter(medical_event_id=event.pk).count()
+    return items > limit
+
+def _job_response(request, job_id: str, status: int = 200) -> JsonResponse:
+    job = job_status(job_id, owner=request.user) or {}
+    done = job.get("status") == STATUS_DONE
+    resp = JsonResponse(
+        {
+            "job": job_id,
+            "status": job.get("status", ""),
+            "error": job.get("error", ""),
+            "status_url": request.build_absolute_uri(reverse("medj:export_job_status", args=[job_id])),
+            "download_url": request.build_absolute_uri(reverse("medj:export_job_download", args=[job_id])) if done else "",
+        },
+        status=status,
     )
-    pdf_bytes = _overlay_bytes_with_template(pdf_bytes, _template_pdf_path(request))
-    return pdf_response(f"event_{pk}.pdf", pdf_bytes, inline=True)
+    if not done:
+        resp["Retry-After"] = "2"
+    return resp
+
+@login_required
+def export_job_status(request, job_id: str):
+    if job_status(job_id, owner=request.user) is None:
+        raise Http404("unknown job")
+    return _job_response(request, job_id)
+
+@login_required
+def export_job_download(request, job_id: str):
+    job = job_status(job_id, owner=request.user)
+    if job is None:
+        raise Http404("unknown job")
+    if job.get("status") != STATUS_DONE:
+        return _job_response(request, job_id, status=409)
+    fh = open_job_result(job)
+    if fh is None:
+        raise Http404("export expired")
+    content_type = "image/png" if job.get("kind") == "png" else "application/pdf"
+    resp = FileResponse(fh, content_type=content_type)
+    resp["Content-Disposition"] = f'inline; filename="{job.get("filename") or "export.pdf"}"'
+    return resp
 
 @login_required
 def export_csv(request):
@@ -311,30 +406,34 @@ def print_pdf(request):
         resp = HttpResponse(pdf_bytes, content_type="application/pdf")
         resp["Content-Disposition"] = 'inline; filename="export.pdf"'
         return resp
-    if not request.user.is_authenticated and not _token_ok(request, "print_pdf"):
-        return HttpResponseForbidden()
+    payload = None
+    if request.GET.get("t") or not request.user.is_authenticated:
+        payload = _token_payload(request, "print_pdf")
+        if payload is None or "f" not in payload:
+            return HttpResponseForbidden()
     labs_requested = bool(request.GET.get("labs"))
-    buf = io.StringIO()
-    writer = csv.writer(buf)
+    patient = _report_patient(request, payload)
+    record_filters = _report_filters(request, payload)
     if labs_requested:
-        writer.writerow(
-            [
-                "event_id",
-                "event_date",
-                "indicator_name",
-                "value",
-                "unit",
-                "reference_low",
-                "reference_high",
-                "measured_at",
-                "tags",
-            ]
-        )
+        header = [
+            "event_id",
+            "event_date",
+            "indicator_name",
+            "value",
+            "unit",
+            "reference_low",
+            "reference_high",
+            "measured_at",
+            "tags",
+        ]
+        rows = _lab_report_rows(record_filters.labs(patient)) if patient else []
         filename = "labs.pdf"
-        generated = labs_csv_to_pdf(io.BytesIO(buf.getvalue().encode("utf-8")))
+        generated = build_table_report(header, rows, "Лабораторни резултати")
     else:
-        writer.writerow(["date", "category", "specialty", "summary"])
+        header = ["date", "category", "specialty", "summary"]
+        rows = _event_report_rows(record_filters.events(patient)) if patient else []
         filename = "events.pdf"
-        generated = events_csv_to_pdf(io.BytesIO(buf.getvalue().encode("utf-8")))
-    pdf_bytes = _overlay_bytes_with_template(generated, _template_pdf_path(request))
-    return pdf_response(filename, pdf_bytes, inline=True)
+        generated = build_table_report(header, rows, "Медицински доклад")
+    resp = FileResponse(overlay_to_file(generated, _template_pdf_path(request)), content_type="application/pdf")
+    resp["Content-Disposition"] = f'inline; filename="{filename}"'
+    return resp
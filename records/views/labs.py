@@ -1,19 +1,30 @@
 from __future__ import annotations
 
+import base64
 import csv
-from io import StringIO
+from datetime import datetime, time
 from urllib.parse import urlencode
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import HttpRequest, HttpResponse
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpRequest, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render, redirect
 from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.http import require_GET
 
 from ..forms import LabTestMeasurementForm
+from ..management.services.downsample import METHODS, reduce_series
+from ..management.services.lab_facets import indicator_facets
+from ..management.services.lab_series import series_for_patient
 from ..models import LabIndicator, LabTestMeasurement, MedicalEvent
 from .utils import parse_date, require_patient_profile
 
+CHART_MAX_POINTS = 2000
+EXPORT_CHUNK_SIZE = 2000
+
 
 def _indicator_label(indicator: LabIndicator) -> str:
     getter = getattr(indicator, "safe_translation_getter", None)
@@ -27,12 +38,17 @@ def _indicator_label(indicator: LabIndicator) -> str:
     return (getattr(indicator, "name", None) or indicator.slug or "").strip()
 
 
-def _indicator_queryset(patient, event=None):
-    qs = LabIndicator.objects.filter(measurements__medical_event__patient=patient)
-    if event is not None:
-        qs = qs.filter(measurements__medical_event=event)
-    qs = qs.prefetch_related("translations").distinct()
-    return qs.order_by("translations__name", "slug")
+def _indicator_options(patient, selected, event=None):
+    return [
+        {
+            "slug": facet["slug"],
+            "label": facet["label"],
+            "count": facet["count"],
+            "last_measured": facet["last_measured"],
+            "checked": facet["slug"] in selected,
+        }
+        for facet in indicator_facets(patient, event)
+    ]
 
 
 def _parse_filter_params(request: HttpRequest):
@@ -54,15 +70,45 @@ def _coerce_bool(value, default=False):
     return str(value).strip().lower() in {"1", "true", "yes", "on"}
 
 
+def _filter_measurements(qs, selected, start_dt, end_dt):
+    if selected:
+        qs = qs.filter(indicator__slug__in=selected)
+    if start_dt:
+        qs = qs.filter(measured_at__date__gte=start_dt)
+    if end_dt:
+        qs = qs.filter(measured_at__date__lte=end_dt)
+    return qs
+
+
+def _encode_cursor(measurement) -> str:
+    raw = f"{measurement.measured_at.isoformat()}|{measurement.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(token):
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+        stamp, ident = raw.rsplit("|", 1)
+        return datetime.fromisoformat(stamp), int(ident)
+    except (ValueError, UnicodeError):
+        return None
+
+
 def _build_measurement_rows(qs):
     rows = []
+    labels = {}
     for measurement in qs:
         indicator = measurement.indicator
         event = measurement.medical_event
+        if indicator.id not in labels:
+            labels[indicator.id] = _indicator_label(indicator)
         rows.append(
             {
                 "object": measurement,
-                "indicator_name": _indicator_label(indicator),
+                "indicator_name": labels[indicator.id],
                 "indicator_slug": indicator.slug,
                 "value": measurement.value,
                 "unit": indicator.unit or "",
@@ -80,39 +126,53 @@ def _build_measurement_rows(qs):
 
 def _labtests_context(request: HttpRequest, patient, base_qs, event=None):
     selected, start_raw, end_raw, start_dt, end_dt = _parse_filter_params(request)
-    qs = base_qs
-    if selected:
-        qs = qs.filter(indicator__slug__in=selected)
-    if start_dt:
-        qs = qs.filter(measured_at__date__gte=start_dt)
-    if end_dt:
-        qs = qs.filter(measured_at__date__lte=end_dt)
-    qs = qs.select_related("indicator", "medical_event").order_by("-measured_at", "-id")
-    measurements = list(qs)
-    indicator_qs = _indicator_queryset(patient, event)
-    indicator_options = [
-        {
-            "slug": ind.slug,
-            "label": _indicator_label(ind),
-            "checked": ind.slug in selected,
-        }
-        for ind in indicator_qs
-    ]
-    indicator_options.sort(key=lambda x: x["label"].lower())
-
-    csv_params = []
+    qs = _filter_measurements(base_qs, selected, start_dt, end_dt)
+    total = qs.count()
+
+    page_size = getattr(settings, "LAB_PAGE_SIZE", 100)
+    cursor_raw = (request.GET.get("after") or "").strip()
+    cursor = _decode_cursor(cursor_raw)
+    page_qs = qs
+    if cursor:
+        measured_at, last_id = cursor
+        page_qs = page_qs.filter(
+            Q(measured_at__lt=measured_at) | Q(measured_at=measured_at, id__lt=last_id)
+        )
+    page_qs = (
+        page_qs.select_related("indicator", "medical_event")
+        .with_abnormal_flag()
+        .order_by("-measured_at", "-id")
+    )
+    measurements = list(page_qs[: page_size + 1])
+    has_next = len(measurements) > page_size
+    measurements = measurements[:page_size]
+
+    indicator_options = _indicator_options(patient, selected, event)
+
+    filter_params = []
     for slug in selected:
-        csv_params.append(("indicator", slug))
+        filter_params.append(("indicator", slug))
     if start_raw:
-        csv_params.append(("start_date", start_raw))
+        filter_params.append(("start_date", start_raw))
     if end_raw:
-        csv_params.append(("end_date", end_raw))
+        filter_params.append(("end_date", end_raw))
+
+    csv_params = list(filter_params)
     if event:
         csv_params.append(("event", str(event.id)))
     csv_params.append(("download", "1"))
     csv_url = reverse("medj:export_lab_csv")
     csv_download_url = f"{csv_url}?{urlencode(csv_params, doseq=True)}"
 
+    page_path = request.path
+    next_url = ""
+    if has_next and measurements:
+        next_params = filter_params + [("after", _encode_cursor(measurements[-1]))]
+        next_url = f"{page_path}?{urlencode(next_params, doseq=True)}"
+    first_url = ""
+    if cursor:
+        first_url = f"{page_path}?{urlencode(filter_params, doseq=True)}" if filter_params else page_path
+
     return {
         "medical_event": event,
         "measurements": _build_measurement_rows(measurements),
@@ -122,7 +182,9 @@ def _labtests_context(request: HttpRequest, patient, base_qs, event=None):
         "end_date": end_raw,
         "csv_download_url": csv_download_url,
         "has_filters": bool(selected or start_raw or end_raw),
-        "total_measurements": len(measurements),
+        "total_measurements": total,
+        "next_page_url": next_url,
+        "first_page_url": first_url,
     }
 
 
@@ -162,6 +224,13 @@ def labtest_edit(request: HttpRequest, event_id: int | str) -> HttpResponse:
     return render(request, "subpages/labtest_edit.html", {"event": event, "form": form})
 
 
+class _Echo:
+    """File-like object that hands each written CSV line straight back."""
+
+    def write(self, value):
+        return value
+
+
 @login_required
 def export_lab_csv(request: HttpRequest) -> HttpResponse:
     patient = require_patient_profile(request.user)
@@ -175,19 +244,10 @@ def export_lab_csv(request: HttpRequest) -> HttpResponse:
         base_qs = base_qs.filter(medical_event_id=event_id)
         event_obj = MedicalEvent.objects.filter(pk=event_id, patient=patient).first()
 
-    qs = base_qs
-    if selected:
-        qs = qs.filter(indicator__slug__in=selected)
-    if start_dt:
-        qs = qs.filter(measured_at__date__gte=start_dt)
-    if end_dt:
-        qs = qs.filter(measured_at__date__lte=end_dt)
-    qs = qs.select_related("indicator", "medical_event").order_by("measured_at", "id")
-    measurements = list(qs)
-
+    qs = _filter_measurements(base_qs, selected, start_dt, end_dt)
     only_abnormal = _coerce_bool(request.GET.get("only_abnormal"), default=False)
     if only_abnormal:
-        measurements = [m for m in measurements if m.abnormal_flag]
+        qs = qs.abnormal()
 
     separator_choice = (request.GET.get("separator") or "comma").lower()
     if separator_choice in {";", "semicolon"}:
@@ -222,52 +282,52 @@ def export_lab_csv(request: HttpRequest) -> HttpResponse:
         return text
 
     if download:
-        buffer = StringIO()
-        writer = csv.writer(buffer, delimiter=delimiter)
-        if include_header:
-            writer.writerow([
-                "event_id",
-                "event_date",
-                "indicator_slug",
-                "indicator_name",
-                "value",
-                "unit",
-                "reference_low",
-                "reference_high",
-                "measured_at",
-                "abnormal_flag",
-            ])
-        for item in measurements:
-            indicator = item.indicator
-            event = item.medical_event
-            indicator_name = _indicator_label(indicator)
-            measured_at = item.measured_at.isoformat() if item.measured_at else ""
-            event_date = event.event_date.isoformat() if event and event.event_date else ""
-            writer.writerow([
-                item.medical_event_id,
-                event_date,
-                indicator.slug,
-                indicator_name,
-                format_decimal(item.value),
-                indicator.unit or "",
-                format_decimal(indicator.reference_low),
-                format_decimal(indicator.reference_high),
-                measured_at,
-                item.abnormal_flag,
-            ])
-        resp = HttpResponse(buffer.getvalue(), content_type="text/csv; charset=utf-8")
+        qs = qs.select_related("indicator", "medical_event").with_abnormal_flag().order_by("measured_at", "id")
+
+        def rows():
+            if include_header:
+                yield [
+                    "event_id",
+                    "event_date",
+                    "indicator_slug",
+                    "indicator_name",
+                    "value",
+                    "unit",
+                    "reference_low",
+                    "reference_high",
+                    "measured_at",
+                    "abnormal_flag",
+                ]
+            labels = {}
+            for item in qs.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+                indicator = item.indicator
+                event = item.medical_event
+                if indicator.id not in labels:
+                    labels[indicator.id] = _indicator_label(indicator)
+                measured_at = item.measured_at.isoformat() if item.measured_at else ""
+                event_date = event.event_date.isoformat() if event and event.event_date else ""
+                yield [
+                    item.medical_event_id,
+                    event_date,
+                    indicator.slug,
+                    labels[indicator.id],
+                    format_decimal(item.value),
+                    indicator.unit or "",
+                    format_decimal(indicator.reference_low),
+                    format_decimal(indicator.reference_high),
+                    measured_at,
+                    item.abnormal_flag,
+                ]
+
+        writer = csv.writer(_Echo(), delimiter=delimiter)
+        resp = StreamingHttpResponse(
+            (writer.writerow(row) for row in rows()),
+            content_type="text/csv; charset=utf-8",
+        )
         resp["Content-Disposition"] = 'attachment; filename="lab-results.csv"'
         return resp
 
-    indicator_options = [
-        {
-            "slug": ind.slug,
-            "label": _indicator_label(ind),
-            "checked": ind.slug in selected,
-        }
-        for ind in _indicator_queryset(patient, event_obj)
-    ]
-    indicator_options.sort(key=lambda x: x["label"].lower())
+    indicator_options = _indicator_options(patient, selected, event_obj)
 
     context = {
         "indicators": indicator_options,
@@ -278,6 +338,60 @@ def export_lab_csv(request: HttpRequest) -> HttpResponse:
         "only_abnormal": only_abnormal,
         "separator": separator_choice,
         "decimal": decimal_choice,
-        "result_count": len(measurements),
+        "result_count": qs.count(),
     }
     return render(request, "subpages/labtestssubpages/labtests_export_csv.html", context)
+
+
+def _parse_range_bound(raw, end=False):
+    raw = (raw or "").strip()
+    if not raw:
+        return None
+    day = parse_date(raw)
+    if day is not None:
+        value = datetime.combine(day, time.max if end else time.min)
+    else:
+        try:
+            value = datetime.fromisoformat(raw)
+        except ValueError:
+            return None
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.get_current_timezone())
+    return value
+
+
+@login_required
+@require_GET
+def lab_chart_data(request: HttpRequest) -> JsonResponse:
+    patient = require_patient_profile(request.user)
+    slug = (request.GET.get("indicator") or "").strip()
+    if not slug:
+        return HttpResponseBadRequest("missing_indicator")
+    try:
+        points = int(request.GET.get("points") or getattr(settings, "LAB_CHART_DETAIL_POINTS", 500))
+    except (TypeError, ValueError):
+        return HttpResponseBadRequest("bad_points")
+    points = max(10, min(points, CHART_MAX_POINTS))
+    method = (request.GET.get("method") or "lttb").strip().lower()
+    if method not in METHODS:
+        method = "lttb"
+    start = _parse_range_bound(request.GET.get("start"))
+    end = _parse_range_bound(request.GET.get("end"), end=True)
+
+    found = series_for_patient(patient, limit=1, slugs=[slug])
+    series = found[0] if found else None
+    if series is None:
+        return JsonResponse({"indicator": slug, "total": 0, "returned": 0, "series": []})
+    data, in_range = reduce_series(series.timestamps, series.values, points, method, start, end)
+    return JsonResponse(
+        {
+            "indicator": slug,
+            "name": series.indicator_name or slug,
+            "unit": series.indicator.unit or "",
+            "method": method,
+            "total": series.count,
+            "in_range": in_range,
+            "returned": len(data),
+            "series": data,
+        }
+    )
@@ -1,3 +1,5 @@
+import logging
+
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import render, redirect, get_object_or_404
@@ -7,12 +9,15 @@ from django.urls import reverse
 from django.http import HttpResponse, Http404, JsonResponse
 from django.views.decorators.http import require_POST
 from django.template.loader import render_to_string
-from io import BytesIO
-import qrcode
 from records.forms import PatientProfileForm
+from records.management.services.export_jobs import render_now
+from records.management.services.rate_limit import qr_limiter, rate_limited, user_or_ip
+from records.views.utils import qr_response
 from records.models import PatientProfile
 from django.contrib import messages as dj_messages
 
+log = logging.getLogger("records.exports")
+
 
 class PersonalCardView(LoginRequiredMixin, View):
     template_name = "main/personalcard.html"
@@ -124,27 +129,14 @@ def personalcard_share_enable_api(request):
     )
 
 
+@rate_limited(qr_limiter, user_or_ip)
 def personalcard_qr(request, token):
     try:
         PatientProfile.objects.get(share_token=token, share_enabled=True)
     except PatientProfile.DoesNotExist:
         raise Http404
     url = request.build_absolute_uri(reverse("medj:personalcard_public", args=[token]))
-    qr = qrcode.QRCode(
-        version=None,
-        error_correction=qrcode.constants.ERROR_CORRECT_M,
-        box_size=12,
-        border=4,
-    )
-    qr.add_data(url)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white").convert("RGB")
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    response = HttpResponse(buf.getvalue(), content_type="image/png")
-    response["Content-Disposition"] = 'attachment; filename="personal_card.png"'
-    return response
+    return qr_response(request, url, box_size=12, filename="personal_card")
 
 
 def public_personalcard(request, token):
@@ -156,11 +148,10 @@ def personalcard_public_png(request, token):
     profile = get_object_or_404(PatientProfile, share_token=token, share_enabled=True)
     html = render_to_string("subpages/personalcard_public.html", {"p": profile})
     try:
-        from weasyprint import HTML
-
-        png_bytes = HTML(string=html, base_url=request.build_absolute_uri("/")).write_png()
+        png_bytes = render_now("png", html, request.build_absolute_uri("/"))
         response = HttpResponse(png_bytes, content_type="image/png")
         response["Content-Disposition"] = 'attachment; filename="personal_card.png"'
         return response
     except Exception:
+        log.exception("personal card PNG render failed")
         return HttpResponse(html, content_type="text/html", status=200)
@@ -2,33 +2,36 @@ from __future__ import annotations
 
 import json
 import time
-from io import BytesIO
 from urllib.parse import urlencode
 
-import qrcode
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.core import signing
-from django.db.models import Q
+from django.core.cache import cache
 from django.http import HttpRequest, JsonResponse, HttpResponseBadRequest, HttpResponse
 from django.shortcuts import render
 from django.urls import reverse
 from django.utils import timezone
-from django.utils.translation import gettext as _
+from django.utils.translation import get_language, gettext as _
 from django.views.decorators.http import require_POST
 
 from records.models import (
     Document,
-    LabIndicator,
-    LabTestMeasurement,
     MedicalCategory,
     MedicalEvent,
     MedicalSpecialty,
     Tag,
     TagKind,
 )
-from .utils import require_patient_profile, parse_date, safe_translated
+from records.management.services.document_facets import facet_panels
+from records.management.services.lab_facets import indicator_facets
+from records.management.services.rate_limit import qr_limiter, rate_limited, user_or_ip
+from records.management.services.record_filters import RecordFilters
+from records.management.services.record_versions import record_version
+from .utils import qr_response, require_patient_profile, safe_translated
 
 _SIGNER_SALT = "medj.share"
+_OPTIONS_CACHE_PREFIX = "shareopts"
 
 
 def _make_token(payload: dict) -> str:
@@ -37,21 +40,28 @@ def _make_token(payload: dict) -> str:
     return s.sign(data)
 
 
-def share_document_page(request: HttpRequest) -> HttpResponse:
-    patient = require_patient_profile(request.user)
-
+def _build_share_options(user, patient) -> dict:
     def _sorted(items):
         return sorted(
             items,
             key=lambda item: (item.get("name") or item.get("label") or "").lower(),
         )
 
-    specialties_qs = (
-        MedicalSpecialty.objects.filter(
-            Q(events__patient=patient) | Q(documents__owner=request.user)
-        )
-        .distinct()
+    panels = facet_panels(user, ("tag",))
+    # The document's own specialty/category, as the documents filter matches them;
+    # the facet counters follow the event instead (casefiles).
+    facets = MedicalEvent.objects.filter(patient=patient).values_list("specialty_id", "category_id").union(
+        Document.objects.filter(owner=user).values_list("specialty_id", "category_id")
     )
+    specialty_ids = set()
+    category_ids = set()
+    for specialty_id, category_id in facets:
+        if specialty_id:
+            specialty_ids.add(specialty_id)
+        if category_id:
+            category_ids.add(category_id)
+
+    specialties_qs = MedicalSpecialty.objects.filter(id__in=specialty_ids).prefetch_related("translations")
     specialty_options = _sorted(
         [
             {
@@ -62,12 +72,7 @@ def share_document_page(request: HttpRequest) -> HttpResponse:
         ]
     )
 
-    categories_qs = (
-        MedicalCategory.objects.filter(
-            Q(events__patient=patient) | Q(documents__owner=request.user)
-        )
-        .distinct()
-    )
+    categories_qs = MedicalCategory.objects.filter(id__in=category_ids).prefetch_related("translations")
     category_options = _sorted(
         [
             {
@@ -81,6 +86,7 @@ def share_document_page(request: HttpRequest) -> HttpResponse:
     events_qs = (
         MedicalEvent.objects.filter(patient=patient)
         .select_related("specialty", "category")
+        .prefetch_related("specialty__translations", "category__translations")
         .order_by("-event_date", "-id")
     )
     event_options = [
@@ -102,22 +108,14 @@ def share_document_page(request: HttpRequest) -> HttpResponse:
     ]
 
     indicator_labels = {}
-    indicator_tag_qs = (
-        Tag.objects.filter(kind=TagKind.INDICATOR, documents__owner=request.user)
-        .distinct()
-    )
+    indicator_tag_qs = Tag.objects.filter(
+        kind=TagKind.INDICATOR, id__in=[int(k) for k in panels["tag"]]
+    ).prefetch_related("translations")
     for tag in indicator_tag_qs:
         indicator_labels[tag.slug] = safe_translated(tag) or tag.slug
 
-    indicator_qs = (
-        LabIndicator.objects.filter(measurements__medical_event__patient=patient)
-        .distinct()
-    )
-    for indicator in indicator_qs:
-        indicator_labels.setdefault(
-            indicator.slug,
-            safe_translated(indicator) or indicator.slug,
-        )
+    for facet in indicator_facets(patient):
+        indicator_labels.setdefault(facet["slug"], facet["label"])
 
     indicator_options = _sorted(
         [
@@ -129,13 +127,29 @@ def share_document_page(request: HttpRequest) -> HttpResponse:
         ]
     )
 
-    context = {
+    return {
         "specialty_options": specialty_options,
         "category_options": category_options,
         "event_options": event_options,
         "indicator_options": indicator_options,
     }
-    return render(request, "main/share.html", context)
+
+
+def _share_options(user, patient) -> dict:
+    """Return the share-page option lists from the per-user snapshot cache."""
+
+    lang = (get_language() or "").lower()
+    key = f"{_OPTIONS_CACHE_PREFIX}:{user.pk}:{lang}:{record_version(user)}"
+    options = cache.get(key)
+    if options is None:
+        options = _build_share_options(user, patient)
+        cache.set(key, options, timeout=getattr(settings, "SHARE_OPTIONS_CACHE_TIMEOUT", 3600))
+    return options
+
+
+def share_document_page(request: HttpRequest) -> HttpResponse:
+    patient = require_patient_profile(request.user)
+    return render(request, "main/share.html", _share_options(request.user, patient))
 
 
 def share_view(request: HttpRequest, token: str) -> HttpResponse:
@@ -186,87 +200,17 @@ def create_download_links(request: HttpRequest) -> JsonResponse:
     hours_labs = clamp_hours(data.get("hours_labs", 24), 24)
     hours_csv = clamp_hours(data.get("hours_csv", 24), 24)
 
-    filters = data.get("filters") or {}
-    start_raw = (data.get("start_date") or "").strip()
-    end_raw = (data.get("end_date") or "").strip()
-    start_dt = parse_date(start_raw) if start_raw else None
-    end_dt = parse_date(end_raw) if end_raw else None
-
     patient = require_patient_profile(request.user)
-
-    def as_int_list(value):
-        if isinstance(value, (list, tuple)):
-            items = value
-        elif value in (None, ""):
-            items = []
-        else:
-            items = [value]
-        out = []
-        for item in items:
-            try:
-                out.append(int(item))
-            except (TypeError, ValueError):
-                continue
-        return out
-
-    category_ids = as_int_list(filters.get("category"))
-    specialty_ids = as_int_list(filters.get("specialty"))
-    event_ids = as_int_list(filters.get("event"))
-    indicator_raw = filters.get("indicator")
-    if isinstance(indicator_raw, (list, tuple)):
-        indicator_slugs = [str(v).strip() for v in indicator_raw if str(v).strip()]
-    elif indicator_raw:
-        indicator_slugs = [str(indicator_raw).strip()]
-    else:
-        indicator_slugs = []
-
-    indicator_event_ids = []
-    if indicator_slugs:
-        indicator_event_ids = list(
-            LabTestMeasurement.objects.filter(
-                medical_event__patient=patient,
-                indicator__slug__in=indicator_slugs,
-            )
-            .values_list("medical_event_id", flat=True)
-            .distinct()
-        )
-
-    docs_qs = (
-        Document.objects.filter(owner=request.user)
-        .select_related("doc_type")
-        .prefetch_related("tags")
-        .order_by("-uploaded_at")
+    record_filters = RecordFilters.from_payload(
+        data.get("filters"), data.get("start_date"), data.get("end_date")
     )
-    if category_ids:
-        docs_qs = docs_qs.filter(category_id__in=category_ids)
-    if specialty_ids:
-        docs_qs = docs_qs.filter(specialty_id__in=specialty_ids)
-    if event_ids:
-        docs_qs = docs_qs.filter(medical_event_id__in=event_ids)
-    if indicator_slugs:
-        indicator_filter = Q(tags__slug__in=indicator_slugs) | Q(
-            medical_event__labtests__indicator__slug__in=indicator_slugs
-        )
-        if indicator_event_ids:
-            indicator_filter = indicator_filter | Q(medical_event_id__in=indicator_event_ids)
-        docs_qs = docs_qs.filter(indicator_filter)
-    if start_dt:
-        docs_qs = docs_qs.filter(
-            Q(uploaded_at__date__gte=start_dt)
-            | Q(document_date__gte=start_dt)
-            | Q(medical_event__event_date__gte=start_dt)
-        )
-    if end_dt:
-        docs_qs = docs_qs.filter(
-            Q(uploaded_at__date__lte=end_dt)
-            | Q(document_date__lte=end_dt)
-            | Q(medical_event__event_date__lte=end_dt)
-        )
-    docs_qs = docs_qs.distinct()
+    counts = record_filters.counts(request.user, patient)
+    docs_total = counts["documents"]
+    labs_total = counts["labs"]
+    events_total = counts["events"]
 
-    docs_total = docs_qs.count()
     doc_items = []
-    for doc in docs_qs[:25]:
+    for doc in record_filters.preview_documents(request.user) if docs_total else []:
         detail_url = request.build_absolute_uri(
             reverse("medj:document_detail", args=[doc.id])
         )
@@ -288,55 +232,13 @@ def create_download_links(request: HttpRequest) -> JsonResponse:
             }
         )
 
-    lab_qs = LabTestMeasurement.objects.filter(medical_event__patient=patient)
-    if category_ids:
-        lab_qs = lab_qs.filter(medical_event__category_id__in=category_ids)
-    if specialty_ids:
-        lab_qs = lab_qs.filter(medical_event__specialty_id__in=specialty_ids)
-    if event_ids:
-        lab_qs = lab_qs.filter(medical_event_id__in=event_ids)
-    if indicator_slugs:
-        lab_qs = lab_qs.filter(indicator__slug__in=indicator_slugs)
-    if start_dt:
-        lab_qs = lab_qs.filter(measured_at__date__gte=start_dt)
-    if end_dt:
-        lab_qs = lab_qs.filter(measured_at__date__lte=end_dt)
-    labs_total = lab_qs.count()
-
-    events_qs = MedicalEvent.objects.filter(patient=patient)
-    if category_ids:
-        events_qs = events_qs.filter(category_id__in=category_ids)
-    if specialty_ids:
-        events_qs = events_qs.filter(specialty_id__in=specialty_ids)
-    if event_ids:
-        events_qs = events_qs.filter(id__in=event_ids)
-    if indicator_event_ids:
-        events_qs = events_qs.filter(id__in=indicator_event_ids)
-    if start_dt:
-        events_qs = events_qs.filter(event_date__gte=start_dt)
-    if end_dt:
-        events_qs = events_qs.filter(event_date__lte=end_dt)
-    events_total = events_qs.distinct().count()
-
-    base_params = {}
-    if start_dt:
-        base_params["start_date"] = start_dt.isoformat()
-    if end_dt:
-        base_params["end_date"] = end_dt.isoformat()
-    if specialty_ids:
-        base_params["specialty"] = [str(s) for s in specialty_ids]
-    if category_ids:
-        base_params["category"] = [str(c) for c in category_ids]
-    if event_ids:
-        base_params["event"] = [str(e) for e in event_ids]
-    if indicator_slugs:
-        base_params["indicator"] = indicator_slugs
+    base_params = record_filters.as_params()
 
     now = int(time.time())
     urls = {"pdf_events_url": "", "pdf_labs_url": "", "csv_url": ""}
     if generate_events:
         pdf_events_path = reverse("medj:print_pdf")
-        payload_events = {"k": "print_pdf", "exp": now + hours_events * 3600, "labs": 0}
+        payload_events = {"k": "print_pdf", "exp": now + hours_events * 3600, "labs": 0, "u": request.user.pk, "f": base_params}
         token_events = _make_token(payload_events)
         qs_events = dict(base_params)
         qs_events["t"] = token_events
@@ -344,7 +246,7 @@ def create_download_links(request: HttpRequest) -> JsonResponse:
         urls["pdf_events_url"] = events_url
     if generate_labs:
         pdf_labs_path = reverse("medj:print_pdf")
-        payload_labs = {"k": "print_pdf", "exp": now + hours_labs * 3600, "labs": 1}
+        payload_labs = {"k": "print_pdf", "exp": now + hours_labs * 3600, "labs": 1, "u": request.user.pk, "f": base_params}
         token_labs = _make_token(payload_labs)
         qs_labs = dict(base_params)
         qs_labs["labs"] = 1
@@ -353,7 +255,7 @@ def create_download_links(request: HttpRequest) -> JsonResponse:
         urls["pdf_labs_url"] = labs_url
     if generate_csv:
         csv_path = reverse("medj:print_csv")
-        payload_csv = {"k": "print_csv", "exp": now + hours_csv * 3600}
+        payload_csv = {"k": "print_csv", "exp": now + hours_csv * 3600, "u": request.user.pk, "f": base_params}
         token_csv = _make_token(payload_csv)
         qs_csv = dict(base_params)
         qs_csv["t"] = token_csv
@@ -392,6 +294,7 @@ def create_share_token(request: HttpRequest) -> JsonResponse:
     return create_download_links(request)
 
 
+@rate_limited(qr_limiter, user_or_ip)
 def share_qr(request: HttpRequest, token=None) -> HttpResponse:
     if request.method == "POST":
         try:
@@ -403,11 +306,7 @@ def share_qr(request: HttpRequest, token=None) -> HttpResponse:
         url = (request.GET.get("url") or "").strip()
     if not url:
         return HttpResponseBadRequest("missing url")
-    img = qrcode.make(url)
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    return HttpResponse(buf.read(), content_type="image/png")
+    return qr_response(request, url)
 
 
 def qr_for_url(request: HttpRequest) -> HttpResponse:
@@ -1,10 +1,8 @@
-import io
 import json
 import secrets
 from datetime import timedelta
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.hashers import make_password, check_password
-from django.core.cache import cache
 from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, Http404
 from django.shortcuts import render, get_object_or_404, redirect
 from django.utils.timezone import now
@@ -14,11 +12,20 @@ from django.conf import settings
 from django.urls import reverse
 import logging
 from records.models import Document, MedicalEvent, ShareLink
-
-try:
-    import qrcode
-except Exception:
-    qrcode = None
+from records.management.services.qr_codes import available as qr_available
+from records.management.services.rate_limit import (
+    client_ip,
+    qr_limiter,
+    rate_limit_headers,
+    rate_limited,
+    share_create_limiter,
+    share_password_limiter,
+    too_many_requests,
+    user_or_ip,
+)
+from records.management.services.share_lifecycle import active_links, revoke_link
+from records.management.services.share_payload import link_scope, render_share_body
+from .utils import qr_response
 
 log = logging.getLogger("records.share")
 
@@ -30,28 +37,13 @@ def _abs_url(request, path):
     return base + path.lstrip("/")
 
 
-def _rate_limit_key(user_id):
-    return f"share_create_rl_{user_id}"
-
-
-def _rate_limited(user_id, max_per_window=10, window_seconds=300):
-    k = _rate_limit_key(user_id)
-    v = cache.get(k)
-    if not v:
-        cache.set(k, 1, timeout=window_seconds)
-        return False
-    if v >= max_per_window:
-        return True
-    cache.incr(k, 1)
-    return False
-
-
 @login_required
 @csrf_exempt
 @require_POST
 def share_create(request):
-    if _rate_limited(request.user.id):
-        return HttpResponseBadRequest("rate_limited")
+    limit = share_create_limiter.hit(f"u{request.user.id}")
+    if not limit.allowed:
+        return too_many_requests(limit)
     try:
         data = json.loads(request.body.decode("utf-8"))
     except Exception:
@@ -109,25 +101,6 @@ def _session_pw_flag(token):
     return f"share_pw_ok_{token}"
 
 
-def _check_expired(sl):
-    return bool(sl.expires_at and sl.expires_at < now())
-
-
-def _get_scope(sl):
-    v = (sl.scope or "full").lower()
-    return v if v in ("full", "summary", "labs") else "full"
-
-
-def _get_objects(sl):
-    if sl.object_type == "event":
-        event = get_object_or_404(MedicalEvent, id=sl.object_id)
-        document = None
-    else:
-        document = get_object_or_404(Document, id=sl.object_id)
-        event = getattr(document, "medical_event", None)
-    return event, document
-
-
 def _need_password(sl, request):
     if not sl.password_hash:
         return False
@@ -140,40 +113,39 @@ def _set_password_ok(sl, request):
     request.session.modified = True
 
 
-def _labs_for_event(ev):
-    try:
-        qs = getattr(ev, "lab_measurements", None)
-        if qs is None:
-            qs = getattr(ev, "labtests", None)
-        if qs is None:
-            return []
-        return list(qs.select_related("indicator").order_by("measured_at", "id"))
-    except Exception:
-        return []
-
-
-def _render_public(request, sl, need_password=False, wrong_password=False):
-    scope = _get_scope(sl)
-    event, document = _get_objects(sl)
-    ctx = {"share": sl, "event": event, "document": document, "need_password": need_password, "wrong_password": wrong_password, "scope": scope, "labs": _labs_for_event(event) if event else []}
-    return render(request, "subpages/share_public.html", ctx)
+def _render_public(request, sl, need_password=False, wrong_password=False, limit=None):
+    ctx = {
+        "share": sl,
+        "scope": link_scope(sl),
+        "need_password": need_password,
+        "wrong_password": wrong_password,
+        "rate_limited": bool(limit and not limit.allowed),
+    }
+    if not need_password:
+        ctx["body"] = render_share_body(sl)
+        if ctx["body"] is None:
+            raise Http404()
+    response = render(request, "subpages/share_public.html", ctx, status=429 if ctx["rate_limited"] else 200)
+    return rate_limit_headers(response, limit) if limit else response
 
 
 def share_public(request, token):
-    sl = get_object_or_404(ShareLink, token=token, status="active")
-    if _check_expired(sl):
-        raise Http404()
+    sl = get_object_or_404(active_links(), token=token)
     if request.method == "POST":
         pw = request.POST.get("password") or ""
         if not sl.password_hash:
             return redirect(reverse("medj:share_public", kwargs={"token": token}))
+        limit = share_password_limiter.hit(f"{token}:{client_ip(request)}")
+        if not limit.allowed:
+            log.info("share_access user=anon token=%s ok=0 rate_limited=1", token)
+            return _render_public(request, sl, need_password=True, limit=limit)
         if check_password(pw, sl.password_hash):
             _set_password_ok(sl, request)
             log.info("share_access user=anon token=%s ok=1", token)
             return redirect(reverse("medj:share_public", kwargs={"token": token}))
         else:
             log.info("share_access user=anon token=%s ok=0", token)
-            return _render_public(request, sl, need_password=True, wrong_password=True)
+            return _render_public(request, sl, need_password=True, wrong_password=True, limit=limit)
     if _need_password(sl, request):
         return _render_public(request, sl, need_password=True, wrong_password=False)
     log.info("share_access user=anon token=%s ok=1", token)
@@ -190,7 +162,7 @@ def share_history(request):
             "token": s.token,
             "object_type": s.object_type,
             "object_id": s.object_id,
-            "scope": _get_scope(s),
+            "scope": link_scope(s),
             "format": s.format,
             "status": s.status,
             "expires_at": s.expires_at.strftime("%d-%m-%Y") if s.expires_at else "",
@@ -204,22 +176,18 @@ def share_history(request):
 @require_POST
 def share_revoke(request, token):
     sl = get_object_or_404(ShareLink, token=token, owner=request.user)
-    sl.status = "revoked"
-    sl.save(update_fields=["status"])
+    revoke_link(sl)
     log.info("share_revoke user=%s token=%s", request.user.id, token)
     return JsonResponse({"ok": True})
 
 
 @require_GET
+@rate_limited(qr_limiter, user_or_ip)
 def share_qr_png(request, token):
-    if qrcode is None:
+    if not qr_available():
         raise Http404()
     get_object_or_404(ShareLink, token=token)
-    url = _abs_url(request, f"s/{token}/")
-    img = qrcode.make(url)
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    return HttpResponse(buf.getvalue(), content_type="image/png")
+    return qr_response(request, _abs_url(request, f"s/{token}/"))
 
 
 @login_required
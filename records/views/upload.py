@@ -3,7 +3,6 @@ from django.http import JsonResponse, HttpResponseBadRequest
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
 from django.urls import reverse
-from django.core.files.base import ContentFile
 from django.utils.text import slugify
 from records.models import (
     DocumentType,
@@ -15,6 +14,10 @@ from records.models import (
     LabIndicator,
     LabTestMeasurement,
 )
+from records.management.services.ingest import find_duplicate, hashing_base64, hashing_upload
+from records.management.services.lab_facets import invalidate_indicator_facets
+from records.management.services.record_versions import bump_record_version
+from records.management.services.lab_series import refresh_series
 from records.utils.analysis import (
     compose_analysis_text,
     ensure_minimum_summary,
@@ -23,15 +26,13 @@ from records.utils.analysis import (
     word_count,
 )
 
-import base64
-import binascii
 import logging
 from decimal import Decimal
 import math
-import os, requests, json, re, time, hashlib, unicodedata
+import os, requests, json, re, time, unicodedata
 from datetime import datetime, timedelta
 from django.utils import timezone
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 
 __all__ = [
     "upload_ocr",
@@ -224,15 +225,12 @@ def _decode_base64_file(payload):
     file_b64 = (payload.get("file_b64") or "").strip()
     if not file_b64:
         return None, None, "missing_file"
+    name = payload.get("file_name") or "document.bin"
+    mime = (payload.get("file_mime") or "").strip() or None
     try:
-        file_bytes = base64.b64decode(file_b64)
-    except (binascii.Error, ValueError):
+        file_obj = hashing_base64(file_b64, name, mime)
+    except ValueError:
         return None, None, "invalid_file"
-    name = payload.get("file_name") or "document.bin"
-    file_obj = ContentFile(file_bytes, name=name)
-    mime = (payload.get("file_mime") or "").strip()
-    if mime:
-        file_obj.content_type = mime
     kind = (payload.get("file_kind") or "").strip().lower()
     return file_obj, (kind or None), None
 
@@ -379,6 +377,9 @@ def _persist_lab_measurements(event, all_rows, fallback_dt):
     if not objs:
         return 0
     LabTestMeasurement.objects.bulk_create(objs)
+    refresh_series(event.patient_id, {obj.indicator_id for obj in objs})
+    invalidate_indicator_facets(event.patient_id)
+    bump_record_version(event.owner_id)
     return len(objs)
 
 
@@ -730,7 +731,7 @@ def _call_flask_ocr(dj_file, ctx):
     url = os.getenv("OCR_API_URL") or os.getenv("OCR_SERVICE_URL") or "http://ocrapi:5000/ocr"
     timeout = float(os.getenv("OCR_HTTP_TIMEOUT", "90"))
     dj_file.seek(0)
-    files = {"file": (dj_file.name, dj_file.read(), dj_file.content_type or "application/octet-stream")}
+    files = {"file": (dj_file.name, dj_file, dj_file.content_type or "application/octet-stream")}
     data = {
         "event_type": ctx.get("event_type", ""),
         "category_name": ctx.get("category_name", ""),
@@ -805,16 +806,25 @@ def _call_vision_ocr_bytes(blob):
         return "", {"engine": "Google Cloud Vision", "error": "failed"}
 
 def _ocr_pipeline(dj_file, ctx):
-    dj_file.seek(0)
-    vb = dj_file.read()
-    vision_txt, vision_meta = "", {}
     if _vision_available():
-        vision_txt, vision_meta = _call_vision_ocr_bytes(vb)
-    if vision_txt:
-        return vision_txt, vision_meta
-    dj_file.seek(0)
+        dj_file.seek(0)
+        vision_txt, vision_meta = _call_vision_ocr_bytes(dj_file.read())
+        if vision_txt:
+            return vision_txt, vision_meta
     return _call_flask_ocr(dj_file, ctx)
 
+def _duplicate_response(document, digest):
+    documents_url = reverse("medj:documents")
+    return JsonResponse(
+        {
+            "error": "duplicate",
+            "document_id": document.id,
+            "content_hash": digest,
+            "redirect_url": f"{documents_url}?q={digest}",
+        },
+        status=409,
+    )
+
 def _anonymize(t):
     t = re.sub(r"\b\d{10}\b", "<ID>", t or "")
     t = re.sub(r"\b(?:\+?\d{3}[-.\s]?)?\d{3}[-.\s]?\d{3}[-.\s]?\d{3,4}\b", "<PHONE>", t)
@@ -863,6 +873,11 @@ def upload_ocr(request):
     )
     cat_name = _id_to_name(MedicalCategory, cat_id)
     ctx = {"event_type": doc_name, "specialty_name": spec_name, "category_name": cat_name}
+    for f in files:
+        digest = hashing_upload(f).consume().sha256
+        existing_doc = find_duplicate(request.user, digest)
+        if existing_doc:
+            return _duplicate_response(existing_doc, digest)
     merged = ""
     meta_list = []
     for f in files:
@@ -1014,9 +1029,9 @@ def upload_confirm(request):
             return HttpResponseBadRequest(error or "invalid_file")
         data_source = payload
     else:
-        upload_file = request.FILES.get("file")
-        if not upload_file:
+        if not request.FILES.get("file"):
             return HttpResponseBadRequest("Missing file")
+        upload_file = hashing_upload(request.FILES["file"])
         data_source = request.POST
 
     def _data_get(key, default=""):
@@ -1127,146 +1142,122 @@ def upload_confirm(request):
         or _parse_date(data_section.get("date_created"))
     )
 
-    hasher = hashlib.sha256()
-    try:
-        for chunk in upload_file.chunks():
-            hasher.update(chunk)
-    except Exception:
-        data_bytes = upload_file.read()
-        hasher.update(data_bytes)
-    digest = hasher.hexdigest()
-    try:
-        upload_file.seek(0)
-    except Exception:
-        pass
-
+    # Hash the upload (from memory, the temporary upload file or the base64
+    # text) and dedup on the digest before anything is written to storage.
+    digest = upload_file.consume().sha256
     documents_url = reverse("medj:documents")
     redirect_to_hash = f"{documents_url}?q={digest}" if digest else documents_url
 
-    existing_doc = (
-        Document.objects.filter(owner=request.user, content_hash=digest)
-        .order_by("-id")
-        .first()
-    )
-    if not existing_doc:
-        existing_doc = (
-            Document.objects.filter(owner=request.user, content_hash__isnull=True, sha256=digest)
-            .order_by("-id")
-            .first()
-        )
+    existing_doc = find_duplicate(request.user, digest)
     if existing_doc:
-        return JsonResponse(
-            {
-                "error": "duplicate",
-                "document_id": existing_doc.id,
-                "content_hash": digest,
-                "redirect_url": redirect_to_hash,
-            },
-            status=409,
-        )
-
-    patient, _ = PatientProfile.objects.get_or_create(user=request.user)
-
-    if not event:
-        event_summary = final_summary[:255] if final_summary else (_safe_name(doc_type) or "Документ")
-        event = MedicalEvent.objects.create(
-            patient=patient,
-            owner=request.user,
-            specialty=specialty,
-            category=category,
-            doc_type=doc_type,
-            event_date=event_date,
-            summary=event_summary,
-        )
+        return _duplicate_response(existing_doc, digest)
 
-    doc = Document(
-        owner=request.user,
-        medical_event=event,
-        specialty=specialty,
-        category=category,
-        doc_type=doc_type,
-        document_date=document_date,
-        date_created=creation_date,
-        doc_kind=file_kind or _guess_file_kind(upload_file),
-        file_size=getattr(upload_file, "size", None) or None,
-        file_mime=getattr(upload_file, "content_type", None) or None,
-        original_ocr_text=ocr_text,
-        summary=final_summary,
-        analysis_html=analysis_html or None,
-        analysis_text=analysis_text_compiled or None,
-        notes=json.dumps(
-            {
-                "analysis": analysis_payload,
-                "ocr_meta": ocr_meta,
-            },
-            ensure_ascii=False,
-        ),
-        content_hash=digest,
-        sha256=digest,
-    )
+    file_field = Document._meta.get_field("file")
     file_name = getattr(upload_file, "name", "") or "document.bin"
-    doc.file.save(file_name, upload_file, save=False)
+    stored_name = file_field.storage.save(
+        file_field.generate_filename(None, file_name), upload_file, max_length=file_field.max_length
+    )
+
+    # The event and the document are written in one transaction: a concurrent
+    # duplicate or any failure rolls both back and removes the stored file, so
+    # a failed confirm never leaves an orphan record or file behind.
     try:
-        doc.save()
-    except IntegrityError:
-        dupe = (
-            Document.objects.filter(owner=request.user, content_hash=digest)
-            .order_by("-id")
-            .first()
-        )
-        if dupe:
+        with transaction.atomic():
+            patient, _ = PatientProfile.objects.get_or_create(user=request.user)
+
+            if not event:
+                event_summary = final_summary[:255] if final_summary else (_safe_name(doc_type) or "Документ")
+                event = MedicalEvent.objects.create(
+                    patient=patient,
+                    owner=request.user,
+                    specialty=specialty,
+                    category=category,
+                    doc_type=doc_type,
+                    event_date=event_date,
+                    summary=event_summary,
+                )
+
+            doc = Document(
+                owner=request.user,
+                medical_event=event,
+                specialty=specialty,
+                category=category,
+                doc_type=doc_type,
+                document_date=document_date,
+                date_created=creation_date,
+                doc_kind=file_kind or _guess_file_kind(upload_file),
+                file=stored_name,
+                file_size=upload_file.size or None,
+                file_mime=upload_file.content_type or None,
+                original_ocr_text=ocr_text,
+                summary=final_summary,
+                analysis_html=analysis_html or None,
+                analysis_text=analysis_text_compiled or None,
+                notes=json.dumps(
+                    {
+                        "analysis": analysis_payload,
+                        "ocr_meta": ocr_meta,
+                    },
+                    ensure_ascii=False,
+                ),
+                content_hash=digest,
+                sha256=digest,
+            )
+            try:
+                with transaction.atomic():
+                    doc.save()
+            except IntegrityError:
+                dupe = find_duplicate(request.user, digest)
+                if not dupe:
+                    raise
+                transaction.set_rollback(True)
+                file_field.storage.delete(stored_name)
+                return _duplicate_response(dupe, digest)
+
+            if not doc.date_created and doc.uploaded_at:
+                doc.date_created = doc.uploaded_at.date()
+                doc.save(update_fields=["date_created"])
+
+            lab_rows = []
+            raw_labs = _data_get("blood_test_results")
+            if raw_labs:
+                lab_rows.extend(_lab_rows_from_payload(_json_load(raw_labs)))
+            if isinstance(analysis_payload.get("blood_test_results"), list):
+                lab_rows.extend(_lab_rows_from_payload(analysis_payload.get("blood_test_results")))
+            if isinstance(data_section.get("blood_test_results"), list):
+                lab_rows.extend(_lab_rows_from_payload(data_section.get("blood_test_results")))
+            fallback_dt = _event_fallback_dt(event.event_date if event else None)
+            labs_created = _persist_lab_measurements(event, lab_rows, fallback_dt)
+
+            detail_bits = [f"Документ №{doc.id}"]
+            if event:
+                detail_bits.append(f"Събитие №{event.id}")
+
+            meta = {
+                "engine": "MedJ Upload",
+                "detail": " • ".join(detail_bits),
+                "document_id": doc.id,
+            }
+            if event:
+                meta["event_id"] = event.id
+            if labs_created:
+                meta["labs_saved"] = labs_created
+
             return JsonResponse(
                 {
-                    "error": "duplicate",
-                    "document_id": dupe.id,
+                    "ok": True,
+                    "document_id": doc.id,
+                    "event_id": event.id if event else None,
+                    "meta": meta,
+                    "file_url": doc.file.url if doc.file else "",
                     "content_hash": digest,
                     "redirect_url": redirect_to_hash,
-                },
-                status=409,
+                }
             )
+    except Exception:
+        file_field.storage.delete(stored_name)
         raise
 
-    if not doc.date_created and doc.uploaded_at:
-        doc.date_created = doc.uploaded_at.date()
-        doc.save(update_fields=["date_created"])
-
-    lab_rows = []
-    raw_labs = _data_get("blood_test_results")
-    if raw_labs:
-        lab_rows.extend(_lab_rows_from_payload(_json_load(raw_labs)))
-    if isinstance(analysis_payload.get("blood_test_results"), list):
-        lab_rows.extend(_lab_rows_from_payload(analysis_payload.get("blood_test_results")))
-    if isinstance(data_section.get("blood_test_results"), list):
-        lab_rows.extend(_lab_rows_from_payload(data_section.get("blood_test_results")))
-    fallback_dt = _event_fallback_dt(event.event_date if event else None)
-    labs_created = _persist_lab_measurements(event, lab_rows, fallback_dt)
-
-    detail_bits = [f"Документ №{doc.id}"]
-    if event:
-        detail_bits.append(f"Събитие №{event.id}")
-
-    meta = {
-        "engine": "MedJ Upload",
-        "detail": " • ".join(detail_bits),
-        "document_id": doc.id,
-    }
-    if event:
-        meta["event_id"] = event.id
-    if labs_created:
-        meta["labs_saved"] = labs_created
-
-    return JsonResponse(
-        {
-            "ok": True,
-            "document_id": doc.id,
-            "event_id": event.id if event else None,
-            "meta": meta,
-            "file_url": doc.file.url if doc.file else "",
-            "content_hash": digest,
-            "redirect_url": redirect_to_hash,
-        }
-    )
-
 @login_required
 @require_http_methods(["GET"])
 def upload_preview(request):
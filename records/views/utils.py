@@ -8,10 +8,13 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
+from django.http import HttpResponse, HttpResponseNotModified
 from django.utils import timezone
+from django.utils.http import parse_etags
 
 
 from ..models import PatientProfile, Tag, DocumentTag
+from ..management.services.qr_codes import FORMATS as QR_FORMATS, qr_bytes, qr_etag, qr_format
 
 User = get_user_model()
 
@@ -29,6 +32,25 @@ def safe_translated(obj, field="name"):
     except Exception:
         return getattr(obj, field, "") or ""
 
+def qr_response(request, data: str, *, box_size=10, border=4, filename: str | None = None):
+    """QR image response with a strong ETag; ``?format=svg`` selects SVG output.
+
+    The tokens behind these codes can be revoked, so clients must revalidate
+    on every use (``no-cache``); an unchanged image costs only a 304.
+    """
+
+    fmt = qr_format(request.GET.get("format"))
+    etag = qr_etag(data, fmt, box_size, border)
+    if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+        resp = HttpResponseNotModified()
+    else:
+        resp = HttpResponse(qr_bytes(data, fmt, box_size, border), content_type=QR_FORMATS[fmt])
+        if filename:
+            resp["Content-Disposition"] = f'attachment; filename="{filename}.{fmt}"'
+    resp["ETag"] = etag
+    resp["Cache-Control"] = "private, no-cache"
+    return resp
+
 def get_patient(user):
     return PatientProfile.objects.filter(user=user).first()
 
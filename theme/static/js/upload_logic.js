@@ -990,6 +990,19 @@ function setWorkText(t, opts = {}) {
   }
 }
 
+function showDuplicate(data) {
+  const docId = data?.document_id;
+  const historyUrl = data?.redirect_url || CONFIG.history_url || CONFIG.documents_url || "";
+  const label = data?.redirect_url ? "Виж в историята" : (CONFIG.history_url ? "История" : "Документи");
+  const linkHtml = historyUrl ? `<a class="underline font-semibold" href="${escapeHtml(historyUrl)}">${escapeHtml(label)}</a>` : "";
+  const parts = [`Файлът вече е качен${docId ? ` (Документ №${docId})` : ""}.`];
+  if (linkHtml) parts.push(linkHtml);
+  showError(parts.join(" "), { allowHTML: true });
+  DUPLICATE_DETECTED = true;
+  ANALYZED_READY = false;
+  updateButtons();
+}
+
 async function doOCR() {
   clearError();
   clearStatus();
@@ -1008,6 +1021,10 @@ async function doOCR() {
   setBusy(true);
   try {
     const res = await fetch(API.ocr, { method: "POST", body: fd, credentials: "same-origin", headers: { "X-CSRFToken": getCSRF() } });
+    if (res.status === 409) {
+      showDuplicate(await res.json().catch(() => ({})));
+      return;
+    }
     if (!res.ok) throw new Error("ocr_failed");
     const data = await res.json();
     const rawText = data?.ocr_text ?? data?.text ?? "";
@@ -1179,16 +1196,7 @@ async function doConfirm() {
     let data = {};
     try { data = await res.json(); } catch {}
     if (res.status === 409) {
-      const docId = data?.document_id;
-      const historyUrl = data?.redirect_url || CONFIG.history_url || CONFIG.documents_url || "";
-      const label = data?.redirect_url ? "Виж в историята" : (CONFIG.history_url ? "История" : "Документи");
-      const linkHtml = historyUrl ? `<a class="underline font-semibold" href="${escapeHtml(historyUrl)}">${escapeHtml(label)}</a>` : "";
-      const parts = [`Файлът вече е качен${docId ? ` (Документ №${docId})` : ""}.`];
-      if (linkHtml) parts.push(linkHtml);
-      showError(parts.join(" "), { allowHTML: true });
-      DUPLICATE_DETECTED = true;
-      ANALYZED_READY = false;
-      updateButtons();
+      showDuplicate(data);
       return;
     }
     if (!res.ok) throw new Error("confirm_failed");